@@ -0,0 +1,65 @@
+"""
+Microbenchmark for intent routing.
+
+Compares the compiled single-pass router with the previous approach of one
+phrase-list scan per intent, as the number of registered intents grows.
+
+    python bench_intent_router.py
+"""
+import random
+import string
+import timeit
+
+from intent_router import IntentRouter
+
+MESSAGES = [
+    "Can you search for the best ramen places in Chicago?",
+    "add expense 12.50 for lunch",
+    "What's the weather going to be like tomorrow afternoon?",
+    "Please add calendar event for dentist on Friday at 3pm",
+    "Tell me a long story about a dragon who learned to code in Python and Rust.",
+]
+
+
+def random_phrase(rng: random.Random) -> str:
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8))) for _ in range(rng.randint(2, 3)))
+
+
+def build(intent_count: int):
+    rng = random.Random(intent_count)
+    intents = {
+        "calendar": ['add calendar event', 'add a calendar reminder'],
+        "search": ['search for', 'find information about', 'look up'],
+        "expense": ['add expense'],
+    }
+    while len(intents) < intent_count:
+        intents[f"intent_{len(intents)}"] = [random_phrase(rng) for _ in range(3)]
+
+    router = IntentRouter()
+    for name, phrases in intents.items():
+        router.register(name, phrases)
+    router.compile()
+
+    def naive(message):
+        lowered = message.lower()
+        for name, phrases in intents.items():
+            if any(phrase in lowered for phrase in phrases):
+                return name
+        return None
+
+    return router, naive
+
+
+def main():
+    number = 2000
+    print(f"{'intents':>8} {'router us/msg':>14} {'naive us/msg':>13}")
+    for intent_count in (3, 10, 50, 200, 1000):
+        router, naive = build(intent_count)
+        router_time = timeit.timeit(lambda: [router.route(m) for m in MESSAGES], number=number)
+        naive_time = timeit.timeit(lambda: [naive(m) for m in MESSAGES], number=number)
+        per_message = 1e6 / (number * len(MESSAGES))
+        print(f"{intent_count:>8} {router_time * per_message:>14.2f} {naive_time * per_message:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
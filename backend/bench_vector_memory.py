@@ -0,0 +1,63 @@
+"""
+Microbenchmark for vector memory recall.
+
+Fills one owner's partition with random unit vectors and times
+VectorMemory.search end to end (query embedding, dot products, top-k and
+the metadata lookup) as the number of stored messages grows.
+
+    python bench_vector_memory.py
+
+To reproduce the single-core figures, pin it to one core and one BLAS thread:
+
+    OMP_NUM_THREADS=1 OPENBLAS_NUM_THREADS=1 taskset -c 0 python bench_vector_memory.py
+"""
+import asyncio
+import tempfile
+import time
+
+import numpy as np
+
+from vector_memory import VectorMemory, HashingEmbedder
+
+DIM = 256
+QUERIES = ["what did I say about my passport", "dog names", "remind me of the trip budget"]
+
+
+async def fill(memory: VectorMemory, owner: str, count: int) -> None:
+    rng = np.random.default_rng(count)
+    partition = await memory._partition(owner)
+    start = partition.count
+    for offset in range(0, count - start, 50000):
+        block = rng.standard_normal((min(50000, count - start - offset), DIM), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        coarse = block[:, :memory.coarse_dim]
+        coarse = coarse / np.linalg.norm(coarse, axis=1, keepdims=True)
+        for vector, coarse_vector in zip(block, coarse):
+            partition.append(vector, coarse_vector)
+    db = await memory._get_db()
+    await db.executemany(
+        "INSERT OR REPLACE INTO memory_rows (owner, row, conversation_id, role, content) VALUES (?, ?, 'bench', 'user', 'x')",
+        [(owner, row) for row in range(start, count)]
+    )
+    await db.commit()
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        memory = VectorMemory(directory, HashingEmbedder(DIM), dim=DIM, min_score=-1.0)
+        print(f"{'messages':>9} {'search ms':>10}  (two-stage above {memory.exact_search_rows} rows)")
+        for count in (10000, 100000, 300000):
+            await fill(memory, "bench", count)
+            for query in QUERIES:
+                await memory.search("bench", query)  # warm the page cache and the query vectors
+            rounds = 20
+            started = time.perf_counter()
+            for index in range(rounds):
+                await memory.search("bench", QUERIES[index % len(QUERIES)])
+            elapsed = (time.perf_counter() - started) / rounds
+            print(f"{count:>9} {elapsed * 1000:>10.2f}")
+        await memory.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,638 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional
+
+import aiosqlite
+
+from conversation_archive import compress_rows, decompress_rows
+from history_cache import HistoryCache
+from message_writer import MessageWriter
+from metrics import DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseManager:
+    # Schema migrations, applied in order and tracked with PRAGMA user_version.
+    MIGRATIONS = [
+        # 1: history lookups filter on conversation_id and sort by timestamp
+        """
+        CREATE INDEX IF NOT EXISTS idx_conversations_conversation_id_timestamp
+        ON conversations (conversation_id, timestamp);
+        """,
+        # 2: full-text index over message content. Rows that existed before
+        # this migration are indexed by the background backfill, which moves
+        # search_backfill.done_upto towards stop_id; newer rows are indexed by
+        # the triggers. A row is in the index exactly when its id is above
+        # stop_id or at most done_upto, which the delete triggers check so they
+        # never remove a row that was not indexed yet.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+            content,
+            content='conversations',
+            content_rowid='id',
+            tokenize='porter unicode61'
+        );
+        CREATE TABLE IF NOT EXISTS search_backfill (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            done_upto INTEGER NOT NULL,
+            stop_id INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO search_backfill (id, done_upto, stop_id)
+        SELECT 1, 0, COALESCE(MAX(id), 0) FROM conversations;
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+            INSERT INTO conversations_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations
+        WHEN old.id > (SELECT stop_id FROM search_backfill) OR old.id <= (SELECT done_upto FROM search_backfill)
+        BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF content ON conversations
+        WHEN old.id > (SELECT stop_id FROM search_backfill) OR old.id <= (SELECT done_upto FROM search_backfill)
+        BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO conversations_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+        """,
+        # 3: cold storage, one compressed blob of messages per idle conversation
+        """
+        CREATE TABLE IF NOT EXISTS conversation_archive (
+            conversation_id TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            message_count INTEGER NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            last_timestamp DATETIME,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # 4: archived messages stay searchable. Their text only lives in the
+        # compressed blobs, so they get a contentless index of their own plus
+        # the columns a search hit shows. Archives made before this migration
+        # have indexed = 0 until the background backfill reaches them.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS archived_messages_fts USING fts5(
+            content,
+            content='',
+            tokenize='porter unicode61'
+        );
+        CREATE TABLE IF NOT EXISTS archived_messages (
+            id INTEGER PRIMARY KEY,
+            conversation_id TEXT NOT NULL,
+            role TEXT,
+            timestamp DATETIME
+        );
+        CREATE INDEX IF NOT EXISTS idx_archived_messages_conversation_id ON archived_messages (conversation_id);
+        ALTER TABLE conversation_archive ADD COLUMN indexed INTEGER NOT NULL DEFAULT 0;
+        """,
+    ]
+
+    PRAGMAS = [
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -20000",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA mmap_size = 268435456",
+    ]
+
+    def __init__(self, db_path: str = 'chat_history.db'):
+        self.db_path = db_path
+        self._db: Optional[aiosqlite.Connection] = None
+        self.writer = MessageWriter(
+            self._get_db,
+            batch_size=int(os.getenv('CHAT_WRITE_BATCH_SIZE', '200')),
+            flush_interval=float(os.getenv('CHAT_WRITE_FLUSH_MS', '5')) / 1000
+        )
+        self.history_cache = HistoryCache(
+            max_conversations=int(os.getenv('HISTORY_CACHE_CONVERSATIONS', '1000')),
+            max_messages=int(os.getenv('HISTORY_CACHE_MESSAGES', '50000')),
+            ttl=float(os.getenv('HISTORY_CACHE_TTL', '1800'))
+        )
+        self.search_backfill_batch = int(os.getenv('CHAT_SEARCH_BACKFILL_BATCH', '2000'))
+        self._backfill_task: Optional[asyncio.Task] = None
+        self.archive_after = float(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '30')) * 86400
+        self.compact_interval = float(os.getenv('CHAT_COMPACT_INTERVAL', '3600'))
+        self._compact_task: Optional[asyncio.Task] = None
+        self.rehydrated = 0
+        self._init_db()
+
+    def _init_db(self):
+        """Initialize the database with required tables and run pending migrations."""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT,
+                role TEXT,
+                content TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # WAL is persistent, so setting it once here covers every later connection.
+        c.execute("PRAGMA journal_mode = WAL")
+
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(self.MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Applying chat history migration {number}")
+            c.executescript(migration)
+            c.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+        conn.close()
+
+    async def connect(self) -> None:
+        """Open the long-lived connection shared by every request."""
+        if self._db is not None:
+            return
+        self._db = await aiosqlite.connect(self.db_path)
+        for pragma in self.PRAGMAS:
+            await self._db.execute(pragma)
+        self.writer.start()
+        self._backfill_task = asyncio.create_task(self._backfill_search_index())
+        if self.archive_after > 0 and self.compact_interval > 0:
+            self._compact_task = asyncio.create_task(self._compaction_loop())
+        logger.info(f"Opened chat history database {self.db_path}")
+
+    async def close(self) -> None:
+        """Flush queued messages and close the shared connection."""
+        for task in (self._backfill_task, self._compact_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._backfill_task = self._compact_task = None
+        try:
+            await self.writer.stop()
+        finally:
+            if self._db is not None:
+                await self._db.close()
+                self._db = None
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        if self._db is None:
+            await self.connect()
+        return self._db
+
+    async def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """
+        Retrieve conversation history, from the cache when possible.
+
+        Other uvicorn workers write to the same database, so a cached history
+        is only used while SQLite still holds exactly the committed part of it:
+        the same number of rows, and no message older than the latest one the
+        cache has seen missing. Anything else is re-read.
+        """
+        try:
+            db = await self._get_db()
+            if conversation_id in self.history_cache:
+                async with self.writer.lock:
+                    async with db.execute(
+                            "SELECT COUNT(*), MAX(id) FROM conversations WHERE conversation_id = ?", (conversation_id,)
+                    ) as cursor:
+                        committed, latest_id = await cursor.fetchone()
+                    pending = len(self.writer.pending_for(conversation_id))
+                    latest_id = latest_id or 0
+                    cached = self.history_cache.get(
+                        conversation_id,
+                        lambda messages, version: len(messages) - pending == committed and latest_id >= version
+                    )
+                if cached is not None:
+                    # Our own messages committed since then move the version on.
+                    self.history_cache.set_version(conversation_id, latest_id)
+                    return cached
+
+            with DB_SECONDS.time(operation="history_read"):
+                async with self.writer.lock:
+                    await self._rehydrate(db, conversation_id)
+                    async with db.execute("""
+                        SELECT role, content, id
+                        FROM conversations
+                        WHERE conversation_id = ?
+                        ORDER BY timestamp, id
+                    """, (conversation_id,)) as cursor:
+                        rows = await cursor.fetchall()
+                    latest_id = max((row[2] for row in rows), default=0)
+                    # Messages still waiting in the write-behind queue come last.
+                    rows += [(row["role"], row["content"]) for row in self.writer.pending_for(conversation_id)]
+
+                    history = [
+                        {
+                            "isUser": row[0] == "user",
+                            "text": row[1]
+                        }
+                        for row in rows
+                    ]
+                    # No await between the pending snapshot and this put, so no message
+                    # stored in the meantime can be lost from the cached copy.
+                    self.history_cache.put(conversation_id, history, version=latest_id)
+
+            return list(history)
+        except Exception as e:
+            logger.error(f"Error retrieving conversation history: {e}")
+            return []
+
+    async def store_message(self, conversation_id: str, role: str, content: str) -> None:
+        """Queue a message for the next group commit; it is readable immediately."""
+        try:
+            # Make sure the connection, and with it the writer task, is running.
+            await self._get_db()
+            self.writer.enqueue(conversation_id, role, content)
+            self.history_cache.append(conversation_id, {"isUser": role == "user", "text": content})
+        except Exception as e:
+            logger.error(f"Error storing message: {e}")
+
+    async def _rehydrate(self, db: aiosqlite.Connection, conversation_id: str) -> None:
+        """Move an archived conversation back into the hot table. Call with the writer lock held."""
+        async with db.execute(
+                "SELECT codec, data, indexed FROM conversation_archive WHERE conversation_id = ?", (conversation_id,)
+        ) as cursor:
+            archived = await cursor.fetchone()
+        if archived is None:
+            return
+
+        rows = decompress_rows(archived[0], archived[1])
+        try:
+            if archived[2]:
+                await self._unindex_archived(db, rows)
+            # Original ids and timestamps are kept, so ordering and the search
+            # index come back exactly as they were.
+            await db.executemany(
+                "INSERT INTO conversations (id, conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(row[0], conversation_id, row[1], row[2], row[3]) for row in rows]
+            )
+            await db.execute("DELETE FROM conversation_archive WHERE conversation_id = ?", (conversation_id,))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        self.rehydrated += 1
+        logger.info(f"Rehydrated archived conversation {conversation_id} ({len(rows)} messages)")
+
+    async def compact_idle_conversations(self, idle_seconds: Optional[float] = None, batch_size: int = 50) -> Dict[str, Any]:
+        """
+        Move conversations idle for `idle_seconds` into the compressed archive.
+
+        Each conversation becomes one blob in conversation_archive and its rows
+        leave the hot table until the conversation is read again; their search
+        index entries move to the archive's index, so they can still be found.
+        Conversations whose blob would not be smaller than their text stay as
+        they are. Returns what was archived and `reclaimed_bytes`, the net
+        drop in database pages in use: it counts the blobs and the archive's
+        search index that were added, not just the rows that were deleted.
+        SQLite reuses the freed pages for new rows, so the file stops growing
+        rather than shrinking.
+        """
+        idle_seconds = self.archive_after if idle_seconds is None else idle_seconds
+        report = {"conversations": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0, "reclaimed_bytes": 0}
+        db = await self._get_db()
+
+        async with db.execute("SELECT done_upto >= stop_id FROM search_backfill") as cursor:
+            row = await cursor.fetchone()
+        if row is not None and not row[0]:
+            # Rehydrated rows are re-indexed by the insert trigger, which would
+            # double-index any row the backfill has not reached yet.
+            logger.info("Skipping conversation compaction until the search backfill finishes")
+            return report
+
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=idle_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+        # Conversations are walked in id order, so the ones left in place
+        # (not worth compressing, or written to meanwhile) are not picked again.
+        after = ''
+        while True:
+            async with db.execute("""
+                SELECT conversation_id
+                FROM conversations
+                WHERE conversation_id > ?
+                GROUP BY conversation_id
+                HAVING MAX(timestamp) < ?
+                ORDER BY conversation_id
+                LIMIT ?
+            """, (after, cutoff, batch_size)) as cursor:
+                candidates = [row[0] for row in await cursor.fetchall()]
+            if not candidates:
+                break
+            after = candidates[-1]
+
+            async with self.writer.lock:
+                in_use = await self._bytes_in_use(db)
+                try:
+                    for conversation_id in candidates:
+                        if self.writer.pending_for(conversation_id):
+                            continue
+                        archived = await self._archive(db, conversation_id, cutoff)
+                        if archived is None:
+                            continue
+                        messages, raw_bytes, compressed_bytes = archived
+                        report["conversations"] += 1
+                        report["messages"] += messages
+                        report["raw_bytes"] += raw_bytes
+                        report["compressed_bytes"] += compressed_bytes
+                        self.history_cache.invalidate(conversation_id)
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+                # Measured under the writer lock, so no other write is counted.
+                report["reclaimed_bytes"] += in_use - await self._bytes_in_use(db)
+            # Let requests run between batches.
+            await asyncio.sleep(0)
+
+        if report["conversations"]:
+            logger.info(
+                f"Archived {report['conversations']} idle conversations ({report['messages']} messages): "
+                f"{report['raw_bytes']} bytes of text stored in {report['compressed_bytes']}, "
+                f"{report['reclaimed_bytes']} bytes reclaimed"
+            )
+        return report
+
+    @staticmethod
+    async def _bytes_in_use(db: aiosqlite.Connection) -> int:
+        """Size of the database pages holding data, free pages excluded."""
+        async with db.execute("""
+            SELECT (page_count - freelist_count) * page_size
+            FROM pragma_page_count(), pragma_freelist_count(), pragma_page_size()
+        """) as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def _archive(self, db: aiosqlite.Connection, conversation_id: str, cutoff: str) -> Optional[tuple[int, int, int]]:
+        async with db.execute("""
+            SELECT id, role, content, timestamp
+            FROM conversations
+            WHERE conversation_id = ?
+            ORDER BY timestamp, id
+        """, (conversation_id,)) as cursor:
+            rows = await cursor.fetchall()
+        # A message may have landed since the candidates were picked.
+        if not rows or max(row[3] for row in rows) >= cutoff:
+            return None
+
+        hot_rows = [tuple(row) for row in rows]
+        async with db.execute(
+                "SELECT codec, data, indexed FROM conversation_archive WHERE conversation_id = ?", (conversation_id,)
+        ) as cursor:
+            existing = await cursor.fetchone()
+        if existing is not None:
+            rows = sorted(decompress_rows(existing[0], existing[1]) + hot_rows, key=lambda row: (row[3], row[0]))
+
+        codec, blob = compress_rows(rows)
+        raw_bytes = sum(len(row[2].encode("utf-8")) for row in rows if row[2])
+        if len(blob) >= raw_bytes:
+            # Short conversations can grow when compressed; they are better off where they are.
+            return None
+
+        await self._index_archived(db, conversation_id, hot_rows if existing is not None and existing[2] else rows)
+        await db.execute("""
+            INSERT OR REPLACE INTO conversation_archive
+                (conversation_id, codec, data, message_count, raw_bytes, last_timestamp, indexed)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+        """, (conversation_id, codec, blob, len(rows), raw_bytes, rows[-1][3]))
+        await db.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        return len(rows), raw_bytes, len(blob)
+
+    @staticmethod
+    async def _index_archived(db: aiosqlite.Connection, conversation_id: str, rows: List[tuple]) -> None:
+        """Add archived (id, role, content, timestamp) rows to the archive's search index."""
+        await db.executemany(
+            "INSERT INTO archived_messages_fts (rowid, content) VALUES (?, ?)",
+            [(row[0], row[2]) for row in rows]
+        )
+        await db.executemany(
+            "INSERT OR REPLACE INTO archived_messages (id, conversation_id, role, timestamp) VALUES (?, ?, ?, ?)",
+            [(row[0], conversation_id, row[1], row[3]) for row in rows]
+        )
+
+    @staticmethod
+    async def _unindex_archived(db: aiosqlite.Connection, rows: List[tuple]) -> None:
+        # A contentless index can only forget a row given the exact text it indexed.
+        await db.executemany(
+            "INSERT INTO archived_messages_fts (archived_messages_fts, rowid, content) VALUES ('delete', ?, ?)",
+            [(row[0], row[2]) for row in rows]
+        )
+        await db.executemany("DELETE FROM archived_messages WHERE id = ?", [(row[0],) for row in rows])
+
+    async def _compaction_loop(self) -> None:
+        while True:
+            try:
+                await self.compact_idle_conversations()
+            except Exception as e:
+                logger.error(f"Error compacting idle conversations: {e}")
+            await asyncio.sleep(self.compact_interval)
+
+    async def _backfill_search_index(self) -> None:
+        """Index messages stored before the search index existed, a batch at a time."""
+        try:
+            db = await self._get_db()
+            total = 0
+            while True:
+                # Holding the writer lock keeps each batch out of the way of a group commit.
+                async with self.writer.lock:
+                    async with db.execute("SELECT done_upto, stop_id FROM search_backfill") as cursor:
+                        row = await cursor.fetchone()
+                    if row is None or row[0] >= row[1]:
+                        break
+                    done_upto, stop_id = row
+                    async with db.execute("""
+                        SELECT MAX(id), COUNT(*) FROM (
+                            SELECT id FROM conversations WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+                        )
+                    """, (done_upto, stop_id, self.search_backfill_batch)) as cursor:
+                        batch_end, count = await cursor.fetchone()
+                    batch_end = batch_end if batch_end is not None else stop_id
+                    await db.execute("""
+                        INSERT INTO conversations_fts (rowid, content)
+                        SELECT id, content FROM conversations WHERE id > ? AND id <= ?
+                    """, (done_upto, batch_end))
+                    await db.execute("UPDATE search_backfill SET done_upto = ?", (batch_end,))
+                    await db.commit()
+                total += count
+                # Let requests run between batches.
+                await asyncio.sleep(0)
+            if total:
+                logger.info(f"Backfilled the search index with {total} messages")
+
+            # Conversations archived before archived messages were indexed.
+            archives = 0
+            while True:
+                async with self.writer.lock:
+                    async with db.execute(
+                            "SELECT conversation_id, codec, data FROM conversation_archive WHERE NOT indexed LIMIT 1"
+                    ) as cursor:
+                        row = await cursor.fetchone()
+                    if row is None:
+                        break
+                    try:
+                        await self._index_archived(db, row[0], decompress_rows(row[1], row[2]))
+                        await db.execute("UPDATE conversation_archive SET indexed = 1 WHERE conversation_id = ?", (row[0],))
+                        await db.commit()
+                    except Exception:
+                        await db.rollback()
+                        raise
+                archives += 1
+                await asyncio.sleep(0)
+            if archives:
+                logger.info(f"Backfilled the search index with {archives} archived conversations")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error backfilling the search index: {e}")
+
+    async def search_messages(
+            self,
+            query: str,
+            limit: int = 20,
+            offset: int = 0,
+            conversation_id: Optional[str] = None
+    ) -> tuple[int, List[Dict[str, Any]]]:
+        """
+        Full-text search over stored messages, best matches first.
+
+        Returns the total number of matches and one page of hits, each with a
+        snippet in which matched terms are wrapped in <mark> tags. Messages
+        still in the write-behind queue show up once their batch commits.
+        Archived conversations are searched too, through their own index.
+        bm25() scores from two indexes with different statistics cannot be
+        compared, so each hit is scored relative to the best match in its own
+        index (1.0 for the best) and the two lists are merged on that.
+        """
+        match = fts_query(query)
+        if not match:
+            return 0, []
+
+        hot_where, archived_where = "conversations_fts MATCH ?", "archived_messages_fts MATCH ?"
+        params: List[Any] = [match]
+        if conversation_id is not None:
+            hot_where += " AND c.conversation_id = ?"
+            archived_where += " AND a.conversation_id = ?"
+            params.append(conversation_id)
+
+        db = await self._get_db()
+        with DB_SECONDS.time(operation="fulltext_search"):
+            async with db.execute(f"""
+                SELECT (
+                    SELECT COUNT(*)
+                    FROM conversations_fts
+                    JOIN conversations c ON c.id = conversations_fts.rowid
+                    WHERE {hot_where}
+                ), (
+                    SELECT COUNT(*)
+                    FROM archived_messages_fts
+                    JOIN archived_messages a ON a.id = archived_messages_fts.rowid
+                    WHERE {archived_where}
+                )
+            """, params + params) as cursor:
+                hot_total, archived_total = await cursor.fetchone()
+
+            # The best offset + limit hits of each index, merged below.
+            async with db.execute(f"""
+                SELECT c.id, c.conversation_id, c.role, c.timestamp,
+                       snippet(conversations_fts, 0, '<mark>', '</mark>', '…', 16),
+                       bm25(conversations_fts)
+                FROM conversations_fts
+                JOIN conversations c ON c.id = conversations_fts.rowid
+                WHERE {hot_where}
+                ORDER BY bm25(conversations_fts), c.id DESC
+                LIMIT ?
+            """, params + [offset + limit]) as cursor:
+                rows = list(await cursor.fetchall())
+
+            rows = _relative_scores(rows)
+            if archived_total:
+                async with db.execute(f"""
+                    SELECT a.id, a.conversation_id, a.role, a.timestamp, NULL, bm25(archived_messages_fts)
+                    FROM archived_messages_fts
+                    JOIN archived_messages a ON a.id = archived_messages_fts.rowid
+                    WHERE {archived_where}
+                    ORDER BY bm25(archived_messages_fts), a.id DESC
+                    LIMIT ?
+                """, params + [offset + limit]) as cursor:
+                    rows += _relative_scores(await cursor.fetchall())
+                rows.sort(key=lambda row: (-row[5], -row[0]))
+                rows = rows[offset:offset + limit]
+                # A contentless index has no text to cut snippets from; take it from the archive.
+                snippets = await self._archived_snippets(db, [row for row in rows if row[4] is None], query)
+                rows = [row if row[4] is not None else (*row[:4], snippets.get(row[0], ''), row[5]) for row in rows]
+            else:
+                rows = rows[offset:offset + limit]
+
+        hits = [
+            {
+                "message_id": row[0],
+                "conversation_id": row[1],
+                "role": row[2],
+                "timestamp": row[3],
+                "snippet": row[4],
+                "score": row[5]
+            }
+            for row in rows
+        ]
+        return hot_total + archived_total, hits
+
+    @staticmethod
+    async def _archived_snippets(db: aiosqlite.Connection, rows: List[tuple], query: str) -> Dict[int, str]:
+        """Snippets for archived hits, keyed by message id, decompressing each conversation once."""
+        wanted: Dict[str, set] = {}
+        for row in rows:
+            wanted.setdefault(row[1], set()).add(row[0])
+        snippets = {}
+        for conversation_id, ids in wanted.items():
+            async with db.execute(
+                    "SELECT codec, data FROM conversation_archive WHERE conversation_id = ?", (conversation_id,)
+            ) as cursor:
+                archived = await cursor.fetchone()
+            if archived is None:  # rehydrated since the search ran
+                continue
+            for row in decompress_rows(archived[0], archived[1]):
+                if row[0] in ids:
+                    snippets[row[0]] = highlight_snippet(row[2] or '', query)
+        return snippets
+
+
+def _relative_scores(rows: List[tuple]) -> List[tuple]:
+    """
+    Replace the bm25() score at the end of each row, best first, with its
+    ratio to the best one: 1.0 for the top hit, approaching 0 for weaker ones.
+    """
+    # bm25() is negative, and lower for better matches.
+    best = rows[0][-1] if rows and rows[0][-1] < 0 else -1.0
+    return [(*row[:-1], row[-1] / best) for row in rows]
+
+
+def fts_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query that matches messages containing every word.
+
+    Each word is quoted, so user input can never be parsed as FTS5 syntax, and
+    the last word matches as a prefix to make search-as-you-type work.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight_snippet(text: str, query: str, words: int = 16) -> str:
+    """
+    Up to `words` words of `text` around the first one starting with a query
+    word, matches wrapped in <mark> tags, like FTS5's snippet(). Stemmed
+    matches are not marked; the snippet then starts at the beginning.
+    """
+    terms = [word.casefold() for word in re.findall(r'\w+', query)]
+
+    def matches(word: str) -> bool:
+        core = re.sub(r'\W', '', word).casefold()
+        return bool(core) and any(core.startswith(term) for term in terms)
+
+    parts = text.split()
+    first = next((i for i, part in enumerate(parts) if matches(part)), 0)
+    begin = max(0, first - words // 4)
+    window = [f'<mark>{part}</mark>' if matches(part) else part for part in parts[begin:begin + words]]
+    return ('…' if begin else '') + ' '.join(window) + ('…' if begin + words < len(parts) else '')
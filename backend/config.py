@@ -1,6 +1,13 @@
 import logging
+import os
+import httpx
 from dotenv import load_dotenv
-from ollama import Client, pull
+from llm_service import LLMService
+from ollama_pool import OllamaBackendPool
+from llm_cache import LLMResponseCache
+from llm_scheduler import LLMScheduler
+from model_warmup import KeepAlivePolicy, ModelWarmer, parse_range
+from vector_memory import VectorMemory, OllamaEmbedder, HashingEmbedder
 from google_auth_oauthlib.flow import InstalledAppFlow
 
 def setup_logging():
@@ -12,16 +19,89 @@ def setup_logging():
 def setup_ollama():
     logger = logging.getLogger(__name__)
     load_dotenv()
-    logger.info("Pulling model...")
-    try:
-        # pull('llama3.1')
-        logger.info("Model pull completed successfully")
-    except Exception as e:
-        logger.error(f"Error pulling model: {str(e)}")
-        raise
-    ollama_client = Client(host='http://192.168.1.78:11434')
-    logger.info("Ollama client initialized")
-    return ollama_client
+    # OLLAMA_HOSTS is a comma-separated list of inference boxes; OLLAMA_HOST
+    # still works for a single one.
+    hosts = [
+        host.strip()
+        for host in os.getenv('OLLAMA_HOSTS', os.getenv('OLLAMA_HOST', 'http://192.168.1.78:11434')).split(',')
+        if host.strip()
+    ]
+    request_timeout = float(os.getenv('OLLAMA_TIMEOUT', '300'))
+    connect_timeout = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5'))
+    max_connections = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '20'))
+    max_keepalive = int(os.getenv('OLLAMA_MAX_KEEPALIVE_CONNECTIONS', '10'))
+
+    # One shared async client per host: its httpx pool keeps connections to
+    # that host alive across requests instead of reconnecting for every call.
+    pool = OllamaBackendPool.from_hosts(
+        hosts,
+        client_kwargs={
+            "timeout": httpx.Timeout(request_timeout, connect=connect_timeout),
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=60
+            )
+        },
+        health_interval=float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10'))
+    )
+    logger.info(f"Ollama clients initialized for {', '.join(hosts)}")
+
+    response_cache = LLMResponseCache(
+        db_path=os.getenv('LLM_CACHE_DB', 'llm_cache.db'),
+        ttl=float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600))),
+        max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+    )
+    # Match OLLAMA_MAX_IN_FLIGHT to the sum of the servers' OLLAMA_NUM_PARALLEL.
+    max_in_flight = int(os.getenv('OLLAMA_MAX_IN_FLIGHT', str(4 * len(hosts))))
+    max_background = os.getenv('OLLAMA_MAX_BACKGROUND_IN_FLIGHT')
+    scheduler = LLMScheduler(
+        max_in_flight=max_in_flight,
+        max_background_in_flight=int(max_background) if max_background else None
+    )
+    keep_alive_policy = KeepAlivePolicy(
+        keep_alive=os.getenv('OLLAMA_KEEP_ALIVE', '60m'),
+        off_hours_keep_alive=os.getenv('OLLAMA_KEEP_ALIVE_OFF_HOURS', '5m'),
+        business_hours=parse_range(os.getenv('OLLAMA_BUSINESS_HOURS', '8-20')),
+        business_days=range(*parse_range(os.getenv('OLLAMA_BUSINESS_DAYS', '0-5'))),
+        tz_name=os.getenv('OLLAMA_BUSINESS_TZ')
+    )
+    return LLMService(
+        pool,
+        default_timeout=request_timeout,
+        response_cache=response_cache,
+        scheduler=scheduler,
+        keep_alive_policy=keep_alive_policy
+    )
+
+def setup_model_warmer(llm_service: LLMService) -> ModelWarmer:
+    models = [model.strip() for model in os.getenv('OLLAMA_WARM_MODELS', llm_service.default_model).split(',') if model.strip()]
+    return ModelWarmer(
+        llm_service.pool,
+        models,
+        llm_service.keep_alive_policy,
+        ping_interval=float(os.getenv('OLLAMA_KEEP_WARM_INTERVAL', '240')),
+        pull_missing=os.getenv('OLLAMA_PULL_MODELS', '').lower() in ('1', 'true', 'yes')
+    )
+
+def setup_vector_memory(llm_service: LLMService):
+    """Long-term vector memory, or None when VECTOR_MEMORY_ENABLED is off."""
+    if os.getenv('VECTOR_MEMORY_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    dim = int(os.getenv('VECTOR_MEMORY_DIM', '256'))
+    # VECTOR_MEMORY_EMBEDDER=hashing swaps in the offline embedder, e.g. for tests.
+    if os.getenv('VECTOR_MEMORY_EMBEDDER', 'ollama').lower() == 'hashing':
+        embedder = HashingEmbedder(dim)
+    else:
+        embedder = OllamaEmbedder(llm_service, model=os.getenv('VECTOR_MEMORY_MODEL', 'nomic-embed-text'))
+    return VectorMemory(
+        os.getenv('VECTOR_MEMORY_DIR', 'vector_memory'),
+        embedder,
+        dim=dim,
+        coarse_dim=int(os.getenv('VECTOR_MEMORY_COARSE_DIM', '32')),
+        min_score=float(os.getenv('VECTOR_MEMORY_MIN_SCORE', '0.35')),
+        recall_timeout=float(os.getenv('VECTOR_MEMORY_RECALL_TIMEOUT', '1.5'))
+    )
 
 def setup_calendar_api():
     logger = logging.getLogger(__name__)
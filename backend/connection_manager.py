@@ -0,0 +1,230 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Set, Awaitable, Iterator, Union
+
+from fastapi import WebSocket, Request, Response
+
+from ws_sender import WebSocketSender, DROP_OLDEST
+from ws_session import ClientSession
+
+logger = logging.getLogger(__name__)
+
+
+async def cancel_on_disconnect(request: Request, task: asyncio.Task) -> None:
+    """Cancel `task` as soon as the HTTP client of `request` goes away."""
+    while not task.done():
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            if not task.done():
+                logger.info("HTTP client disconnected, cancelling its generation")
+                task.cancel()
+            return
+
+
+class ConnectionManager:
+    """
+    Tracks WebSocket connections and the generations running for each client.
+
+    Every chat turn runs in a task registered under its client_id, whichever
+    endpoint it came through, so it can be cancelled when the client goes
+    away or asks to stop. Outgoing frames go through a bounded per-connection
+    queue (see WebSocketSender), so sending never blocks the producer.
+
+    WebSocket clients also get a ClientSession that survives reconnects.
+    Every frame carries a sequence number; a client reconnecting within
+    `resume_grace` seconds passes the last one it saw (?resume=<seq>) and is
+    sent only the frames it missed. Generations keep running for
+    `generation_grace` seconds after a disconnect so a quick reconnect picks
+    up the answer instead of asking for it again.
+
+    `connection_stats` reports the send queue of each connection, limited to
+    the `metrics_connections` deepest queues so the number of client_id
+    labels on /metrics stays bounded.
+    """
+
+    def __init__(
+            self,
+            max_queue: int = 256,
+            overflow_policy: str = DROP_OLDEST,
+            binary_min_bytes: int = 4096,
+            replay_frames: int = 1024,
+            resume_grace: float = 120,
+            generation_grace: float = 15,
+            metrics_connections: int = 20
+    ):
+        self.active_connections: dict[str, WebSocket] = {}
+        self.senders: Dict[str, WebSocketSender] = {}
+        self.sessions: Dict[str, ClientSession] = {}
+        self.generations: Dict[str, Set[asyncio.Task]] = {}
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.binary_min_bytes = binary_min_bytes
+        self.replay_frames = replay_frames
+        self.resume_grace = resume_grace
+        self.generation_grace = generation_grace
+        self.metrics_connections = metrics_connections
+        self.resumes = 0
+        self.failed_resumes = 0
+        self.frames_replayed = 0
+
+    async def connect(
+            self,
+            websocket: WebSocket,
+            client_id: str,
+            binary: bool = False,
+            resume_from: Optional[int] = None
+    ) -> ClientSession:
+        await websocket.accept()
+        previous = self.senders.pop(client_id, None)
+        if previous is not None:
+            await previous.stop()
+        sender = WebSocketSender(
+            websocket,
+            max_queue=self.max_queue,
+            overflow_policy=self.overflow_policy,
+            binary=binary,
+            binary_min_bytes=self.binary_min_bytes,
+            on_overflow_disconnect=lambda: self.cancel_generations(client_id)
+        )
+        sender.start()
+
+        session = self.sessions.get(client_id)
+        if session is None:
+            session = self.sessions[client_id] = ClientSession(client_id, self.replay_frames)
+        session.attach()
+
+        # Replay before the sender is registered, so frames produced meanwhile
+        # cannot overtake the missed ones.
+        if resume_from is not None:
+            missed = session.frames_after(resume_from)
+            if missed is None:
+                self.failed_resumes += 1
+                sender.send(session.record({"type": "resume_failed", "last_seq": resume_from}))
+                logger.info(f"Client {client_id} could not resume from {resume_from}")
+            else:
+                for frame in missed:
+                    sender.send(frame, bypass_limit=True)
+                self.resumes += 1
+                self.frames_replayed += len(missed)
+                sender.send(session.record({"type": "resumed", "last_seq": resume_from, "replayed": len(missed)}))
+                logger.info(f"Client {client_id} resumed from {resume_from}, {len(missed)} frames replayed")
+
+        self.active_connections[client_id] = websocket
+        self.senders[client_id] = sender
+        logger.info(f"New client connected: {client_id}{' (msgpack)' if sender.binary else ''}")
+        return session
+
+    async def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        # A client that already reconnected keeps its new connection.
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
+        self.active_connections.pop(client_id, None)
+        sender = self.senders.pop(client_id, None)
+        if sender is not None:
+            await sender.stop()
+
+        session = self.sessions.get(client_id)
+        if session is None or self.generation_grace <= 0:
+            cancelled = self.cancel_generations(client_id)
+            logger.info(f"Client disconnected: {client_id}, {cancelled} generations cancelled")
+        else:
+            session.call_later(self.generation_grace, lambda: self._abandon_generations(client_id))
+        if session is None:
+            return
+        session.detach()
+        session.call_later(self.resume_grace, lambda: self._expire_session(client_id, session))
+        logger.info(f"Client disconnected: {client_id}, session kept for {self.resume_grace} seconds")
+
+    def _abandon_generations(self, client_id: str) -> None:
+        cancelled = self.cancel_generations(client_id)
+        if cancelled:
+            logger.info(f"Client {client_id} did not come back, {cancelled} generations cancelled")
+
+    def _expire_session(self, client_id: str, session: ClientSession) -> None:
+        if self.sessions.get(client_id) is session and not session.connected:
+            del self.sessions[client_id]
+            self.cancel_generations(client_id)
+
+    def start_generation(self, client_id: str, coro: Awaitable[Any]) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self.generations.setdefault(client_id, set()).add(task)
+        task.add_done_callback(lambda done: self._forget_generation(client_id, done))
+        return task
+
+    async def run_for_request(self, client_id: str, coro: Awaitable[Any], request: Request) -> Any:
+        """
+        Run `coro` as a generation for the HTTP client of `request` and return
+        its result, or a 499 response if it was cancelled because the client
+        went away (or asked to stop) first.
+        """
+        task = self.start_generation(client_id, coro)
+        watcher = asyncio.create_task(cancel_on_disconnect(request, task))
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled() or asyncio.current_task().cancelling():
+                raise
+            # Nobody is left to read this; 499 is the conventional "client closed request".
+            return Response(status_code=499)
+        finally:
+            watcher.cancel()
+
+    @contextmanager
+    def track_generation(self, client_id: str) -> Iterator[None]:
+        """Register the current task as a generation for `client_id` while the block runs."""
+        task = asyncio.current_task()
+        self.generations.setdefault(client_id, set()).add(task)
+        try:
+            yield
+        finally:
+            self._forget_generation(client_id, task)
+
+    def _forget_generation(self, client_id: str, task: asyncio.Task) -> None:
+        tasks = self.generations.get(client_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self.generations[client_id]
+
+    def cancel_generations(self, client_id: str) -> int:
+        tasks = [task for task in self.generations.get(client_id, ()) if not task.done()]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    async def send_message(self, message: Union[str, Dict[str, Any]], client_id: str) -> bool:
+        """
+        Queue a frame for the client; returns at once, without waiting on the network.
+
+        Dict payloads get a sequence number and are kept for replay, so they
+        still reach a client that is briefly disconnected once it resumes.
+        """
+        session = self.sessions.get(client_id)
+        if session is not None and isinstance(message, dict):
+            message = session.record(message)
+        sender = self.senders.get(client_id)
+        if sender is None:
+            return False
+        return sender.send(message)
+
+    def stats(self) -> Dict[str, Any]:
+        connections = [sender.stats() for sender in self.senders.values()]
+        return {
+            "connections": len(self.active_connections),
+            "generations_in_flight": sum(len(tasks) for tasks in self.generations.values()),
+            "queued_frames": sum(stats["queue_depth"] for stats in connections),
+            "dropped_frames": sum(stats["frames_dropped"] for stats in connections),
+            "sessions": len(self.sessions),
+            "resumes": self.resumes,
+            "failed_resumes": self.failed_resumes,
+            "frames_replayed": self.frames_replayed
+        }
+
+    def connection_stats(self) -> List[Dict[str, Any]]:
+        """Send queue stats of the connections with the deepest queues, deepest first."""
+        deepest = sorted(self.senders.items(), key=lambda item: item[1].queue_depth, reverse=True)
+        return [
+            {"client_id": client_id, **sender.stats()}
+            for client_id, sender in deepest[:self.metrics_connections]
+        ]
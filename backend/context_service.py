@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+from llm_scheduler import INTERACTIVE, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken missing, or its encoding file could not be fetched
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens in `text`.
+
+    cl100k_base is close enough to the llama tokenizer for budgeting; without
+    tiktoken we fall back to the usual ~4 characters per token estimate.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+class ContextWindowManager:
+    """
+    Keep prompts inside a fixed token budget.
+
+    The newest turns are sent verbatim for as long as they fit in
+    `token_budget`. Everything older is folded into a rolling summary that is
+    cached per conversation_id and only regenerated once `refresh_after` more
+    turns have dropped out of the window. Summaries are always written in the
+    background at BACKGROUND priority, never on the request path: until the
+    first one lands, older turns are simply left out of the prompt.
+    """
+
+    def __init__(
+            self,
+            ollama_client,
+            token_budget: int = 3000,
+            summary_max_tokens: int = 256,
+            refresh_after: int = 6,
+            max_cached_summaries: int = 1000
+    ):
+        self.ollama_client = ollama_client
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.refresh_after = refresh_after
+        self.max_cached_summaries = max_cached_summaries
+        # conversation_id -> (summary text, number of leading turns it covers)
+        self._summaries: "OrderedDict[str, tuple[str, int]]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def split_history(self, history: List[Dict[str, str]], reserved_tokens: int = 0) -> tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Split formatted history into (older turns to summarize, newest turns that fit the budget)."""
+        remaining = self.token_budget - reserved_tokens
+        split = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            cost = count_tokens(history[index]["content"]) + 4  # role and message framing
+            if cost > remaining:
+                break
+            remaining -= cost
+            split = index
+        return history[:split], history[split:]
+
+    async def build_messages(
+            self,
+            system_prompt: Dict[str, str],
+            history: List[Dict[str, str]],
+            user_input: str,
+            conversation_id: Optional[str] = None,
+            memories: Optional[List[Dict[str, str]]] = None,
+            grounding: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Assemble system prompt, recalled memories, rolling summary, recent turns
+        and the new user message.
+
+        `memories` are past messages (role and content, possibly truncated)
+        recalled from long-term memory; any already in the recent window are
+        left out. `grounding` is reference text for this turn only, such as
+        web search results; it goes right before the new user message.
+        """
+        memories = memories or []
+        reserved = count_tokens(system_prompt["content"]) + count_tokens(user_input) + self.summary_max_tokens
+        reserved += count_tokens(grounding)
+        reserved += sum(count_tokens(memory["content"]) + 4 for memory in memories)
+        older, recent = self.split_history(history, reserved)
+
+        messages = [system_prompt]
+        if memories:
+            in_window = [turn["content"] for turn in recent] + [user_input]
+            lines = [
+                f"- {memory['role']}: {memory['content']}"
+                for memory in memories
+                if not any(text.startswith(memory["content"]) for text in in_window)
+            ]
+            if lines:
+                messages.append({
+                    "role": "system",
+                    "content": "Possibly relevant excerpts from the user's earlier conversations:\n" + "\n".join(lines)
+                })
+        if older:
+            summary = self._get_summary(conversation_id, older)
+            if summary:
+                messages.append({
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation: {summary}"
+                })
+            logger.debug(f"Context window for {conversation_id}: {len(older)} turns summarized, {len(recent)} kept")
+
+        messages.extend(recent)
+        if grounding:
+            messages.append({"role": "system", "content": grounding})
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def _get_summary(self, conversation_id: Optional[str], older: List[Dict[str, str]]) -> str:
+        """The cached summary of `older`, possibly stale; schedules a refresh when it is due."""
+        if conversation_id is None:
+            # Nowhere to cache a summary, so the turn goes without one.
+            return ""
+
+        cached = self._summaries.get(conversation_id)
+        if cached is None:
+            # This turn goes out with the truncated history alone.
+            self._schedule_refresh(conversation_id, "", 0, older)
+            return ""
+
+        self._summaries.move_to_end(conversation_id)
+        summary, covered = cached
+        if covered > len(older) or len(older) - covered >= self.refresh_after:
+            self._schedule_refresh(conversation_id, summary, covered, older)
+        return summary
+
+    def _schedule_refresh(self, conversation_id: str, summary: str, covered: int, older: List[Dict[str, str]]) -> None:
+        """
+        Refresh a stale or missing summary in the background; the current one is
+        used until it lands. A failed refresh records nothing, so the next turn
+        tries again.
+        """
+        if conversation_id in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                if covered > len(older):
+                    # History shrank under us; start the summary over.
+                    new_summary = await self._summarize("", older, BACKGROUND)
+                else:
+                    new_summary = await self._summarize(summary, older[covered:], BACKGROUND)
+                self._store(conversation_id, new_summary, len(older))
+            except Exception as e:
+                logger.error(f"Error refreshing summary for conversation {conversation_id}: {e}")
+            finally:
+                self._refreshing.pop(conversation_id, None)
+
+        self._refreshing[conversation_id] = asyncio.create_task(refresh())
+
+    def _store(self, conversation_id: str, summary: str, covered: int) -> None:
+        self._summaries[conversation_id] = (summary, covered)
+        self._summaries.move_to_end(conversation_id)
+        while len(self._summaries) > self.max_cached_summaries:
+            self._summaries.popitem(last=False)
+
+    async def _summarize(self, previous_summary: str, turns: List[Dict[str, str]], priority: int = INTERACTIVE) -> str:
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        prompt = "Update the running summary of this conversation with the new messages below. " \
+                 "Keep names, facts, decisions and open questions; drop pleasantries. " \
+                 "Reply with the summary only.\n\n"
+        if previous_summary:
+            prompt += f"Current summary:\n{previous_summary}\n\n"
+        prompt += f"New messages:\n{transcript}"
+
+        response = await self.ollama_client.chat(
+            messages=[
+                {"role": "system", "content": "You write short, factual conversation summaries."},
+                {"role": "user", "content": prompt}
+            ],
+            options={"num_predict": self.summary_max_tokens},
+            priority=priority
+        )
+        return response['message']['content'].strip()
@@ -0,0 +1,43 @@
+import json
+import logging
+import zlib
+from typing import List, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+    _zstd_compressor = zstandard.ZstdCompressor(level=10)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+except ImportError:  # zstandard is optional; zlib is always there
+    zstandard = None
+
+# Columns of one archived message, in blob order.
+ARCHIVE_COLUMNS = ("id", "role", "content", "timestamp")
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress_rows(rows: List[Tuple[Any, ...]], codec: str = None) -> Tuple[str, bytes]:
+    """Pack a conversation's (id, role, content, timestamp) rows into one compressed blob."""
+    codec = codec or default_codec()
+    payload = json.dumps([list(row) for row in rows], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if codec == "zstd":
+        return codec, _zstd_compressor.compress(payload)
+    if codec == "zlib":
+        return codec, zlib.compress(payload, 9)
+    raise ValueError(f"Unknown archive codec {codec!r}")
+
+
+def decompress_rows(codec: str, blob: bytes) -> List[Tuple[Any, ...]]:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Conversation was archived with zstd but the zstandard package is not installed")
+        payload = _zstd_decompressor.decompress(blob)
+    elif codec == "zlib":
+        payload = zlib.decompress(blob)
+    else:
+        raise ValueError(f"Unknown archive codec {codec!r}")
+    return [tuple(row) for row in json.loads(payload)]
@@ -3,9 +3,10 @@ import requests
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import logging
-from state import global_state
+from state import State
 from models import ChatResponse
 from utils import parse_date_time
+from intent_router import intent_router
 from datetime import timedelta
 import random
 
@@ -135,101 +136,103 @@ class ExpenseTracker:
         self.db_conn.execute("SELECT * FROM income")
         return self.db_conn.fetchall()
 
+EXPENSE_PHRASES = ['add expense']
+
 def is_expense_request(message):
-    return any(phrase in message.lower() for phrase in ['add expense'])
+    return any(phrase in message.lower() for phrase in EXPENSE_PHRASES)
 
-def add_expense(summary, amount, category, description, date):
-    logger.info(f"Attempting to add expense: {summary}")
+def add_expense(amount, category, description, date):
+    logger.info(f"Attempting to add expense: {description}")
 
-    event = {
+    expense = {
         'amount': amount,
         'category': category,
         'description': description,
         'date': date,
     }
+    return expense
+
 
+def parse_amount(amount_str):
+    return float(amount_str.strip().lstrip('$').replace(',', ''))
 
-def handle_expense_request(user_input):
-    if global_state.event_creation_stage is None:
-        global_state.event_creation_stage = 'amount'
-        global_state.expense_info = {}
+
+def handle_expense_request(user_input, state: State):
+    if state.event_creation_stage is None:
+        state.event_creation_stage = 'amount'
+        state.expense_info = {}
         return ChatResponse(
             message="Sure, I can help you add a expense. What's the expense amount?",
             metadata={}
         )
 
-    if global_state.event_creation_stage == 'amount':
-        global_state.expense_info['amount'] = user_input
-        global_state.event_creation_stage = 'category'
+    if state.event_creation_stage == 'amount':
+        try:
+            state.expense_info['amount'] = parse_amount(user_input)
+        except ValueError:
+            return ChatResponse(
+                message="I couldn't understand that amount. Please enter it as a number, like '12.50'.",
+                metadata={}
+            )
+        state.event_creation_stage = 'category'
         return ChatResponse(
             message="Great! Now, what's the category? Please provide enter it now.",
             metadata={}
         )
 
-    if global_state.event_creation_stage == 'category':
-        global_state.expense_info['category'] = user_input
-        global_state.event_creation_stage = 'description'
+    if state.event_creation_stage == 'category':
+        state.expense_info['category'] = user_input
+        state.event_creation_stage = 'description'
         return ChatResponse(
             message="Great! Now, give a description of the expense. Please provide enter it now.",
             metadata={}
         )
 
-    if global_state.event_creation_stage == 'description':
-        global_state.expense_info['description'] = user_input
-        global_state.event_creation_stage = 'date_time'
+    if state.event_creation_stage == 'description':
+        state.expense_info['description'] = user_input
+        state.event_creation_stage = 'date_time'
         return ChatResponse(
             message="Great! Now, when was the expense from? Please provide the date and time.",
             metadata={}
         )
 
-    if global_state.event_creation_stage == 'date_time':
+    if state.event_creation_stage == 'date_time':
         date_time, time_zone = parse_date_time(user_input)
         if date_time is None:
             return ChatResponse(
                 message="I couldn't understand that date and time. Can you please provide it in a format like '10/24/24 10:00am EST' or '10 am est on October 24, 2024'?",
                 metadata={}
             )
-        global_state.expense_info['date_time'] = date_time
-        global_state.expense_info['time_zone'] = time_zone
-        global_state.event_creation_stage = 'duration'
-        return ChatResponse(
-            message="Got it. How long will the event last? (e.g., '1 hour', '30 minutes')",
-            metadata={}
-        )
-
-    if global_state.event_creation_stage == 'duration':
         try:
-            duration = parse_duration(user_input)
-            start_time = global_state.event_creation_stage['date_time']
-            end_time = start_time + duration
-            result = add_expense    (
-                global_state.expense_info['amount'],
-                global_state.expense_info['category'],
-                global_state.expense_info['description'],
-                global_state.expense_info['date_time'],
+            state.expense_info['date_time'] = date_time
+            add_expense(
+                state.expense_info['amount'],
+                state.expense_info['category'],
+                state.expense_info['description'],
+                state.expense_info['date_time'].strftime("%Y-%m-%d"),
             )
-            logger.info("Calendar event added successfully")
-
-            # Format the response
-            event_title = global_state.calendar_event_info['summary']
-            date_time = start_time.strftime("%B %d, %Y, %I:%M %p %Z")
-            duration_str = f"{duration.total_seconds() // 3600} hours" if duration.total_seconds() >= 3600 else f"{duration.total_seconds() // 60} minutes"
+            logger.info("Expense added successfully")
 
-            response_message = generate_expense_response(event_title, date_time, duration_str)
+            response_message = generate_expense_response(
+                state.expense_info['amount'],
+                state.expense_info['category'],
+                state.expense_info['description'],
+                state.expense_info['date_time'].strftime("%B %d, %Y")
+            )
 
-            global_state.expense_info = {}  # Clear the info after successful addition
-            global_state.event_creation_stage = None  # Reset the stage
+            state.expense_info = {}  # Clear the info after successful addition
+            state.event_creation_stage = None  # Reset the stage
 
             return ChatResponse(
                 message=response_message,
                 metadata={}
             )
         except Exception as e:
-            logger.error(f"Failed to add calendar event: {str(e)}")
-            global_state.calendar_event_info = {}  # Clear the info if there's an error
-            global_state.event_creation_stage = None  # Reset the stage
+            logger.error(f"Failed to add expense: {str(e)}")
+            state.expense_info = {}  # Clear the info if there's an error
+            state.event_creation_stage = None  # Reset the stage
             return ChatResponse(
-                message=f"I'm sorry, but I couldn't add the calendar event. {str(e)}",
+                message=f"I'm sorry, but I couldn't add the expense. {str(e)}",
                 metadata={}
             )
 
@@ -243,4 +246,7 @@ def parse_duration(duration_str):
         minutes = int(duration_str.split()[0])
         return timedelta(minutes=minutes)
     else:
-        raise ValueError("Couldn't understand the duration. Please specify in hours or minutes.")
\ No newline at end of file
+        raise ValueError("Couldn't understand the duration. Please specify in hours or minutes.")
+
+
+intent_router.register('expense', EXPENSE_PHRASES, handler=handle_expense_request)
@@ -0,0 +1,109 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryCache:
+    """
+    LRU cache of conversation histories keyed by conversation_id.
+
+    Entries are loaded on the first read and kept current by appending each
+    stored message, so hot conversations are not read from SQLite again. Each
+    entry also keeps a `version`, the id of the latest message it is known to
+    include; readers pass `is_current` to `get` to drop entries that another
+    process has written to since. The cache is bounded both by number of
+    conversations and by total cached messages, and entries not touched for
+    `ttl` seconds are dropped.
+    """
+
+    def __init__(self, max_conversations: int = 1000, max_messages: int = 50000, ttl: float = 1800):
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self.ttl = ttl
+        # conversation_id -> (last access time, messages, version)
+        self._entries: "OrderedDict[str, tuple[float, List[Dict[str, Any]], int]]" = OrderedDict()
+        self._message_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._entries
+
+    def get(
+            self,
+            conversation_id: str,
+            is_current: Optional[Callable[[List[Dict[str, Any]], int], bool]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Return the cached history, or None on a miss. `is_current(messages,
+        version)` can reject an entry as out of date, which drops it.
+        """
+        entry = self._entries.get(conversation_id)
+        stale = entry is not None and is_current is not None and not is_current(entry[1], entry[2])
+        if entry is None or stale or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                self._remove(conversation_id)
+            if stale:
+                self.stale += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries[conversation_id] = (time.monotonic(), entry[1], entry[2])
+        self._entries.move_to_end(conversation_id)
+        return list(entry[1])
+
+    def put(self, conversation_id: str, messages: List[Dict[str, Any]], version: int = 0) -> None:
+        if conversation_id in self._entries:
+            self._remove(conversation_id)
+        self._entries[conversation_id] = (time.monotonic(), list(messages), version)
+        self._message_count += len(messages)
+        self._evict()
+
+    def append(self, conversation_id: str, message: Dict[str, Any]) -> None:
+        """Add a new message to a cached history; uncached conversations are left alone."""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        entry[1].append(message)
+        self._message_count += 1
+        self._evict()
+
+    def set_version(self, conversation_id: str, version: int) -> None:
+        entry = self._entries.get(conversation_id)
+        if entry is not None:
+            self._entries[conversation_id] = (entry[0], entry[1], version)
+
+    def invalidate(self, conversation_id: str) -> None:
+        if conversation_id in self._entries:
+            self._remove(conversation_id)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self._entries),
+            "messages": self._message_count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+    def _remove(self, conversation_id: str) -> None:
+        _, messages, _ = self._entries.pop(conversation_id)
+        self._message_count -= len(messages)
+
+    def _evict(self) -> None:
+        while self._entries and (
+                len(self._entries) > self.max_conversations or self._message_count > self.max_messages
+        ):
+            conversation_id = next(iter(self._entries))
+            self._remove(conversation_id)
+            self.evictions += 1
+            logger.debug(f"Evicted conversation {conversation_id} from history cache")
@@ -0,0 +1,198 @@
+import re
+import inspect
+import logging
+from typing import List, Dict, Any, Optional, Callable, Iterable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+def fold_case(text: str) -> str:
+    """
+    Lowercase `text` character for character, so offsets into the result are
+    offsets into `text`. str.lower() turns 'İ' into 'i' plus a combining dot;
+    here it becomes a plain 'i'.
+    """
+    return "".join(char.lower()[0] for char in text)
+
+
+class IntentMatch(NamedTuple):
+    name: str
+    handler: Optional[Callable]
+    args: Dict[str, str]
+    trigger: str
+
+
+class _Intent(NamedTuple):
+    name: str
+    phrases: List[str]
+    handler: Optional[Callable]
+    args_pattern: Optional[re.Pattern]
+
+
+class IntentRouter:
+    """
+    Routes chat messages to intents in a single pass.
+
+    Every registered trigger phrase is compiled into one Aho-Corasick
+    automaton, so a message is scanned once, character by character, and the
+    cost depends on the message length rather than on how many intents exist.
+
+    The earliest trigger in the message wins. Between triggers starting at the
+    same position the longest wins, then the intent registered first. An
+    intent's optional `args_pattern` is then matched against the text right
+    after its trigger; its named groups come back as arguments, and `rest`
+    always holds the text after the trigger.
+
+    Handlers are called as `handler(message, state)` with the session State,
+    through `dispatch`. Intents without a handler only route the message.
+    """
+
+    def __init__(self):
+        self._intents: List[_Intent] = []
+        self._compiled = False
+        # Automaton: per node its transitions, failure link and the best
+        # (longest, earliest registered) phrase ending there as
+        # (length, intent index), or None.
+        self._goto: List[Dict[str, int]] = []
+        self._fail: List[int] = []
+        self._output: List[Optional[tuple[int, int]]] = []
+        self._max_length = 0
+
+    def register(
+            self,
+            name: str,
+            phrases: Iterable[str],
+            handler: Optional[Callable] = None,
+            args_pattern: Optional[str] = None
+    ) -> None:
+        """Register an intent triggered by any of `phrases` (case-insensitive)."""
+        phrases = [fold_case(phrase) for phrase in phrases if phrase]
+        if not phrases:
+            raise ValueError(f"Intent {name!r} needs at least one trigger phrase")
+        if any(intent.name == name for intent in self._intents):
+            raise ValueError(f"Intent {name!r} is already registered")
+
+        compiled_args = re.compile(args_pattern, re.IGNORECASE | re.DOTALL) if args_pattern else None
+        self._intents.append(_Intent(name, phrases, handler, compiled_args))
+        self._compiled = False
+
+    def intent(self, name: str, phrases: Iterable[str], args_pattern: Optional[str] = None) -> Callable:
+        """Decorator form of `register` that uses the decorated function as the handler."""
+        def decorator(handler: Callable) -> Callable:
+            self.register(name, phrases, handler, args_pattern)
+            return handler
+        return decorator
+
+    def compile(self) -> None:
+        if self._compiled:
+            return
+
+        goto: List[Dict[str, int]] = [{}]
+        output: List[Optional[tuple[int, int]]] = [None]
+        for index, intent in enumerate(self._intents):
+            for phrase in intent.phrases:
+                node = 0
+                for char in phrase:
+                    next_node = goto[node].get(char)
+                    if next_node is None:
+                        next_node = len(goto)
+                        goto[node][char] = next_node
+                        goto.append({})
+                        output.append(None)
+                    node = next_node
+                if output[node] is None:
+                    output[node] = (len(phrase), index)
+
+        # Breadth-first pass for failure links. A node without a phrase of its
+        # own inherits the output of its failure node, so output[] is None
+        # exactly when no phrase ends at that node.
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, child in goto[node].items():
+                queue.append(child)
+                if node:
+                    state = fail[node]
+                    while state and char not in goto[state]:
+                        state = fail[state]
+                    fail[child] = goto[state].get(char, 0)
+                if output[child] is None:
+                    output[child] = output[fail[child]]
+
+        self._goto, self._fail, self._output = goto, fail, output
+        self._max_length = max((len(p) for intent in self._intents for p in intent.phrases), default=0)
+        self._compiled = True
+        logger.debug(f"Compiled intent router with {len(self._intents)} intents, {len(goto)} states")
+
+    def route(self, message: str) -> Optional[IntentMatch]:
+        """Return the intent triggered by `message`, or None for plain chat."""
+        self.compile()
+        goto, fail, output = self._goto, self._fail, self._output
+
+        best = None  # (start, -length, intent index), smallest wins
+        node = 0
+        for position, char in enumerate(message):
+            char = char.lower()[0]  # as fold_case, so positions stay aligned with `message`
+            if best is not None and position >= best[0] + self._max_length:
+                break  # nothing starting at or before best's start can still end here
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            # Walk the failure chain so every phrase ending here is considered,
+            # not just the longest one.
+            state = node
+            while state and output[state] is not None:
+                length, index = output[state]
+                candidate = (position - length + 1, -length, index)
+                if best is None or candidate < best:
+                    best = candidate
+                state = fail[state]
+
+        if best is None:
+            return None
+
+        start, negative_length, index = best
+        end = start - negative_length
+        intent = self._intents[index]
+
+        args: Dict[str, str] = {}
+        if intent.args_pattern is not None:
+            args_match = intent.args_pattern.match(message, end)
+            if args_match is not None:
+                args = {key: value for key, value in args_match.groupdict().items() if value is not None}
+        args.setdefault("rest", message[end:].strip())
+        return IntentMatch(intent.name, intent.handler, args, message[start:end])
+
+    def resume(self, name: str, message: str) -> Optional[IntentMatch]:
+        """The match that hands `message` to intent `name`, whose multi-step flow is waiting for it."""
+        for intent in self._intents:
+            if intent.name == name:
+                return IntentMatch(intent.name, intent.handler, {"rest": message.strip()}, "")
+        return None
+
+    def matches(self, name: str, message: str) -> bool:
+        routed = self.route(message)
+        return routed is not None and routed.name == name
+
+    @property
+    def intent_names(self) -> List[str]:
+        return [intent.name for intent in self._intents]
+
+
+async def dispatch(match: IntentMatch, message: str, state) -> Any:
+    """
+    Run an intent's handler as `handler(message, state)`, awaiting it if it is
+    a coroutine. While the handler leaves a stage pending in the session
+    state, `state.flow` names the intent, so the next message can be resumed
+    to it whatever it says.
+    """
+    result = match.handler(message, state)
+    if inspect.isawaitable(result):
+        result = await result
+    state.flow = match.name if state.event_creation_stage is not None else None
+    return result
+
+
+# Shared router; services register their intents on import.
+intent_router = IntentRouter()
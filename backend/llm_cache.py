@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import time
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+import aiosqlite
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], options: Optional[Dict[str, Any]]) -> str:
+    """Hash of everything that determines a completion: model, prompt messages and options."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "options": options or {}},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of LLM responses stored in SQLite.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    dropped once there are more than `max_entries`. Concurrent identical
+    requests are coalesced: only the first one calls the model, the rest wait
+    for its result, even if the first caller is cancelled meanwhile.
+    """
+
+    def __init__(self, db_path: str = 'llm_cache.db', ttl: float = 7 * 24 * 3600, max_entries: int = 5000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db: Optional[aiosqlite.Connection] = None
+        self._in_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        if self._db is None:
+            self._db = await aiosqlite.connect(self.db_path)
+            await self._db.execute("PRAGMA journal_mode = WAL")
+            await self._db.execute("PRAGMA synchronous = NORMAL")
+            await self._db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT,
+                    created_at REAL,
+                    last_access REAL
+                )
+            """)
+            await self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            await self._db.commit()
+        return self._db
+
+    async def close(self) -> None:
+        await self._in_flight.cancel_all()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        db = await self._get_db()
+        async with db.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        if now - row[1] > self.ttl:
+            await db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            await db.commit()
+            return None
+
+        await db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        await db.commit()
+        return json.loads(row[0])
+
+    async def put(self, key: str, model: str, response: Dict[str, Any]) -> None:
+        db = await self._get_db()
+        now = time.time()
+        await db.execute("""
+            INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?)
+        """, (key, model, json.dumps(dict(response)), now, now))
+        await db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        await db.execute("""
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        await db.commit()
+
+    async def get_or_call(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            options: Optional[Dict[str, Any]],
+            call: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Return the cached response for this request, or run `call` once and cache its result."""
+        key = cache_key(model, messages, options)
+
+        if key in self._in_flight:
+            self.coalesced += 1
+
+        async def lookup_or_call():
+            try:
+                cached = await self.get(key)
+            except Exception as e:
+                logger.error(f"Error reading LLM cache: {e}")
+                cached = None
+
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+            self.misses += 1
+            response = await call()
+            try:
+                await self.put(key, model, response)
+            except Exception as e:
+                logger.error(f"Error writing LLM cache: {e}")
+            return response
+
+        return await self._in_flight.run(key, lookup_or_call)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
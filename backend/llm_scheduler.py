@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower value is served first.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class LLMScheduler:
+    """
+    Admission control for calls to the Ollama host.
+
+    At most `max_in_flight` generations run at once, which should match the
+    server's OLLAMA_NUM_PARALLEL. Waiting interactive requests are always
+    admitted before background ones. Background work never takes more than
+    `max_background_in_flight` slots, so chat can always get a slot quickly.
+    Within a class, clients are served round-robin so one client_id with many
+    queued requests cannot starve the others.
+    """
+
+    def __init__(self, max_in_flight: int = 4, max_background_in_flight: Optional[int] = None):
+        self.max_in_flight = max_in_flight
+        self.max_background_in_flight = (
+            max_background_in_flight if max_background_in_flight is not None else max(1, max_in_flight - 1)
+        )
+        # priority -> client_id -> waiting futures, client order is the round-robin order
+        self._waiters: Dict[int, "OrderedDict[Optional[str], deque]"] = {
+            priority: OrderedDict() for priority in PRIORITY_NAMES
+        }
+        self._in_flight = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wait_stats = {
+            priority: {"count": 0, "total": 0.0, "max": 0.0} for priority in PRIORITY_NAMES
+        }
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, client_id: Optional[str] = None) -> AsyncIterator[None]:
+        """Hold one generation slot for the duration of the block."""
+        await self.acquire(priority, client_id)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    async def acquire(self, priority: int = INTERACTIVE, client_id: Optional[str] = None) -> None:
+        started = time.monotonic()
+        if self._can_admit(priority) and not self._has_waiters(priority):
+            self._in_flight[priority] += 1
+            self._record_wait(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].setdefault(client_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled; give it back.
+                self.release(priority)
+            raise
+        self._record_wait(priority, time.monotonic() - started)
+
+    def release(self, priority: int = INTERACTIVE) -> None:
+        self._in_flight[priority] -= 1
+        self._dispatch()
+
+    def _can_admit(self, priority: int) -> bool:
+        if sum(self._in_flight.values()) >= self.max_in_flight:
+            return False
+        if priority == BACKGROUND and self._in_flight[BACKGROUND] >= self.max_background_in_flight:
+            return False
+        return True
+
+    def _has_waiters(self, priority: int) -> bool:
+        # Anyone already queued at this priority or a more urgent one goes first.
+        return any(self._waiters[p] for p in PRIORITY_NAMES if p <= priority)
+
+    def _dispatch(self) -> None:
+        for priority in sorted(PRIORITY_NAMES):
+            while self._can_admit(priority):
+                future = self._next_waiter(priority)
+                if future is None:
+                    break
+                self._in_flight[priority] += 1
+                future.set_result(None)
+
+    def _next_waiter(self, priority: int) -> Optional[asyncio.Future]:
+        clients = self._waiters[priority]
+        while clients:
+            client_id, queue = next(iter(clients.items()))
+            future = queue.popleft()
+            if queue:
+                clients.move_to_end(client_id)
+            else:
+                del clients[client_id]
+            if not future.cancelled():
+                return future
+        return None
+
+    def _record_wait(self, priority: int, seconds: float) -> None:
+        stats = self._wait_stats[priority]
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+    def queue_depth(self, priority: int) -> int:
+        return sum(
+            sum(1 for future in queue if not future.cancelled())
+            for queue in self._waiters[priority].values()
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        result = {"max_in_flight": self.max_in_flight}
+        for priority, name in PRIORITY_NAMES.items():
+            wait = self._wait_stats[priority]
+            result[name] = {
+                "in_flight": self._in_flight[priority],
+                "queue_depth": self.queue_depth(priority),
+                "waited": wait["count"],
+                "avg_wait": wait["total"] / wait["count"] if wait["count"] else 0.0,
+                "max_wait": wait["max"]
+            }
+        return result
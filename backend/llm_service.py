@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Awaitable
+
+from llm_cache import LLMResponseCache
+from llm_scheduler import LLMScheduler, INTERACTIVE
+from ollama_pool import OllamaBackendPool, OllamaBackend, is_retryable
+from model_warmup import KeepAlivePolicy
+from metrics import observe_ollama_response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama3.1"
+
+
+class LLMService:
+    """
+    Async wrapper around the pool of Ollama backends.
+
+    Each backend keeps its own pooled, keep-alive HTTP connections, and nothing
+    blocks the event loop while a generation is running. Every generation is
+    admitted through the scheduler, which caps concurrency and serves
+    interactive work first, and is then routed to a backend by the pool. A
+    call that fails with a connection or server error is retried on the next
+    backend. Calls that do not set `keep_alive` get the one from the policy.
+    """
+
+    def __init__(
+            self,
+            pool: OllamaBackendPool,
+            default_model: str = DEFAULT_MODEL,
+            default_timeout: Optional[float] = None,
+            response_cache: Optional[LLMResponseCache] = None,
+            scheduler: Optional[LLMScheduler] = None,
+            keep_alive_policy: Optional[KeepAlivePolicy] = None
+    ):
+        self.pool = pool
+        self.default_model = default_model
+        self.default_timeout = default_timeout
+        self.response_cache = response_cache
+        self.scheduler = scheduler or LLMScheduler()
+        self.keep_alive_policy = keep_alive_policy or KeepAlivePolicy()
+
+    async def chat(
+            self,
+            messages: List[Dict[str, str]],
+            model: Optional[str] = None,
+            timeout: Optional[float] = None,
+            cache: bool = False,
+            priority: int = INTERACTIVE,
+            client_id: Optional[str] = None,
+            conversation_id: Optional[str] = None,
+            **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Run a non-streaming chat completion, bounded by `timeout` seconds.
+
+        With `cache=True` the response is served from, and stored in, the
+        response cache, and identical concurrent calls share one generation.
+        Only use it for prompts whose answer should not vary between calls.
+        """
+        model = model or self.default_model
+        timeout = timeout if timeout is not None else self.default_timeout
+        kwargs.setdefault("keep_alive", self.keep_alive_policy.current())
+
+        async def call():
+            # Cache hits never get here, so they do not take a scheduler slot.
+            async with self.scheduler.slot(priority, client_id):
+                response = await self._with_failover(
+                    "chat",
+                    lambda backend: backend.client.chat(model=model, messages=messages, **kwargs),
+                    timeout,
+                    conversation_id
+                )
+            observe_ollama_response(model, response)
+            return response
+
+        if cache and self.response_cache is not None:
+            return await self.response_cache.get_or_call(model, messages, kwargs.get("options"), call)
+        return await call()
+
+    async def embed(
+            self,
+            texts: List[str],
+            model: str,
+            timeout: Optional[float] = None,
+            priority: int = INTERACTIVE,
+            client_id: Optional[str] = None,
+            **kwargs
+    ) -> List[List[float]]:
+        """Embed `texts` in one request and return one vector per text."""
+        timeout = timeout if timeout is not None else self.default_timeout
+        kwargs.setdefault("keep_alive", self.keep_alive_policy.current())
+        async with self.scheduler.slot(priority, client_id):
+            response = await self._with_failover(
+                "embed",
+                lambda backend: backend.client.embed(model=model, input=texts, **kwargs),
+                timeout
+            )
+        return response["embeddings"]
+
+    async def _with_failover(
+            self,
+            name: str,
+            request: Callable[[OllamaBackend], Awaitable[Any]],
+            timeout: Optional[float],
+            conversation_id: Optional[str] = None
+    ) -> Any:
+        """Run `request` on a backend, moving on to the next one after retryable failures."""
+        tried: List[OllamaBackend] = []
+        while True:
+            backend = self.pool.pick(conversation_id, exclude=tried)
+            try:
+                with self.pool.track(backend):
+                    response = await asyncio.wait_for(request(backend), timeout=timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.pool.mark_failed(backend, e)
+                tried.append(backend)
+                logger.warning(f"Retrying {name} on another Ollama backend after {backend.host} failed: {e}")
+                continue
+            self.pool.remember(conversation_id, backend)
+            return response
+
+    async def stream_chat(
+            self,
+            messages: List[Dict[str, str]],
+            model: Optional[str] = None,
+            timeout: Optional[float] = None,
+            priority: int = INTERACTIVE,
+            client_id: Optional[str] = None,
+            conversation_id: Optional[str] = None,
+            **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a chat completion chunk by chunk.
+
+        `timeout` bounds the wait for each chunk rather than the whole
+        generation, so long answers are not cut off while tokens keep flowing.
+        Failover only happens before the first chunk; after that a failure is
+        raised to the caller, which has already relayed part of the answer.
+        """
+        model = model or self.default_model
+        timeout = timeout if timeout is not None else self.default_timeout
+        kwargs.setdefault("keep_alive", self.keep_alive_policy.current())
+
+        # The slot is held until the last chunk, since the server is still busy
+        # generating until then.
+        async with self.scheduler.slot(priority, client_id):
+            tried: List[OllamaBackend] = []
+            while True:
+                backend = self.pool.pick(conversation_id, exclude=tried)
+                with self.pool.track(backend):
+                    started = False
+                    iterator = None
+                    try:
+                        stream = await asyncio.wait_for(
+                            backend.client.chat(model=model, messages=messages, stream=True, **kwargs),
+                            timeout=timeout
+                        )
+                        iterator = stream.__aiter__()
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+                            except StopAsyncIteration:
+                                break
+                            started = True
+                            if chunk.get("done"):
+                                observe_ollama_response(model, chunk)
+                            yield chunk
+                    except Exception as e:
+                        if started or not is_retryable(e):
+                            raise
+                        self.pool.mark_failed(backend, e)
+                        tried.append(backend)
+                        logger.warning(f"Retrying stream on another Ollama backend after {backend.host} failed: {e}")
+                        continue
+                    finally:
+                        # Closing the generator releases the pooled connection even when
+                        # the consumer stops early.
+                        aclose = getattr(iterator, "aclose", None)
+                        if aclose is not None:
+                            await aclose()
+                self.pool.remember(conversation_id, backend)
+                return
+
+    async def aclose(self) -> None:
+        """Close the backend connection pools and the response cache."""
+        if self.response_cache is not None:
+            await self.response_cache.close()
+        await self.pool.aclose()
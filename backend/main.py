@@ -5,19 +5,30 @@ import os
 import uuid
 import aiosqlite
 import fastapi.responses
-from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from models import ChatMessage, ChatResponse, SearchResponse, MovieMetadata, StreamingResponse, FileItem, SmbConfig, ImageSearchResult, SourceCodeAnalysisRequest, SourceCodeAnalysisResponse, SearchResult, Expense, Income, Metadata, DocumentAnalysisResult, CalendarEvent, CalendarEventRequest, FinancialData, LoginCredentials
-from config import setup_logging, setup_ollama, setup_calendar_api
+from models import ChatMessage, ChatResponse, ConversationSearchResponse, SearchResponse, MovieMetadata, StreamingResponse, FileItem, SmbConfig, ImageSearchResult, SourceCodeAnalysisRequest, SourceCodeAnalysisResponse, SearchResult, Expense, Income, Metadata, DocumentAnalysisResult, CalendarEvent, CalendarEventRequest, FinancialData, LoginCredentials
+from config import setup_logging, setup_ollama, setup_model_warmer, setup_vector_memory, setup_calendar_api
 from calendar_service import handle_calendar_request, is_calendar_request
-from chat_service import process_chat_request, get_conversation_history, store_message
-from search_service import perform_web_search, perform_image_search, is_search_request
+from search_service import perform_web_search, perform_image_search, is_search_request, fetch_search_context, format_search_context, search_client, search_cache
+from search_service import deep_search, search_all, stream_search_pages, next_start, MAX_RESULTS
+from thumbnail_cache import ThumbnailCache, thumbnail_response
+from context_service import ContextWindowManager
+from vector_memory import VectorMemory
+from chat_history import DatabaseManager
+from ws_sender import DROP_OLDEST
+from connection_manager import ConnectionManager
+from llm_scheduler import BACKGROUND
+from intent_router import intent_router, IntentMatch, dispatch
+from stage_timer import StageTimer
+from metrics import registry, MetricsMiddleware, CHAT_STAGE_SECONDS, DOCUMENT_PARSE_SECONDS, SMB_SECONDS
 from document_analysis_service import analyze_pdf, analyze_word, analyze_spreadsheet
 from expense_service import is_expense_request, handle_expense_request
 from expense_service import ExpenseTracker
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncGenerator, NamedTuple
+from contextlib import aclosing
 from fastapi import FastAPI, HTTPException
-from state import global_state
+from state import SessionStore, State
 from capital_one import login_navigate_and_download_capital_one
 import json, base64
 from pydantic import BaseModel
@@ -53,9 +64,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Setup Ollama and Google Calendar API
 ollama_client = setup_ollama()
+model_warmer = setup_model_warmer(ollama_client)
 setup_calendar_api()
 
 # Setup SQLite database
@@ -110,67 +123,23 @@ def increase_socket_buffer_size():
         logger.warning(f"Failed to increase socket buffer size: {e}")
 
 
-class DatabaseManager:
-    def __init__(self, db_path: str = 'chat_history.db'):
-        self.db_path = db_path
-        self._init_db()
-
-    def _init_db(self):
-        """Initialize the database with required tables."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id TEXT,
-                role TEXT,
-                content TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
-
-    async def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
-        """Retrieve conversation history from the database."""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                async with db.execute("""
-                    SELECT role, content 
-                    FROM conversations 
-                    WHERE conversation_id = ?
-                    ORDER BY timestamp
-                """, (conversation_id,)) as cursor:
-                    rows = await cursor.fetchall()
-
-                    return [
-                        {
-                            "isUser": row[0] == "user",
-                            "text": row[1]
-                        }
-                        for row in rows
-                    ]
-        except Exception as e:
-            logger.error(f"Error retrieving conversation history: {e}")
-            return []
-
-    async def store_message(self, conversation_id: str, role: str, content: str) -> None:
-        """Store a message in the database."""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    INSERT INTO conversations (conversation_id, role, content)
-                    VALUES (?, ?, ?)
-                """, (conversation_id, role, content))
-                await db.commit()
-        except Exception as e:
-            logger.error(f"Error storing message: {e}")
-
-
 class ChatProcessor:
-    def __init__(self, ollama_client, db_manager: DatabaseManager):
+    def __init__(
+            self,
+            ollama_client,
+            db_manager: DatabaseManager,
+            context_manager: ContextWindowManager,
+            vector_memory: Optional[VectorMemory] = None,
+            recall_k: int = 5
+    ):
         self.ollama_client = ollama_client
         self.db_manager = db_manager
+        self.context_manager = context_manager
+        self.vector_memory = vector_memory
+        self.recall_k = recall_k
+        # Generations abandoned by their client, and the tokens they had produced
+        self.cancelled_generations = 0
+        self.cancelled_tokens = 0
         self.system_prompt = {"role": "system", "content": "You are a helpful AI assistant."}
 
     def format_conversation_history(self, history: List[Dict[str, Any]]) -> List[Dict[str, str]]:
@@ -185,44 +154,145 @@ class ChatProcessor:
 
         return formatted
 
-    async def process_chat_request(
+    async def recall(self, client_id: Optional[str], user_input: str) -> List[Dict[str, str]]:
+        """Past turns from the client's other conversations that relate to `user_input`."""
+        if self.vector_memory is None:
+            return []
+        hits = await self.vector_memory.recall(client_id, user_input, self.recall_k)
+        return [{"role": hit.role, "content": hit.content} for hit in hits]
+
+    async def build_prompt(
             self,
             user_input: str,
             conversation_history: List[Dict[str, Any]],
-            client_id: str
-    ) -> Dict[str, Any]:
-        """Process a chat request and return a response."""
-        try:
-            formatted_conversation = self.format_conversation_history(conversation_history)
-            formatted_conversation.append({
-                "role": "user",
-                "content": user_input
-            })
-
-            logger.debug(f"Sending conversation to Ollama for client {client_id}: {formatted_conversation}")
+            conversation_id: Optional[str] = None,
+            grounding: Optional[str] = None,
+            memories: Optional[List[Dict[str, str]]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Format the history and fit it, plus the new user input, past turns
+        recalled from the client's other conversations (see `recall`) and any
+        grounding text such as search results, into the context budget.
+        """
+        formatted = self.format_conversation_history(conversation_history)
+        return await self.context_manager.build_messages(
+            self.system_prompt,
+            formatted[1:],
+            user_input,
+            conversation_id,
+            memories,
+            grounding
+        )
 
-            response = self.ollama_client.chat(
-                model="llama3.1",
-                messages=formatted_conversation
-            )
+    def remember(self, client_id: Optional[str], conversation_id: str, role: str, content: str) -> None:
+        """Add a stored message to the client's long-term memory in the background."""
+        if self.vector_memory is not None and client_id:
+            self.vector_memory.remember(client_id, conversation_id, role, content)
 
-            assistant_message = response['message']['content']
+    async def process_chat_request(
+            self,
+            user_input: str,
+            conversation_history: List[Dict[str, Any]],
+            client_id: str,
+            conversation_id: Optional[str] = None,
+            grounding: Optional[str] = None,
+            timer: Optional[StageTimer] = None,
+            memories: Optional[List[Dict[str, str]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Process a chat request and return a response.
 
-            logger.debug(f"Received response from Ollama for client {client_id}: {assistant_message}")
+        The answer is streamed from Ollama and assembled here, so cancelling
+        the request stops generation at the next token.
+        """
+        async with aclosing(self.stream_chat_request(
+                user_input, conversation_history, client_id, conversation_id, grounding, timer, memories
+        )) as events:
+            async for event in events:
+                if event["type"] == "chat_done":
+                    return {"type": "chat", "message": event["message"], "metadata": event["metadata"]}
+                if event["type"] == "error":
+                    return event
+        raise RuntimeError("Chat stream ended without a result")
+
+    async def stream_chat_request(
+            self,
+            user_input: str,
+            conversation_history: List[Dict[str, Any]],
+            client_id: str,
+            conversation_id: Optional[str] = None,
+            grounding: Optional[str] = None,
+            timer: Optional[StageTimer] = None,
+            memories: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Stream a chat response token by token.
 
-            return {
-                "type": "chat",
+        Yields "chat_token" events as Ollama produces them, followed by a single
+        "chat_done" event carrying the full message, or an "error" event. If
+        the consumer is cancelled or closes the generator early, the upstream
+        stream is closed, which makes Ollama stop generating. With a `timer`,
+        the prompt build, time to first token and generation are recorded on it.
+        """
+        timer = timer or StageTimer()
+        parts = []
+        finished = False
+        try:
+            with timer.stage("prompt"):
+                formatted_conversation = await self.build_prompt(
+                    user_input, conversation_history, conversation_id, grounding, memories
+                )
+
+            logger.debug(f"Streaming conversation to Ollama for client {client_id}: {formatted_conversation}")
+
+            final_chunk = {}
+            with timer.stage("generation"):
+                async with aclosing(self.ollama_client.stream_chat(
+                    model="llama3.1",
+                    messages=formatted_conversation,
+                    client_id=client_id,
+                    conversation_id=conversation_id
+                )) as stream:
+                    async for chunk in stream:
+                        token = chunk.get('message', {}).get('content', '')
+                        if token:
+                            if not parts:
+                                timer.mark("first_token")
+                            parts.append(token)
+                            yield {
+                                "type": "chat_token",
+                                "message": token,
+                                "metadata": {"client_id": client_id}
+                            }
+
+                        if chunk.get('done'):
+                            final_chunk = chunk
+
+            assistant_message = "".join(parts)
+
+            logger.debug(f"Finished streaming response from Ollama for client {client_id}: {assistant_message}")
+
+            finished = True
+            yield {
+                "type": "chat_done",
                 "message": assistant_message,
                 "metadata": {
-                    "tokens_evaluated": response.get('eval_count', 0),
-                    "duration": response.get('eval_duration', 0),
-                    "client_id": client_id
+                    "tokens_evaluated": final_chunk.get('eval_count', 0),
+                    "duration": final_chunk.get('eval_duration', 0),
+                    "client_id": client_id,
+                    "timings_ms": timer.as_ms()
                 }
             }
 
+        except (asyncio.CancelledError, GeneratorExit):
+            if not finished:
+                self.cancelled_generations += 1
+                self.cancelled_tokens += len(parts)
+                logger.info(f"Generation for client {client_id} cancelled after {len(parts)} tokens")
+            raise
         except Exception as e:
-            logger.error(f"Error in chat processing for client {client_id}: {str(e)}", exc_info=True)
-            return {
+            logger.error(f"Error in streaming chat for client {client_id}: {str(e)}", exc_info=True)
+            yield {
                 "type": "error",
                 "message": "I'm sorry, but I encountered an error while processing your request. Please try again.",
                 "metadata": {
@@ -231,6 +301,12 @@ class ChatProcessor:
                 }
             }
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cancelled_generations": self.cancelled_generations,
+            "cancelled_tokens": self.cancelled_tokens
+        }
+
 class ConversationManager:
     """Handle conversation storage and retrieval."""
 
@@ -274,143 +350,313 @@ class ConversationManager:
         except Exception as e:
             logger.error(f"Error storing message: {e}")
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-        logger.info(f"New client connected: {client_id}")
-
-    def disconnect(self, client_id: str):
-        self.active_connections.pop(client_id, None)
-        logger.info(f"Client disconnected: {client_id}")
-
-    async def send_message(self, message: str, client_id: str):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_text(message)
+# Messages routed to search are answered from this many web results, fetched
+# concurrently with the history; a slow search is given up after the timeout.
+CHAT_SEARCH_RESULTS = int(os.getenv('CHAT_SEARCH_RESULTS', '5'))
+CHAT_SEARCH_TIMEOUT = float(os.getenv('CHAT_SEARCH_TIMEOUT', '5'))
+# /api/search?type=all returns whichever side is done after this many seconds.
+SEARCH_ALL_TIMEOUT = float(os.getenv('SEARCH_ALL_TIMEOUT', '8'))
 
 # Initialize database and chat processor
 db_manager = DatabaseManager()
-manager = ConnectionManager()
-chat_processor = ChatProcessor(ollama_client, db_manager)
+manager = ConnectionManager(
+    max_queue=int(os.getenv('WS_SEND_QUEUE_SIZE', '256')),
+    overflow_policy=os.getenv('WS_OVERFLOW_POLICY', DROP_OLDEST),
+    binary_min_bytes=int(os.getenv('WS_BINARY_MIN_BYTES', '4096')),
+    replay_frames=int(os.getenv('WS_REPLAY_FRAMES', '1024')),
+    resume_grace=float(os.getenv('WS_RESUME_GRACE', '120')),
+    generation_grace=float(os.getenv('WS_GENERATION_GRACE', '15')),
+    metrics_connections=int(os.getenv('WS_METRICS_CONNECTIONS', '20'))
+)
+context_manager = ContextWindowManager(
+    ollama_client,
+    token_budget=int(os.getenv('CHAT_CONTEXT_TOKENS', '3000')),
+    refresh_after=int(os.getenv('CHAT_SUMMARY_REFRESH_TURNS', '6'))
+)
+vector_memory = setup_vector_memory(ollama_client)
+chat_processor = ChatProcessor(
+    ollama_client,
+    db_manager,
+    context_manager,
+    vector_memory,
+    recall_k=int(os.getenv('VECTOR_MEMORY_RECALL_K', '5'))
+)
 conversation_manager = ConversationManager(c)
+session_store = SessionStore(
+    ttl=float(os.getenv('SESSION_TTL', '3600')),
+    db_path=os.getenv('SESSION_DB') or None
+)
 
+thumbnail_cache = ThumbnailCache(
+    directory=os.getenv('THUMBNAIL_CACHE_DIR', 'thumbnails'),
+    max_bytes=int(os.getenv('THUMBNAIL_CACHE_MAX_MB', '256')) * 1024 * 1024,
+    max_dimension=int(os.getenv('THUMBNAIL_MAX_DIMENSION', '256')),
+    quality=int(os.getenv('THUMBNAIL_QUALITY', '70')),
+    allow_private_hosts=os.getenv('THUMBNAIL_ALLOW_PRIVATE_HOSTS', 'false').lower() in ('1', 'true', 'yes')
+)
 
+# Component stats, exposed as gauges on /metrics
+registry.register_stats("history_cache", db_manager.history_cache.stats)
+registry.register_stats("message_writer", db_manager.writer.stats)
+registry.register_stats("chat", chat_processor.stats)
+registry.register_stats("websocket", manager.stats)
+registry.register_stats("websocket_connection", manager.connection_stats, label="client_id")
+registry.register_stats("llm_scheduler", ollama_client.scheduler.stats)
+registry.register_stats("ollama_backend", ollama_client.pool.stats, label="host")
+if ollama_client.response_cache is not None:
+    registry.register_stats("llm_cache", ollama_client.response_cache.stats)
+if vector_memory is not None:
+    registry.register_stats("vector_memory", vector_memory.stats)
+registry.register_stats("search_client", search_client.stats)
+registry.register_stats("search_cache", search_cache.stats)
+registry.register_stats("thumbnail_cache", thumbnail_cache.stats)
+
+
+@app.on_event("startup")
+async def startup_event():
+    await db_manager.connect()
+    await model_warmer.warm_up(timeout=float(os.getenv('OLLAMA_WARMUP_TIMEOUT', '120')))
+    ollama_client.pool.start()
+    model_warmer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await db_manager.close()
+    await session_store.close()
+    if vector_memory is not None:
+        await vector_memory.close()
+    await model_warmer.aclose()
+    await ollama_client.aclose()
+    await search_cache.close()
+    await search_client.aclose()
+    await thumbnail_cache.aclose()
 
-async def process_chat_request(user_input: str, conversation_history: List[Dict[str, str]], ollama_client, client_id: str):
-    # Format the conversation history
-    formatted_conversation = [
-        {"role": "system", "content": "You are a helpful AI assistant."}
-    ]
-
-    # Add conversation history if it exists
-    if conversation_history:
-        for message in conversation_history:
-            formatted_conversation.append({
-                "role": "user" if message.get("isUser", False) else "assistant",
-                "content": message.get("text", "")
-            })
-
-    # Add the new user input
-    formatted_conversation.append({"role": "user", "content": user_input})
-
-    try:
-        logger.debug(f"Sending conversation to Ollama: {formatted_conversation}")
-
-        # Generate response using Ollama (synchronous call)
-        response = ollama_client.chat(model="llama3.1", messages=formatted_conversation)
-
-        assistant_message = response['message']['content']
-
-        logger.debug(f"Received response from Ollama: {assistant_message}")
-
-        result = {
-            "type": "chat",
-            "message": assistant_message,
-            "metadata": {
-                "tokens_evaluated": response.get('eval_count', 0),
-                "duration": response.get('eval_duration', 0)
-            }
-        }
-
-        # Send the response to the client via WebSocket
-        await manager.send_message(json.dumps(result), client_id)
-
-        return result
-    except Exception as e:
-        logger.error(f"Error in chat processing: {str(e)}", exc_info=True)
-        error_message = {
-            "type": "error",
-            "message": "I'm sorry, but I encountered an error while processing your request. Could you please try again?",
-            "metadata": {
-                "error": str(e)
-            }
-        }
-        await manager.send_message(json.dumps(error_message), client_id)
-        return error_message
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+    # Clients that can decode msgpack opt in with ?encoding=msgpack; a client
+    # reconnecting passes the last sequence number it saw as ?resume=<seq>.
+    resume = websocket.query_params.get('resume')
+    session = await manager.connect(
+        websocket,
+        client_id,
+        binary=websocket.query_params.get('encoding') == 'msgpack',
+        resume_from=int(resume) if resume and resume.lstrip('-').isdigit() else None
+    )
+
+    async def run_turn(message: Dict[str, Any]):
+        # Turns run in their own tasks so the loop below keeps reading and sees
+        # a disconnect or a cancel request right away; the session's lock keeps
+        # them in order, across reconnects too.
+        async with session.turn_lock:
+            await process_message(message, client_id)
+
     try:
         while True:
             data = await websocket.receive_text()
-            # ... (your existing WebSocket logic)
+            try:
+                message = json.loads(data)
+            except json.JSONDecodeError as e:
+                await manager.send_message({"error": f"Invalid JSON: {e}"}, client_id)
+                continue
+            if not isinstance(message, dict):
+                await manager.send_message({"error": "Expected a JSON object"}, client_id)
+                continue
+            if message.get('type') == 'cancel':
+                cancelled = manager.cancel_generations(client_id)
+                logger.info(f"Client {client_id} cancelled {cancelled} generations")
+                continue
+            manager.start_generation(client_id, run_turn(message))
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket closed by client {client_id}")
     except Exception as e:
         logger.error(f"WebSocket error for client {client_id}: {str(e)}")
     finally:
-        manager.disconnect(client_id)
+        await manager.disconnect(client_id, websocket)
 
-async def process_message(data: str, client_id: str):
+async def process_message(message: Dict[str, Any], client_id: str):
     try:
-        message = json.loads(data)
         message_type = message.get('type')
 
         if message_type == 'chat':
             logger.debug(f"Processing chat message for client {client_id}: {message['message']}")
-            response = chat_processor.process_chat_request(
-                message['message'],
-                message.get('conversation_history', []),
-                ollama_client
-            )
-            logger.debug(f"Sending response to client {client_id}: {response}")
-            await manager.send_message(json.dumps(response), client_id)
+            conversation_id = message.get('conversation_id') or client_id
+            async with aclosing(stream_chat_events(message['message'], conversation_id, client_id)) as events:
+                async for event in events:
+                    await manager.send_message(event, client_id)
         else:
             logger.warning(f"Unknown message type received from client {client_id}: {message_type}")
-            await manager.send_message(json.dumps({"error": "Unknown message type"}), client_id)
+            await manager.send_message({"error": "Unknown message type"}, client_id)
     except Exception as e:
         logger.error(f"Error processing message for client {client_id}: {str(e)}", exc_info=True)
-        await manager.send_message(json.dumps({"error": str(e)}), client_id)
-
+        await manager.send_message({"error": str(e)}, client_id)
+
+
+def record_turn_timings(conversation_id: str, timer: StageTimer) -> Dict[str, float]:
+    """Log a chat turn's stage timings, feed them to the stage histogram and return them in ms."""
+    for stage, seconds in timer.stages.items():
+        CHAT_STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = timer.as_ms()
+    CHAT_STAGE_SECONDS.observe(timings["total"] / 1000, stage="total")
+    logger.info(f"Chat turn timings for conversation {conversation_id}: {timings}")
+    return timings
+
+
+class TurnContext(NamedTuple):
+    intent: Optional[IntentMatch]
+    session: State
+    history: List[Dict[str, Any]]
+    grounding: Optional[str]
+    memories: List[Dict[str, str]]
+
+
+async def load_turn_context(user_input: str, conversation_id: str, client_id: str, timer: StageTimer) -> TurnContext:
+    """
+    Route the message and load what answering it takes: the conversation's
+    session, its history, the memories recalled from the client's other
+    conversations and, for messages routed to search, the web results to
+    ground the answer in.
+
+    The intent is settled against the session first, because a multi-step
+    flow in progress takes the message whatever it says: a reply inside an
+    expense flow that happens to contain a search phrase must not fire a
+    paid search. The history loads meanwhile, and recall and search then
+    run alongside it, so the turn waits for the slowest of them rather than
+    their sum. Messages answered by an intent handler skip recall, which
+    only feeds the model.
+    """
+    # Route once; every service's trigger phrases are matched in a single pass
+    intent = intent_router.route(user_input)
+    history = asyncio.ensure_future(timer.measure("history", db_manager.get_conversation_history(conversation_id)))
+    try:
+        # Multi-step flow state belongs to this conversation only
+        session = await timer.measure("session", session_store.get(conversation_id))
+    except BaseException:
+        history.cancel()
+        raise
+    if session.flow:
+        intent = intent_router.resume(session.flow, user_input) or intent
+
+    query = intent.args.get("query") if intent is not None and intent.name == 'search' else None
+    recall = chat_processor.recall(client_id, user_input) if intent is None or intent.handler is None else None
+    search = fetch_search_context(query, num_results=CHAT_SEARCH_RESULTS, timeout=CHAT_SEARCH_TIMEOUT) if query else None
+    conversation_history, memories, results = await asyncio.gather(
+        history,
+        timer.measure("recall", recall) if recall else asyncio.sleep(0, []),
+        timer.measure("search", search) if search else asyncio.sleep(0, [])
+    )
+    grounding = format_search_context(query, results) if results else None
+    return TurnContext(intent, session, conversation_history, grounding, memories)
+
+
+async def stream_chat_events(user_input: str, conversation_id: str, client_id: str) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Run one streamed chat turn: load history (and search results when the
+    message asks for a search), store the user message, relay tokens as they
+    arrive and persist the assistant message once complete. Messages routed
+    to an intent handler get its whole reply as a single chat_done event.
+    """
+    timer = StageTimer()
+    intent, session, conversation_history, grounding, memories = await load_turn_context(
+        user_input, conversation_id, client_id, timer
+    )
+    await db_manager.store_message(conversation_id, 'user', user_input)
+    chat_processor.remember(client_id, conversation_id, 'user', user_input)
+
+    if intent is not None and intent.handler is not None:
+        with timer.stage("handler"):
+            response = await dispatch(intent, user_input, session)
+        await session_store.save(conversation_id, session)
+        await db_manager.store_message(conversation_id, 'assistant', response.message)
+        chat_processor.remember(client_id, conversation_id, 'assistant', response.message)
+        yield {
+            "type": "chat_done",
+            "message": response.message,
+            "metadata": {
+                **response.metadata,
+                "client_id": client_id,
+                "conversation_id": conversation_id,
+                "event_creation_stage": session.event_creation_stage,
+                "timings_ms": record_turn_timings(conversation_id, timer)
+            }
+        }
+        return
+
+    async with aclosing(chat_processor.stream_chat_request(
+            user_input, conversation_history, client_id, conversation_id, grounding, timer, memories
+    )) as events:
+        async for event in events:
+            if event["type"] == "chat_done":
+                await db_manager.store_message(conversation_id, 'assistant', event['message'])
+                chat_processor.remember(client_id, conversation_id, 'assistant', event['message'])
+                event["metadata"]["conversation_id"] = conversation_id
+                record_turn_timings(conversation_id, timer)
+            yield event
+
+
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(chat_message: ChatMessage):
+    """Server-Sent-Events variant of /api/chat that emits tokens as they are generated."""
+    logger.info(f"Received streaming chat message: {chat_message.message} for conversation: {chat_message.conversation_id}, client: {chat_message.client_id}")
+
+    async def event_stream():
+        # Starlette cancels this stream when the client disconnects.
+        with manager.track_generation(chat_message.client_id):
+            async with aclosing(stream_chat_events(chat_message.message, chat_message.conversation_id, chat_message.client_id)) as events:
+                async for event in events:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return fastapi.responses.StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 @app.post("/api/chat")
-async def chat_endpoint(chat_message: ChatMessage):
+async def chat_endpoint(chat_message: ChatMessage, request: Request):
+    return await manager.run_for_request(chat_message.client_id, chat_turn(chat_message), request)
+
+
+async def chat_turn(chat_message: ChatMessage) -> ChatResponse:
     user_input = chat_message.message
     conversation_id = chat_message.conversation_id
     client_id = chat_message.client_id
 
     logger.info(f"Received chat message: {user_input} for conversation: {conversation_id}, client: {client_id}")
+    timer = StageTimer()
 
-    # Get conversation history using the database manager
-    conversation_history = await db_manager.get_conversation_history(conversation_id)
+    # Intent, session, history, recalled memories and search results
+    intent, session, conversation_history, grounding, memories = await load_turn_context(
+        user_input, conversation_id, client_id, timer
+    )
 
     # Store user message
     await db_manager.store_message(conversation_id, 'user', user_input)
+    chat_processor.remember(client_id, conversation_id, 'user', user_input)
 
-    if is_calendar_request(user_input):
-        response = handle_calendar_request(user_input)
+    if intent is not None and intent.handler is not None:
+        with timer.stage("handler"):
+            response = (await dispatch(intent, user_input, session)).model_dump()
     else:
         response = await chat_processor.process_chat_request(
             user_input,
             conversation_history,
-            client_id
+            client_id,
+            conversation_id,
+            grounding,
+            timer,
+            memories
         )
+    timings = record_turn_timings(conversation_id, timer)
 
     # Store assistant response
     await db_manager.store_message(conversation_id, 'assistant', response['message'])
+    chat_processor.remember(client_id, conversation_id, 'assistant', response['message'])
+    await session_store.save(conversation_id, session)
 
     return ChatResponse(
         message=response['message'],
@@ -418,26 +664,118 @@ async def chat_endpoint(chat_message: ChatMessage):
             "conversation_id": conversation_id,
             "duration": response['metadata'].get("duration"),
             "tokens_evaluated": response['metadata'].get("tokens_evaluated"),
-            "event_creation_stage": global_state.event_creation_stage if is_calendar_request(user_input) else None
+            "event_creation_stage": session.event_creation_stage,
+            "grounded_in_search": grounding is not None,
+            "timings_ms": timings
         }
     )
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus scrape target."""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/search", response_model=SearchResponse)
-async def search_endpoint(q: str, type: str = "web"):
-    logger.info(f"Received search request: {q}, type: {type}")
+async def search_endpoint(
+        q: str,
+        type: str = "web",
+        num: int = Query(5, ge=1, le=MAX_RESULTS),
+        start: int = Query(1, ge=1, le=MAX_RESULTS),
+        stream: bool = False
+):
+    """
+    Web or image search, or both at once with `type=all`. `num` may exceed
+    the API's page size: the pages are fetched concurrently and merged. With
+    `stream=true` the results come as Server-Sent Events, one "page" event
+    per page as it arrives, then "done".
+    """
+    logger.info(f"Received search request: {q}, type: {type}, num: {num}, start: {start}")
+    if type.lower() == "all":
+        if stream:
+            raise HTTPException(status_code=400, detail="stream is not supported with type=all")
+        try:
+            results, images, cursor, errors = await search_all(q, num, start, timeout=SEARCH_ALL_TIMEOUT)
+            return SearchResponse(results=results, images=images, next_start=cursor, errors=errors or None)
+        except Exception as e:
+            logger.error(f"Error performing search: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"An error occurred while performing the search: {str(e)}")
+
+    search_type = "image" if type.lower() == "image" else "web"
+    field = "images" if search_type == "image" else "results"
+
+    if stream:
+        return fastapi.responses.StreamingResponse(
+            search_event_stream(search_type, q, num, start),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
+        )
 
     try:
-        if type.lower() == "image":
-            image_results = perform_image_search(q)
-            return SearchResponse(images=image_results)
-        else:
-            search_results = perform_web_search(q)
-            return SearchResponse(results=search_results)
+        results, cursor = await deep_search(search_type, q, num, start)
+        return SearchResponse(**{field: results}, next_start=cursor)
     except Exception as e:
         logger.error(f"Error performing search: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An error occurred while performing the search: {str(e)}")
 
 
+async def search_event_stream(search_type: str, query: str, num_results: int, start: int) -> AsyncGenerator[str, None]:
+    field = "images" if search_type == "image" else "results"
+    pages = []
+    # Starlette closes this stream when the client disconnects, which cancels
+    # the pages still being fetched.
+    async with aclosing(stream_search_pages(search_type, query, num_results, start)) as stream:
+        async for page in stream:
+            pages.append(page)
+            if page.error is not None:
+                event = {"type": "page_error", "start": page.start, "error": str(page.error)}
+            else:
+                event = {"type": "page", "start": page.start, field: [result.dict() for result in page.results]}
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    done = {"type": "done", "next_start": next_start(pages, num_results, start)}
+    yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+
+@app.get("/api/thumb")
+async def thumbnail_endpoint(url: str, request: Request):
+    """
+    Serve a search result thumbnail through the local cache, downsized and
+    re-encoded. Clients revalidate with If-None-Match.
+    """
+    thumbnail = await thumbnail_cache.get(url)
+    return thumbnail_response(thumbnail, request.headers.get("if-none-match"))
+
+
+@app.get("/api/conversations/search", response_model=ConversationSearchResponse)
+async def search_conversations_endpoint(
+        q: str,
+        limit: int = Query(20, ge=1, le=100),
+        offset: int = Query(0, ge=0),
+        conversation_id: Optional[str] = None
+):
+    logger.info(f"Received conversation search: {q}, limit: {limit}, offset: {offset}")
+
+    try:
+        total, hits = await db_manager.search_messages(q, limit=limit, offset=offset, conversation_id=conversation_id)
+    except Exception as e:
+        logger.error(f"Error searching conversations: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"An error occurred while searching conversations: {str(e)}")
+
+    return ConversationSearchResponse(query=q, total=total, limit=limit, offset=offset, results=hits)
+
+
+@app.post("/api/conversations/compact")
+async def compact_conversations_endpoint(idle_days: Optional[float] = Query(None, ge=0)):
+    """Archive idle conversations now instead of waiting for the next scheduled run."""
+    try:
+        return await db_manager.compact_idle_conversations(idle_days * 86400 if idle_days is not None else None)
+    except Exception as e:
+        logger.error(f"Error compacting conversations: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"An error occurred while compacting conversations: {str(e)}")
+
+
 # Add this new function for source code analysis
 def analyze_source_code(code: str, filename: str) -> SourceCodeAnalysisResponse:
     try:
@@ -506,11 +844,14 @@ async def analyze_document(file: UploadFile = File(...)):
         file_extension = file.filename.split('.')[-1].lower()
 
         if file_extension == 'pdf':
-            content, metadata = analyze_pdf(file_content)
+            with DOCUMENT_PARSE_SECONDS.time(format=file_extension):
+                content, metadata = analyze_pdf(file_content)
         elif file_extension in ['doc', 'docx']:
-            content, metadata = analyze_word(file_content)
+            with DOCUMENT_PARSE_SECONDS.time(format=file_extension):
+                content, metadata = analyze_word(file_content)
         elif file_extension in ['xls', 'xlsx', 'csv']:
-            content, metadata, excel_data = analyze_spreadsheet(file_content, file_extension)
+            with DOCUMENT_PARSE_SECONDS.time(format=file_extension):
+                content, metadata, excel_data = analyze_spreadsheet(file_content, file_extension)
         elif file_extension in ['txt', 'py', 'js', 'java', 'cpp', 'cs', 'go', 'rb', 'php', 'swift', 'kt']:
             # For text-based files, treat them as source code and use the LLM
             analysis_result = await analyze_source_code_with_llm(file_content.decode('utf-8'), file.filename, ollama_client)
@@ -572,10 +913,10 @@ Please provide:
 Format your response in markdown for easy reading."""
 
         # Get AI analysis
-        response = ollama_client.chat(model="llama3.1", messages=[
+        response = await ollama_client.chat(model="llama3.1", messages=[
             {"role": "system", "content": "You are a helpful financial advisor."},
             {"role": "user", "content": prompt}
-        ])
+        ], options={"temperature": 0}, cache=True, priority=BACKGROUND)
 
         ai_analysis = response['message']['content']
 
@@ -658,16 +999,14 @@ Suggestions:
 Security Concerns: [list any security concerns or "None identified" if none]
 """
 
-        # Create a mock conversation history with the prompt as the user's message
-        conversation_history = [
-            {'role': 'user', 'content': prompt}
-        ]
-
         # Send the prompt to the LLM
-        response = await chat_processor.process_chat_request(prompt, conversation_history, ollama_client)
+        response = await ollama_client.chat(model="llama3.1", messages=[
+            {"role": "system", "content": "You are a helpful AI assistant."},
+            {"role": "user", "content": prompt}
+        ], options={"temperature": 0}, cache=True, priority=BACKGROUND)
 
         # Parse the LLM's response
-        lines = response.message.split('\n')
+        lines = response['message']['content'].split('\n')
         language = next((line.split(': ')[1] for line in lines if line.startswith('Language:')), 'Unknown')
         summary = next((line.split(': ')[1] for line in lines if line.startswith('Summary:')), 'No summary provided')
         complexity = next((line.split(': ')[1] for line in lines if line.startswith('Complexity:')), 'Unknown')
@@ -748,7 +1087,8 @@ async def stream_movie_endpoint(share_name: str, path: str):
         full_path = str(Path(share.path) / clean_path.lstrip('\\/'))
 
         # Get file info
-        file_obj = conn.getAttributes(share_name, full_path)
+        with SMB_SECONDS.time(operation="attributes"):
+            file_obj = conn.getAttributes(share_name, full_path)
         file_size = file_obj.file_size
 
         # Create a temp file and stream from it
@@ -757,17 +1097,18 @@ async def stream_movie_endpoint(share_name: str, path: str):
         # Download file in chunks to temp file
         chunk_size = 8192
         offset = 0
-        while offset < file_size:
-            chunk = conn.retrieveFileFromOffset(
-                share_name,
-                full_path,
-                temp_file,
-                offset,
-                chunk_size
-            )
-            if not chunk:
-                break
-            offset += chunk_size
+        with SMB_SECONDS.time(operation="read"):
+            while offset < file_size:
+                chunk = conn.retrieveFileFromOffset(
+                    share_name,
+                    full_path,
+                    temp_file,
+                    offset,
+                    chunk_size
+                )
+                if not chunk:
+                    break
+                offset += chunk_size
 
         temp_file.close()
         conn.close()
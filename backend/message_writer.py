@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+import aiosqlite
+
+from metrics import DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+
+    `enqueue` returns immediately; a single writer task drains the queue and
+    inserts everything that arrived within `flush_interval` seconds (or up to
+    `batch_size` rows) in one transaction, so many messages share one commit.
+
+    Rows stay visible through `pending_for` until their batch has committed.
+    Readers hold `lock` while they query and then read the pending rows, so a
+    row is never missed or counted twice while a batch is in flight.
+    """
+
+    def __init__(
+            self,
+            get_db: Callable[[], Awaitable[aiosqlite.Connection]],
+            batch_size: int = 200,
+            flush_interval: float = 0.005
+    ):
+        self.get_db = get_db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = asyncio.Lock()
+        self._queue: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.batches_written = 0
+        self.rows_written = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Flush everything still queued and stop the writer task. A flush that
+        fails is logged rather than raised, so shutdown can carry on and close
+        the connection; the rows still queued are lost.
+        """
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        # Anything enqueued after the task exited still gets written.
+        while self._queue:
+            try:
+                await self._write_batch()
+            except Exception as e:
+                logger.error(f"Error flushing chat messages on shutdown, dropping {len(self._queue)} unsaved: {e}")
+                return
+
+    def enqueue(self, conversation_id: str, role: str, content: str) -> None:
+        # Stamp rows on arrival, in the same format as CURRENT_TIMESTAMP, so
+        # history ordering does not depend on when the batch is flushed.
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._queue.append((conversation_id, role, content, timestamp))
+        self._wakeup.set()
+
+    def pending_for(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Queued rows for `conversation_id` that are not committed yet, oldest first."""
+        return [
+            {"role": row[1], "content": row[2]}
+            for row in self._queue
+            if row[0] == conversation_id
+        ]
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._queue),
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._closing and len(self._queue) < self.batch_size:
+                # Give other requests a moment to join this commit.
+                await asyncio.sleep(self.flush_interval)
+
+            while self._queue:
+                try:
+                    await self._write_batch()
+                except Exception as e:
+                    logger.error(f"Error writing message batch, will retry: {e}")
+                    if self._closing:
+                        return
+                    await asyncio.sleep(max(self.flush_interval, 0.5))
+
+            if self._closing:
+                return
+
+    async def _write_batch(self) -> None:
+        batch = [self._queue[i] for i in range(min(self.batch_size, len(self._queue)))]
+        db = await self.get_db()
+        async with self.lock:
+            with DB_SECONDS.time(operation="batch_write"):
+                try:
+                    await db.executemany("""
+                        INSERT INTO conversations (conversation_id, role, content, timestamp)
+                        VALUES (?, ?, ?, ?)
+                    """, batch)
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+                for _ in batch:
+                    self._queue.popleft()
+        self.batches_written += 1
+        self.rows_written += len(batch)
+        logger.debug(f"Committed {len(batch)} chat messages in one transaction")
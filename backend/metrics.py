@@ -0,0 +1,311 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple, Iterable, Iterator, Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache hit to a long generation.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# One exposed sample: metric name suffix, labels and value.
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, one series per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "_total", dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """
+    Cumulative-bucket histogram of observed values, as Prometheus expects, so
+    quantiles can be computed server-side with histogram_quantile().
+    """
+
+    kind = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: per-bucket (non-cumulative) counts, then sum and count.
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall-clock duration of the block, in seconds, even if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        for key, values in series:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values):
+                cumulative += count
+                yield "_bucket", dict(labels, le=_format_value(bound)), cumulative
+            yield "_sum", labels, values[-2]
+            yield "_count", labels, values[-1]
+
+
+def _flatten(prefix: str, value: Any, out: Dict[str, float]) -> None:
+    if isinstance(value, bool):
+        out[prefix] = 1.0 if value else 0.0
+    elif isinstance(value, (int, float)):
+        out[prefix] = float(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}_{key}", item, out)
+
+
+class MetricsRegistry:
+    """
+    All metrics of the process, rendered in the Prometheus text format.
+
+    Besides counters and histograms updated where the work happens, a
+    registry can expose the stats() dicts of existing components: each
+    numeric leaf becomes a gauge, nested keys joined with "_". Stats that
+    are a list of dicts (one per backend, say) become one series per item,
+    labelled with `label`.
+    """
+
+    def __init__(self, namespace: str = "assistant"):
+        self.namespace = namespace
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Tuple[str, Callable[[], Any], Optional[str]]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(f"{self.namespace}_{name}", documentation, labelnames))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(f"{self.namespace}_{name}", documentation, labelnames, buckets))
+
+    def register_stats(self, prefix: str, stats: Callable[[], Any], label: Optional[str] = None) -> None:
+        """Expose the numeric values returned by `stats()` as gauges named `<namespace>_<prefix>_<key>`."""
+        self._collectors.append((f"{self.namespace}_{prefix}", stats, label))
+
+    def _collect_stats(self) -> Dict[str, Tuple[str, List[Tuple[Dict[str, str], float]]]]:
+        """Gauge name -> (documentation, [(labels, value), ...])."""
+        gauges: Dict[str, Tuple[str, List[Tuple[Dict[str, str], float]]]] = {}
+        for prefix, stats, label in self._collectors:
+            try:
+                value = stats()
+            except Exception as e:
+                logger.warning(f"Could not collect stats for {prefix}: {e}")
+                continue
+            items = value if isinstance(value, list) else [value]
+            for item in items:
+                labels = {}
+                if isinstance(item, dict) and label is not None and label in item:
+                    labels[label] = str(item[label])
+                flat: Dict[str, float] = {}
+                _flatten(prefix, item, flat)
+                for name, number in flat.items():
+                    if name not in gauges:
+                        component = prefix[len(self.namespace) + 1:]
+                        documentation = f"{name[len(prefix) + 1:]} from the {component} stats."
+                        gauges[name] = (documentation, [])
+                    gauges[name][1].append((labels, number))
+        return gauges
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        for name, (documentation, samples) in self._collect_stats().items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# HTTP
+HTTP_REQUESTS = registry.counter(
+    "http_requests", "HTTP requests by route, method and status code.", ("route", "method", "status")
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_seconds", "Time until the response headers were ready, by route and method.", ("route", "method")
+)
+
+# Chat turns
+CHAT_STAGE_SECONDS = registry.histogram(
+    "chat_stage_seconds", "Duration of each stage of a chat turn (history, search, prompt, first_token, ...).", ("stage",)
+)
+
+# Storage
+DB_SECONDS = registry.histogram(
+    "db_seconds", "Time spent in SQLite, by operation.", ("operation",)
+)
+
+# Ollama
+OLLAMA_PREFILL_SECONDS = registry.histogram(
+    "ollama_prefill_seconds", "Prompt evaluation time reported by Ollama (prompt_eval_duration).", ("model",)
+)
+OLLAMA_EVAL_SECONDS = registry.histogram(
+    "ollama_eval_seconds", "Generation time reported by Ollama (eval_duration).", ("model",)
+)
+OLLAMA_TOKENS = registry.counter(
+    "ollama_tokens", "Tokens processed by Ollama, by model and phase (prompt or eval).", ("model", "phase")
+)
+
+# Search, SMB and documents
+SEARCH_SECONDS = registry.histogram(
+    "search_seconds", "Google Custom Search API latency, by search type and outcome.", ("type", "outcome")
+)
+SMB_SECONDS = registry.histogram(
+    "smb_seconds", "Time spent on SMB shares, by operation.", ("operation",)
+)
+DOCUMENT_PARSE_SECONDS = registry.histogram(
+    "document_parse_seconds", "Time spent extracting text from uploaded documents, by format.", ("format",)
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting HTTP requests by route template, method and
+    status, and timing them up to the start of the response. Streamed bodies
+    are not included in the latency; their stages have metrics of their own.
+
+    Routes are labelled with their template ("/api/movies/stream/{share_name}/{path:path}"),
+    never the raw path, to keep the number of series bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        state = {"status": 500, "timed": False}
+
+        def record_latency() -> None:
+            state["timed"] = True
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=_route(scope), method=scope["method"])
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                record_latency()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            if not state["timed"]:
+                record_latency()
+            HTTP_REQUESTS.inc(route=_route(scope), method=scope["method"], status=str(state["status"]))
+
+
+def _route(scope) -> str:
+    # The router stores the matched route in the scope.
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+def observe_ollama_response(model: str, response: Dict[str, Any]) -> None:
+    """Record the prefill and eval timings Ollama reports on a final chat response or chunk."""
+    model = response.get("model") or model
+    if response.get("prompt_eval_duration"):
+        OLLAMA_PREFILL_SECONDS.observe(response["prompt_eval_duration"] / 1e9, model=model)
+    if response.get("eval_duration"):
+        OLLAMA_EVAL_SECONDS.observe(response["eval_duration"] / 1e9, model=model)
+    if response.get("prompt_eval_count"):
+        OLLAMA_TOKENS.inc(response["prompt_eval_count"], model=model, phase="prompt")
+    if response.get("eval_count"):
+        OLLAMA_TOKENS.inc(response["eval_count"], model=model, phase="eval")
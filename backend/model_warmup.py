@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional, Iterable, Union
+
+from pytz import timezone
+
+from ollama_pool import OllamaBackendPool, OllamaBackend
+
+logger = logging.getLogger(__name__)
+
+
+def parse_range(value: str) -> tuple[int, int]:
+    """Parse an inclusive-start, exclusive-end range such as "8-20"."""
+    start, end = value.split('-')
+    return int(start), int(end)
+
+
+class KeepAlivePolicy:
+    """
+    Decides how long Ollama keeps a model loaded after each call.
+
+    During business hours models stay resident for `keep_alive`; outside them
+    the shorter `off_hours_keep_alive` lets the GPU memory be reclaimed.
+    """
+
+    def __init__(
+            self,
+            keep_alive: Union[str, float] = "60m",
+            off_hours_keep_alive: Union[str, float] = "5m",
+            business_hours: tuple[int, int] = (8, 20),
+            business_days: Iterable[int] = range(0, 5),
+            tz_name: Optional[str] = None
+    ):
+        self.keep_alive = keep_alive
+        self.off_hours_keep_alive = off_hours_keep_alive
+        self.business_hours = business_hours
+        self.business_days = set(business_days)
+        self.tz = timezone(tz_name) if tz_name else None
+
+    def in_business_hours(self, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now(self.tz)
+        start, end = self.business_hours
+        return now.weekday() in self.business_days and start <= now.hour < end
+
+    def current(self, now: Optional[datetime] = None) -> Union[str, float]:
+        return self.keep_alive if self.in_business_hours(now) else self.off_hours_keep_alive
+
+
+class ModelWarmer:
+    """
+    Loads models on every backend at startup and keeps them resident.
+
+    An empty generate request makes Ollama load a model without producing any
+    tokens, so it is used both for the startup warm-up and for the pinger,
+    which re-sends it every `ping_interval` seconds during business hours.
+    """
+
+    def __init__(
+            self,
+            pool: OllamaBackendPool,
+            models: List[str],
+            policy: KeepAlivePolicy,
+            ping_interval: float = 240,
+            pull_missing: bool = False
+    ):
+        self.pool = pool
+        self.models = models
+        self.policy = policy
+        self.ping_interval = ping_interval
+        self.pull_missing = pull_missing
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self, backend: OllamaBackend, model: str) -> bool:
+        try:
+            await backend.client.generate(model=model, prompt='', keep_alive=self.policy.current())
+            return True
+        except Exception as e:
+            logger.warning(f"Could not load {model} on {backend.host}: {e}")
+            return False
+
+    async def warm_up(self, timeout: Optional[float] = None) -> None:
+        """Pull (if enabled) and load every configured model on every backend."""
+        async def warm(backend: OllamaBackend, model: str):
+            if self.pull_missing:
+                try:
+                    await backend.client.pull(model)
+                except Exception as e:
+                    logger.error(f"Error pulling {model} on {backend.host}: {e}")
+            if await self.load(backend, model):
+                logger.info(f"Model {model} loaded on {backend.host}")
+
+        jobs = [warm(backend, model) for backend in self.pool.backends for model in self.models]
+        try:
+            await asyncio.wait_for(asyncio.gather(*jobs), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Model warm-up did not finish within {timeout} seconds; continuing startup")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._ping_loop())
+
+    async def _ping_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            if not self.policy.in_business_hours():
+                continue
+            healthy = [backend for backend in self.pool.backends if backend.healthy]
+            await asyncio.gather(*(self.load(backend, model) for backend in healthy for model in self.models))
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
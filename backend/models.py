@@ -55,6 +55,25 @@ class ImageSearchResult(BaseModel):
 class SearchResponse(BaseModel):
     results: Optional[List[SearchResult]] = None
     images: Optional[List[ImageSearchResult]] = None
+    # Pass as `start` to get the following results; None when there are no more.
+    next_start: Optional[int] = None
+    # For type=all: why a side ("web" or "image") came back empty.
+    errors: Optional[Dict[str, str]] = None
+
+class ConversationSearchHit(BaseModel):
+    message_id: int
+    conversation_id: str
+    role: str
+    timestamp: Optional[str] = None
+    snippet: str
+    score: float
+
+class ConversationSearchResponse(BaseModel):
+    query: str
+    total: int
+    limit: int
+    offset: int
+    results: List[ConversationSearchHit]
 
 class Expense(BaseModel):
     amount: float
@@ -6,6 +6,7 @@ from typing import List, Dict
 from pathlib import Path
 import tempfile
 from models import SmbConfig, FileItem, MovieMetadata
+from metrics import SMB_SECONDS
 import logging
 from datetime import datetime
 
@@ -40,7 +41,9 @@ def get_smb_connection(config: SmbConfig) -> SMBConnection:
             use_ntlm_v2=True
         )
 
-        if not conn.connect(config.server_ip, 445):
+        with SMB_SECONDS.time(operation="connect"):
+            connected = conn.connect(config.server_ip, 445)
+        if not connected:
             raise HTTPException(status_code=500, detail="Failed to connect to SMB server")
 
         return conn
@@ -62,7 +65,8 @@ async def list_directory(path: str = "/") -> List[FileItem]:
                 share_path = str(Path(share.path) / path.lstrip('/'))
 
                 try:
-                    files = conn.listPath(share.name, share_path)
+                    with SMB_SECONDS.time(operation="list"):
+                        files = conn.listPath(share.name, share_path)
 
                     # Filter out system files and non-video files
                     valid_extensions = {'.mp4', '.mkv', '.avi', '.mov', '.wmv'}
@@ -121,24 +125,26 @@ async def stream_movie(share_name: str, path: str) -> StreamingResponse:
             # Create a temporary file to store chunks
             with tempfile.NamedTemporaryFile(delete=False) as temp_file:
                 # Get file info
-                file_obj = conn.getAttributes(share_name, full_path)
+                with SMB_SECONDS.time(operation="attributes"):
+                    file_obj = conn.getAttributes(share_name, full_path)
                 file_size = file_obj.file_size
 
                 # Stream the file in chunks
                 chunk_size = 8192
                 offset = 0
 
-                while offset < file_size:
-                    chunk = conn.retrieveFileFromOffset(
-                        share_name,
-                        full_path,
-                        temp_file,
-                        offset,
-                        chunk_size
-                    )
-                    if not chunk:
-                        break
-                    offset += chunk_size
+                with SMB_SECONDS.time(operation="read"):
+                    while offset < file_size:
+                        chunk = conn.retrieveFileFromOffset(
+                            share_name,
+                            full_path,
+                            temp_file,
+                            offset,
+                            chunk_size
+                        )
+                        if not chunk:
+                            break
+                        offset += chunk_size
 
                 temp_file.flush()
 
@@ -182,7 +188,8 @@ async def get_movie_metadata(share_name: str, path: str) -> MovieMetadata:
         try:
             # Construct the full path within the share
             full_path = str(Path(share.path) / path.lstrip('/'))
-            file_obj = conn.getAttributes(share_name, full_path)
+            with SMB_SECONDS.time(operation="attributes"):
+                file_obj = conn.getAttributes(share_name, full_path)
 
             # Convert timestamp using the new helper function
             modified_time = convert_timestamp(file_obj.last_write_time)
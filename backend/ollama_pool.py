@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+
+import httpx
+from ollama import AsyncClient, ResponseError
+
+logger = logging.getLogger(__name__)
+
+
+class BackendUnavailableError(Exception):
+    """Raised when no Ollama backend is left to try."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call should be retried on another backend."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, ResponseError):
+        return error.status_code >= 500
+    # ollama 0.3 reads the body of a failed streamed response with the sync
+    # API, which raises RuntimeError while handling the HTTP error.
+    if isinstance(error, RuntimeError) and isinstance(error.__context__, httpx.HTTPStatusError):
+        return error.__context__.response.status_code >= 500
+    return False
+
+
+class OllamaBackend:
+    def __init__(self, host: str, client: AsyncClient):
+        self.host = host
+        self.client = client
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.last_probe: Optional[float] = None
+        self.last_probe_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"OllamaBackend({self.host!r}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+
+class OllamaBackendPool:
+    """
+    A set of Ollama hosts behind one interface.
+
+    Requests go to the healthy backend with the fewest outstanding requests.
+    A conversation sticks to the backend that last served it, so the model's
+    KV cache for its prompt prefix can be reused, unless that backend is
+    `sticky_slack` requests busier than the least loaded one. Backends that
+    fail a request are taken out of rotation until the background health
+    probe sees them answer again.
+    """
+
+    def __init__(
+            self,
+            backends: List[OllamaBackend],
+            health_interval: float = 10.0,
+            probe_timeout: float = 2.0,
+            sticky_slack: int = 2,
+            max_sticky: int = 10000
+    ):
+        if not backends:
+            raise ValueError("At least one Ollama backend is required")
+        self.backends = backends
+        self.health_interval = health_interval
+        self.probe_timeout = probe_timeout
+        self.sticky_slack = sticky_slack
+        self.max_sticky = max_sticky
+        self._sticky: "OrderedDict[str, OllamaBackend]" = OrderedDict()
+        self._health_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_hosts(cls, hosts: Iterable[str], client_kwargs: Optional[Dict[str, Any]] = None, **kwargs) -> "OllamaBackendPool":
+        client_kwargs = client_kwargs or {}
+        backends = [OllamaBackend(host, AsyncClient(host=host, **client_kwargs)) for host in hosts]
+        return cls(backends, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    def pick(self, conversation_id: Optional[str] = None, exclude: Iterable[OllamaBackend] = ()) -> OllamaBackend:
+        excluded = set(id(backend) for backend in exclude)
+        candidates = [backend for backend in self.backends if id(backend) not in excluded]
+        if not candidates:
+            raise BackendUnavailableError("All Ollama backends failed")
+
+        healthy = [backend for backend in candidates if backend.healthy]
+        # With nothing marked healthy, trying a backend beats failing outright;
+        # the last health probe may simply be stale.
+        pool = healthy or candidates
+        least_loaded = min(pool, key=lambda backend: backend.outstanding)
+
+        if conversation_id is not None:
+            sticky = self._sticky.get(conversation_id)
+            if (
+                    sticky is not None
+                    and sticky in pool
+                    and sticky.outstanding <= least_loaded.outstanding + self.sticky_slack
+            ):
+                self._sticky.move_to_end(conversation_id)
+                return sticky
+
+        return least_loaded
+
+    def remember(self, conversation_id: Optional[str], backend: OllamaBackend) -> None:
+        if conversation_id is None:
+            return
+        self._sticky[conversation_id] = backend
+        self._sticky.move_to_end(conversation_id)
+        while len(self._sticky) > self.max_sticky:
+            self._sticky.popitem(last=False)
+
+    @contextmanager
+    def track(self, backend: OllamaBackend) -> Iterator[OllamaBackend]:
+        """Count a request against `backend` for least-outstanding routing."""
+        backend.outstanding += 1
+        try:
+            yield backend
+        finally:
+            backend.outstanding -= 1
+
+    def mark_failed(self, backend: OllamaBackend, error: BaseException) -> None:
+        backend.consecutive_failures += 1
+        backend.last_error = str(error)
+        if backend.healthy:
+            logger.warning(f"Taking Ollama backend {backend.host} out of rotation: {error}")
+        backend.healthy = False
+
+    def mark_succeeded(self, backend: OllamaBackend) -> None:
+        backend.consecutive_failures = 0
+        if not backend.healthy:
+            logger.info(f"Ollama backend {backend.host} is back in rotation")
+        backend.healthy = True
+
+    async def probe(self, backend: OllamaBackend) -> bool:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(backend.client.list(), timeout=self.probe_timeout)
+        except Exception as e:
+            backend.last_probe = time.time()
+            self.mark_failed(backend, e)
+            return False
+        backend.last_probe = time.time()
+        backend.last_probe_latency = time.monotonic() - started
+        self.mark_succeeded(backend)
+        return True
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self.probe(backend) for backend in self.backends))
+
+    def start(self) -> None:
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Error probing Ollama backends: {e}")
+            await asyncio.sleep(self.health_interval)
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for backend in self.backends:
+            # ollama.AsyncClient does not expose a close method; the httpx
+            # client it wraps is the one holding the connection pool.
+            http_client = getattr(backend.client, "_client", None)
+            if http_client is not None:
+                await http_client.aclose()
+        logger.info("Ollama connection pools closed")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "host": backend.host,
+                "healthy": backend.healthy,
+                "outstanding": backend.outstanding,
+                "consecutive_failures": backend.consecutive_failures,
+                "last_probe_latency": backend.last_probe_latency,
+                "last_error": backend.last_error
+            }
+            for backend in self.backends
+        ]
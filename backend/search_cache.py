@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+
+import aiosqlite
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Punctuation stripped from the ends of each word. Characters that change
+# what Google matches (quotes, "-" exclusions, "site:" operators, "c++") stay.
+_EDGE_PUNCTUATION = ".,!?;:()[]{}'`…"
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation, so near-identical queries share an entry."""
+    words = (word.strip(_EDGE_PUNCTUATION) for word in _WHITESPACE.split(query.casefold()))
+    return " ".join(word for word in words if word)
+
+
+def cache_key(search_type: str, query: str, num_results: int, start: int = 1) -> str:
+    return f"{search_type}:{start}:{num_results}:{normalize_query(query)}"
+
+
+class SearchCache:
+    """
+    Two-tier cache of search results: an in-process LRU in front of SQLite.
+
+    Entries are fresh for the TTL of their search type. After that they are
+    still served, for up to `stale_ttl` more seconds, while one background
+    task per key fetches a replacement (stale-while-revalidate), so a
+    popular query never waits on the API once it has been cached. Misses on
+    the same key are coalesced into one fetch, which keeps going for the
+    other callers if the one that started it is cancelled.
+    """
+
+    def __init__(
+            self,
+            db_path: str = 'search_cache.db',
+            ttls: Optional[Dict[str, float]] = None,
+            default_ttl: float = 6 * 3600,
+            stale_ttl: float = 7 * 24 * 3600,
+            memory_entries: int = 512,
+            max_entries: int = 20000
+    ):
+        self.db_path = db_path
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._db: Optional[aiosqlite.Connection] = None
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._in_flight = SingleFlight()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        if self._db is None:
+            self._db = await aiosqlite.connect(self.db_path)
+            await self._db.execute("PRAGMA journal_mode = WAL")
+            await self._db.execute("PRAGMA synchronous = NORMAL")
+            await self._db.execute("""
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    key TEXT PRIMARY KEY,
+                    search_type TEXT,
+                    results TEXT,
+                    created_at REAL,
+                    last_access REAL
+                )
+            """)
+            await self._db.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_last_access ON search_cache (last_access)")
+            await self._db.commit()
+        return self._db
+
+    async def close(self) -> None:
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        for task in list(self._refreshing.values()):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._refreshing.clear()
+        await self._in_flight.cancel_all()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    def ttl_for(self, search_type: str) -> float:
+        return self.ttls.get(search_type, self.default_ttl)
+
+    def _remember(self, key: str, created_at: float, results: Any) -> None:
+        self._memory[key] = (created_at, results)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[Tuple[float, Any, str]]:
+        """The entry for `key` as (created_at, results, tier), whatever its age."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry[0], entry[1], "memory"
+
+        db = await self._get_db()
+        async with db.execute("SELECT results, created_at FROM search_cache WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        await db.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        await db.commit()
+        results = json.loads(row[0])
+        self._remember(key, row[1], results)
+        return row[1], results, "disk"
+
+    async def _store(self, key: str, search_type: str, results: Any) -> None:
+        now = time.time()
+        self._remember(key, now, results)
+        db = await self._get_db()
+        await db.execute("""
+            INSERT OR REPLACE INTO search_cache (key, search_type, results, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?)
+        """, (key, search_type, json.dumps(results), now, now))
+        # Drop entries too old to be served even as stale.
+        max_ttl = max([self.default_ttl, *self.ttls.values()])
+        await db.execute("DELETE FROM search_cache WHERE created_at < ?", (now - max_ttl - self.stale_ttl,))
+        await db.execute("""
+            DELETE FROM search_cache WHERE key IN (
+                SELECT key FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        await db.commit()
+
+    async def get_or_fetch(
+            self,
+            search_type: str,
+            query: str,
+            num_results: int,
+            fetch: Callable[[], Awaitable[Any]],
+            start: int = 1
+    ) -> Any:
+        """
+        Return cached results for this search, or run `fetch` and cache what it
+        returns. Results must be JSON-serializable.
+        """
+        key = cache_key(search_type, query, num_results, start)
+        try:
+            entry = await self._lookup(key)
+        except Exception as e:
+            logger.error(f"Error reading search cache: {e}")
+            entry = None
+
+        if entry is not None:
+            created_at, results, tier = entry
+            age = time.time() - created_at
+            ttl = self.ttl_for(search_type)
+            if age <= ttl + self.stale_ttl:
+                if tier == "memory":
+                    self.memory_hits += 1
+                else:
+                    self.disk_hits += 1
+                if age > ttl:
+                    self.stale_hits += 1
+                    self._refresh(key, search_type, fetch)
+                return results
+            self._memory.pop(key, None)
+        return await self._fetch(key, search_type, fetch)
+
+    async def _fetch(self, key: str, search_type: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self._in_flight:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+
+        async def fetch_and_store():
+            results = await fetch()
+            try:
+                await self._store(key, search_type, results)
+            except Exception as e:
+                logger.error(f"Error writing search cache: {e}")
+            return results
+
+        return await self._in_flight.run(key, fetch_and_store)
+
+    def _refresh(self, key: str, search_type: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                results = await fetch()
+                await self._store(key, search_type, results)
+                self.refreshes += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The stale entry keeps being served until a refresh succeeds.
+                self.refresh_failures += 1
+                logger.warning(f"Background refresh of cached search {key!r} failed: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "refreshing": len(self._refreshing),
+            "hit_ratio": hits / lookups if lookups else 0.0
+        }
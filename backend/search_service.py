@@ -1,19 +1,25 @@
+import asyncio
 import logging
-import requests
+from contextlib import aclosing
+import random
+import time
+import httpx
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 import datetime
 
 from models import SearchResponse, SearchResult, ChatResponse, ChatMessage, ImageSearchResult
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, NamedTuple, Union, Tuple, Set, AsyncIterator
 
 import os
 from dotenv import load_dotenv
 
 from models import ChatResponse
 from utils import parse_date_time
-from state import global_state
+from intent_router import intent_router
+from metrics import SEARCH_SECONDS
+from search_cache import SearchCache
 
 logger = logging.getLogger(__name__)
 creds = None
@@ -24,97 +30,378 @@ load_dotenv()
 GOOGLE_SEARCH_API_KEY = os.getenv('GOOGLE_SEARCH_API_KEY')
 SEARCH_ENGINE_ID = os.getenv('SEARCH_ENGINE_ID')
 
-def perform_web_search(query: str, num_results: int = 5) -> List[SearchResult]:
-    logger.info(f"Performing web search for query: {query}")
+DEFAULT_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
 
-    url = "https://www.googleapis.com/customsearch/v1"
-    params = {
-        "key": GOOGLE_SEARCH_API_KEY,
-        "cx": SEARCH_ENGINE_ID,
-        "q": query,
-        "num": min(num_results, 10)
-    }
+# The API returns at most PAGE_SIZE results per request, and only the first
+# MAX_RESULTS results of any query.
+PAGE_SIZE = 10
+MAX_RESULTS = 100
 
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        search_data = response.json()
+# Rate limiting and transient server errors are worth another try.
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class GoogleSearchClient:
+    """
+    Async client for the Google Custom Search JSON API.
+
+    One httpx client is shared by every search, so requests reuse pooled
+    keep-alive connections instead of paying a TLS handshake each. Requests
+    rejected with 429 or a 5xx, or that fail to connect, are retried up to
+    `max_retries` times with exponential backoff and full jitter, honouring
+    Retry-After when the API sends one. `base_url` can point at a local
+    stand-in for tests.
+    """
+
+    def __init__(
+            self,
+            api_key: Optional[str],
+            engine_id: Optional[str],
+            base_url: str = DEFAULT_SEARCH_URL,
+            timeout: float = 10.0,
+            max_retries: int = 3,
+            backoff: float = 0.5,
+            max_backoff: float = 8.0,
+            max_connections: int = 20
+    ):
+        self.api_key = api_key
+        self.engine_id = engine_id
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            )
+        return self._client
 
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass  # an HTTP date; fall back to our own backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def query(self, search_type: str, **params) -> Dict[str, Any]:
+        """Run one API request and return the decoded JSON body."""
+        params = {"key": self.api_key, "cx": self.engine_id, **params}
+        client = self._get_client()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            attempt = 0
+            while True:
+                self.requests += 1
+                response = None
+                try:
+                    response = await client.get(self.base_url, params=params)
+                    if response.status_code not in RETRYABLE_STATUS:
+                        response.raise_for_status()
+                        outcome = "ok"
+                        return response.json()
+                    error: Exception = httpx.HTTPStatusError(
+                        f"Search API returned {response.status_code}", request=response.request, response=response
+                    )
+                except httpx.TransportError as e:
+                    error = e
+                if attempt >= self.max_retries:
+                    self.failures += 1
+                    raise error
+                delay = self._retry_delay(attempt, response)
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"Retrying {search_type} search in {delay:.2f}s after: {error}")
+                await asyncio.sleep(delay)
+        finally:
+            SEARCH_SECONDS.observe(time.perf_counter() - started, type=search_type, outcome=outcome)
+
+    async def web(self, query: str, num_results: int = 5, start: int = 1) -> List[SearchResult]:
+        search_data = await self.query("web", q=query, num=min(num_results, PAGE_SIZE), start=start)
         logger.debug(f"Search API response: {search_data}")
+        return [
+            SearchResult(
+                title=item.get('title', 'No title'),
+                link=item.get('link', 'No link'),
+                snippet=item.get('snippet', 'No snippet available')
+            ) for item in search_data.get('items', [])
+        ]
 
-        if 'items' in search_data:
-            return [
-                SearchResult(
-                    title=item.get('title', 'No title'),
-                    link=item.get('link', 'No link'),
-                    snippet=item.get('snippet', 'No snippet available')
-                ) for item in search_data['items']
-            ]
-        else:
-            logger.warning("No search results found")
-            return []
-    except requests.RequestException as e:
+    async def images(self, query: str, num_results: int = 5, start: int = 1) -> List[ImageSearchResult]:
+        search_data = await self.query("image", q=query, num=min(num_results, PAGE_SIZE), start=start, searchType="image")
+        logger.debug(f"Image Search API response: {search_data}")
+        return [
+            ImageSearchResult(
+                title=item.get('title', 'No title'),
+                link=item.get('link', 'No link'),
+                thumbnailLink=item.get('image', {}).get('thumbnailLink', 'No thumbnail'),
+                displayLink=item.get('displayLink', 'No display link'),
+                mime=item.get('mime', 'Unknown'),
+                fileFormat=item.get('fileFormat'),
+                contextLink=item.get('image', {}).get('contextLink')
+            ) for item in search_data.get('items', [])
+        ]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "retries": self.retries, "failures": self.failures}
+
+
+search_client = GoogleSearchClient(
+    GOOGLE_SEARCH_API_KEY,
+    SEARCH_ENGINE_ID,
+    base_url=os.getenv('GOOGLE_SEARCH_BASE_URL', DEFAULT_SEARCH_URL),
+    timeout=float(os.getenv('GOOGLE_SEARCH_TIMEOUT', '10')),
+    max_retries=int(os.getenv('GOOGLE_SEARCH_MAX_RETRIES', '3')),
+    max_connections=int(os.getenv('GOOGLE_SEARCH_MAX_CONNECTIONS', '20'))
+)
+
+
+# Web results go stale faster than image results; both are served stale
+# (and refreshed in the background) for SEARCH_CACHE_STALE_TTL afterwards.
+search_cache = SearchCache(
+    db_path=os.getenv('SEARCH_CACHE_DB', 'search_cache.db'),
+    ttls={
+        "web": float(os.getenv('SEARCH_CACHE_WEB_TTL', str(6 * 3600))),
+        "image": float(os.getenv('SEARCH_CACHE_IMAGE_TTL', str(24 * 3600)))
+    },
+    stale_ttl=float(os.getenv('SEARCH_CACHE_STALE_TTL', str(7 * 24 * 3600))),
+    memory_entries=int(os.getenv('SEARCH_CACHE_MEMORY_ENTRIES', '512')),
+    max_entries=int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '20000'))
+)
+
+
+async def perform_web_search(query: str, num_results: int = 5, start: int = 1) -> List[SearchResult]:
+    """One page of web results: at most PAGE_SIZE, from the 1-based rank `start`."""
+    logger.info(f"Performing web search for query: {query}")
+
+    async def fetch():
+        return [result.dict() for result in await search_client.web(query, num_results, start)]
+
+    try:
+        results = await search_cache.get_or_fetch("web", query, num_results, fetch, start)
+    except Exception as e:
         logger.error(f"Error performing web search: {str(e)}", exc_info=True)
         raise
+    if not results:
+        logger.warning("No search results found")
+    return [SearchResult(**result) for result in results]
+
+
+async def perform_image_search(query: str, num_results: int = 5, start: int = 1) -> List[ImageSearchResult]:
+    """One page of image results: at most PAGE_SIZE, from the 1-based rank `start`."""
+    logger.info(f"Performing image search for query: {query}")
+
+    async def fetch():
+        return [result.dict() for result in await search_client.images(query, num_results, start)]
+
+    try:
+        results = await search_cache.get_or_fetch("image", query, num_results, fetch, start)
     except Exception as e:
-        logger.error(f"Unexpected error in perform_web_search: {str(e)}", exc_info=True)
+        logger.error(f"Error performing image search: {str(e)}", exc_info=True)
         raise
+    if not results:
+        logger.warning("No image search results found")
+    return [ImageSearchResult(**result) for result in results]
 
-def perform_image_search(query: str, num_results: int = 5) -> List[ImageSearchResult]:
-    logger.info(f"Performing image search for query: {query}")
 
-    url = "https://www.googleapis.com/customsearch/v1"
-    params = {
-        "key": GOOGLE_SEARCH_API_KEY,
-        "cx": SEARCH_ENGINE_ID,
-        "q": query,
-        "num": min(num_results, 10),
-        "searchType": "image"
-    }
+class SearchPage(NamedTuple):
+    start: int
+    results: List[Union[SearchResult, ImageSearchResult]]
+    error: Optional[Exception] = None
+
+
+def page_offsets(num_results: int, start: int = 1) -> List[Tuple[int, int]]:
+    """The (start, count) requests covering `num_results` results from rank `start`."""
+    end = min(start + num_results, MAX_RESULTS + 1)
+    return [(offset, min(PAGE_SIZE, end - offset)) for offset in range(start, end, PAGE_SIZE)]
+
+
+def next_start(pages: List[SearchPage], num_results: int, start: int = 1) -> Optional[int]:
+    """Cursor for the page after these, or None when the API has no more results to give."""
+    following = start + num_results
+    if following > MAX_RESULTS or not pages:
+        return None
+    last = max(pages, key=lambda page: page.start)
+    offsets = page_offsets(num_results, start)
+    if last.error is not None or len(last.results) < offsets[-1][1]:
+        return None
+    return following
+
 
+async def stream_search_pages(
+        search_type: str,
+        query: str,
+        num_results: int,
+        start: int = 1,
+        dedupe: bool = True
+) -> AsyncIterator[SearchPage]:
+    """
+    Fetch every page needed for `num_results` results concurrently and yield
+    them as they arrive, so a deep search takes about one round-trip.
+
+    With `dedupe`, results already yielded on another page (same link) are
+    left out, so which copy survives depends on arrival order. A page
+    that fails is yielded with its error and no results. Closing the
+    generator cancels the pages still in flight.
+    """
+    search = perform_image_search if search_type == "image" else perform_web_search
+    tasks = {
+        asyncio.create_task(search(query, count, offset)): offset
+        for offset, count in page_offsets(num_results, start)
+    }
+    seen: Set[str] = set()
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        search_data = response.json()
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.get):
+                if task.cancelled():
+                    yield SearchPage(tasks[task], [], RuntimeError(f"Search page starting at {tasks[task]} was cancelled"))
+                    continue
+                if task.exception() is not None:
+                    yield SearchPage(tasks[task], [], task.exception())
+                    continue
+                results = [result for result in task.result() if not (dedupe and result.link in seen)]
+                seen.update(result.link for result in results)
+                yield SearchPage(tasks[task], results)
+    finally:
+        for task in tasks:
+            task.cancel()
 
-        logger.debug(f"Image Search API response: {search_data}")
 
-        if 'items' in search_data:
-            return [
-                ImageSearchResult(
-                    title=item.get('title', 'No title'),
-                    link=item.get('link', 'No link'),
-                    thumbnailLink=item.get('image', {}).get('thumbnailLink', 'No thumbnail'),
-                    displayLink=item.get('displayLink', 'No display link'),
-                    mime=item.get('mime', 'Unknown'),
-                    fileFormat=item.get('fileFormat'),
-                    contextLink=item.get('image', {}).get('contextLink')
-                ) for item in search_data['items']
-            ]
+async def deep_search(
+        search_type: str,
+        query: str,
+        num_results: int,
+        start: int = 1
+) -> Tuple[List[Union[SearchResult, ImageSearchResult]], Optional[int]]:
+    """
+    Up to `num_results` results from rank `start`, fetched page by page in
+    parallel and de-duplicated by link in rank order, plus the cursor for
+    the next call. Raises only if every page failed.
+    """
+    async with aclosing(stream_search_pages(search_type, query, num_results, start, dedupe=False)) as stream:
+        pages = [page async for page in stream]
+    pages.sort(key=lambda page: page.start)
+    failed = [page for page in pages if page.error is not None]
+    if failed and len(failed) == len(pages):
+        raise failed[0].error
+    for page in failed:
+        logger.warning(f"Search page starting at {page.start} failed, returning the others: {page.error}")
+
+    # Pages arrive in any order; rank order decides which duplicate is kept.
+    results, seen = [], set()
+    for page in pages:
+        for result in page.results:
+            if result.link not in seen:
+                seen.add(result.link)
+                results.append(result)
+    return results, next_start(pages, num_results, start)
+
+
+async def search_all(
+        query: str,
+        num_results: int,
+        start: int = 1,
+        timeout: float = 8.0
+) -> Tuple[List[SearchResult], List[ImageSearchResult], Optional[int], Dict[str, str]]:
+    """
+    Web and image results for one query, searched concurrently.
+
+    A side that fails or is still running after `timeout` seconds comes back
+    empty, with the reason in the returned errors; the other side's results
+    are returned either way. Raises only if both sides failed. The cursor is
+    the web search's.
+    """
+    tasks = {
+        "web": asyncio.create_task(deep_search("web", query, num_results, start)),
+        "image": asyncio.create_task(deep_search("image", query, num_results, start))
+    }
+    try:
+        await asyncio.wait(tasks.values(), timeout=timeout)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+    # Let a cancelled side unwind, cancelling its page requests, before reading results.
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    outcomes: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for name, task in tasks.items():
+        if task.cancelled():
+            errors[name] = f"timed out after {timeout} seconds"
+        elif task.exception() is not None:
+            errors[name] = str(task.exception())
         else:
-            logger.warning("No image search results found")
-            return []
-    except requests.RequestException as e:
-        logger.error(f"Error performing image search: {str(e)}", exc_info=True)
-        raise
+            outcomes[name] = task.result()
+    if not outcomes:
+        raise RuntimeError(f"Web and image search both failed: {errors}")
+    for name, reason in errors.items():
+        logger.warning(f"Returning partial results for {query!r}, {name} search failed: {reason}")
+
+    web, cursor = outcomes.get("web", ([], None))
+    images, _ = outcomes.get("image", ([], None))
+    return web, images, cursor, errors
+
+
+async def fetch_search_context(query: str, num_results: int = 5, timeout: float = 5.0) -> List[SearchResult]:
+    """
+    Web results to ground a chat answer in, or an empty list.
+
+    The chat still answers when search is slow or down, so failures and
+    timeouts are logged rather than raised.
+    """
+    try:
+        return await asyncio.wait_for(perform_web_search(query, num_results), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Web search for chat context timed out after {timeout} seconds: {query}")
     except Exception as e:
-        logger.error(f"Unexpected error in perform_image_search: {str(e)}", exc_info=True)
-        raise
+        logger.warning(f"Web search for chat context failed: {e}")
+    return []
+
+
+def format_search_context(query: str, results: List[SearchResult]) -> str:
+    lines = [f'Web search results for "{query}". Base your answer on them where relevant and cite them as [n]:']
+    for i, result in enumerate(results, 1):
+        lines.append(f"[{i}] {result.title} ({result.link})\n{result.snippet}")
+    return "\n".join(lines)
+
+
+SEARCH_PHRASES = ['search for', 'find information about', 'look up']
 
 def is_search_request(message):
-    return any(phrase in message.lower() for phrase in ['search for', 'find information about', 'look up'])
+    return any(phrase in message.lower() for phrase in SEARCH_PHRASES)
 
 
-def handle_search_request(user_input):
+async def handle_search_request(user_input):
     query = user_input.split(' ', 2)[-1]  # Extract the search query
-    search_results = perform_web_search(query)
+    search_results = await perform_web_search(query)
 
     if search_results:
         response = "Here are the top search results:\n\n"
         for i, result in enumerate(search_results, 1):
-            response += f"{i}. {result['title']}\n   {result['link']}\n   {result['snippet']}\n\n"
+            response += f"{i}. {result.title}\n   {result.link}\n   {result.snippet}\n\n"
     else:
         response = "I'm sorry, but I couldn't find any relevant search results for your query."
 
     return ChatResponse(message=response, metadata={})
 
+# No handler: chat answers search requests with the model, grounded in the results (see main.load_turn_context).
+intent_router.register('search', SEARCH_PHRASES, args_pattern=r'\s+(?P<query>\S.*)')
+
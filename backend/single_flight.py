@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Dict, Callable, Awaitable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    At most one call in flight per key; concurrent callers for the key share it.
+
+    The call runs in its own task and every caller awaits it through
+    asyncio.shield, so a caller that is cancelled (its client went away, its
+    deadline passed) only stops waiting: the others still get the result. The
+    call itself is cancelled only once nobody is waiting for it any more.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._tasks
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def run(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """Join the call in flight for `key`, or start `call()` as that call."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(call())
+            self._tasks[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done: self._finished(key, done))
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1 and self._tasks.get(key) is task:
+                task.cancel()
+            raise
+        finally:
+            if self._tasks.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            del self._waiters[key]
+        if not task.cancelled():
+            # Mark it retrieved so a failure nobody waited for is not logged as unhandled.
+            task.exception()
+
+    async def cancel_all(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,42 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Awaitable, TypeVar, Iterator
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    """
+    Wall-clock timings for the stages of one request.
+
+    Stages may overlap: awaitables run concurrently under `measure` each get
+    their own duration, so the report shows which one the request waited on.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - started
+
+    async def measure(self, name: str, awaitable: Awaitable[T]) -> T:
+        with self.stage(name):
+            return await awaitable
+
+    def mark(self, name: str) -> None:
+        """Record the time elapsed since the request started, e.g. for the first token."""
+        self.stages[name] = time.perf_counter() - self.started
+
+    def as_ms(self) -> Dict[str, float]:
+        report = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        report["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return report
@@ -1,9 +1,175 @@
 # state.py
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
 
 class State:
+    """Multi-step flow state for one session (calendar and expense creation)."""
+
+    __slots__ = ("conversation", "flow", "calendar_event_info", "event_creation_stage", "expense_info", "updated_at")
+
     def __init__(self):
         self.conversation = []
+        # Intent whose flow is waiting for the next message, while event_creation_stage is set
+        self.flow = None
         self.calendar_event_info = {}
         self.event_creation_stage = None
+        self.expense_info = {}
+        self.updated_at = time.time()
+
+    def is_empty(self) -> bool:
+        return not (self.conversation or self.flow or self.calendar_event_info or self.event_creation_stage or self.expense_info)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "conversation": self.conversation,
+            "flow": self.flow,
+            "calendar_event_info": self.calendar_event_info,
+            "event_creation_stage": self.event_creation_stage,
+            "expense_info": self.expense_info
+        }, default=_encode_value)
+
+    @classmethod
+    def from_json(cls, data: str, updated_at: float) -> "State":
+        values = json.loads(data, object_hook=_decode_value)
+        state = cls()
+        state.conversation = values.get("conversation", [])
+        state.flow = values.get("flow")
+        state.calendar_event_info = values.get("calendar_event_info", {})
+        state.event_creation_stage = values.get("event_creation_stage")
+        state.expense_info = values.get("expense_info", {})
+        state.updated_at = updated_at
+        return state
+
+
+def _encode_value(value: Any) -> Any:
+    # Flows keep parsed datetimes in their info dicts; round-trip them intact.
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot serialize {type(value).__name__} in session state")
+
+
+def _decode_value(value: Dict[str, Any]) -> Any:
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+class SessionStore:
+    """
+    Session state keyed by conversation_id, replacing the process-wide state.
+
+    Sessions live in an in-memory LRU and expire `ttl` seconds after their last
+    save. With `db_path` set they are also written through to SQLite and read
+    back from it on every lookup, so they survive restarts and every uvicorn
+    worker sees the same state.
+    """
+
+    def __init__(self, ttl: float = 3600, max_sessions: int = 10000, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.db_path = db_path
+        self._sessions: "OrderedDict[str, State]" = OrderedDict()
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self._last_purge = time.time()
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        async with self._db_lock:
+            if self._db is None:
+                self._db = await aiosqlite.connect(self.db_path)
+                await self._db.execute("PRAGMA journal_mode = WAL")
+                await self._db.execute("PRAGMA synchronous = NORMAL")
+                await self._db.execute("PRAGMA busy_timeout = 5000")
+                await self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS sessions (
+                        session_id TEXT PRIMARY KEY,
+                        state TEXT,
+                        updated_at REAL
+                    )
+                """)
+                await self._db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+                await self._db.commit()
+        return self._db
+
+    async def get(self, session_id: str) -> State:
+        """Return the session's state, creating an empty one if there is none."""
+        await self._maybe_purge()
+        now = time.time()
+
+        if self.db_path:
+            db = await self._get_db()
+            async with db.execute("SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                state = State.from_json(row[0], row[1])
+                self._remember(session_id, state)
+                return state
+            self._sessions.pop(session_id, None)
+            return State()
+
+        state = self._sessions.get(session_id)
+        if state is None or now - state.updated_at > self.ttl:
+            self._sessions.pop(session_id, None)
+            return State()
+        self._sessions.move_to_end(session_id)
+        return state
+
+    async def save(self, session_id: str, state: State) -> None:
+        """Persist changes made to a session; empty sessions are dropped."""
+        if state.is_empty():
+            await self.delete(session_id)
+            return
+
+        state.updated_at = time.time()
+        self._remember(session_id, state)
+        if self.db_path:
+            db = await self._get_db()
+            await db.execute("""
+                INSERT INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+            """, (session_id, state.to_json(), state.updated_at))
+            await db.commit()
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+        if self.db_path:
+            db = await self._get_db()
+            await db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            await db.commit()
+
+    def _remember(self, session_id: str, state: State) -> None:
+        self._sessions[session_id] = state
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def _maybe_purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        expired = [session_id for session_id, state in self._sessions.items() if now - state.updated_at > self.ttl]
+        for session_id in expired:
+            del self._sessions[session_id]
+        if self.db_path:
+            try:
+                db = await self._get_db()
+                await db.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Error purging expired sessions: {e}")
 
-global_state = State()
\ No newline at end of file
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
@@ -0,0 +1,285 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import conversation_archive
+from chat_history import DatabaseManager, fts_query
+
+OLD = "2020-01-01 00:00:00"
+
+
+def make_manager(tmp_path) -> DatabaseManager:
+    manager = DatabaseManager(str(tmp_path / "chat_history.db"))
+    manager.compact_interval = 0  # compaction only when a test asks for it
+    return manager
+
+
+def insert(manager: DatabaseManager, conversation_id: str, messages, timestamp: str = OLD) -> None:
+    """Insert (role, content) messages straight into the hot table, as if stored long ago."""
+    with sqlite3.connect(manager.db_path) as conn:
+        conn.executemany(
+            "INSERT INTO conversations (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+            [(conversation_id, role, content, timestamp) for role, content in messages]
+        )
+
+
+def long_conversation(topic: str, turns: int = 30):
+    return [
+        ("user" if i % 2 == 0 else "assistant", f"Message {i} about the {topic}, which we keep discussing at length today.")
+        for i in range(turns)
+    ]
+
+
+def run(manager: DatabaseManager, scenario):
+    async def wrapped():
+        try:
+            return await scenario()
+        finally:
+            await manager.close()
+
+    return asyncio.run(wrapped())
+
+
+def test_compaction_archives_idle_conversations_and_reports_net_savings(tmp_path):
+    manager = make_manager(tmp_path)
+    for index in range(5):
+        insert(manager, f"idle-{index}", long_conversation(f"garden plan {index}"))
+    insert(manager, "short", [("user", "hi")])
+    insert(manager, "recent", long_conversation("budget"), timestamp="2999-01-01 00:00:00")
+
+    async def scenario():
+        db = await manager._get_db()
+        before = await manager._bytes_in_use(db)
+        report = await manager.compact_idle_conversations(idle_seconds=86400)
+        after = await manager._bytes_in_use(db)
+
+        assert report["conversations"] == 5
+        assert report["messages"] == 150
+        assert report["compressed_bytes"] < report["raw_bytes"]
+        # Net of the archive blobs and their search index, not just the deleted rows.
+        assert report["reclaimed_bytes"] == before - after
+
+        async with db.execute("SELECT DISTINCT conversation_id FROM conversations ORDER BY 1") as cursor:
+            assert [row[0] for row in await cursor.fetchall()] == ["recent", "short"]
+        async with db.execute("SELECT COUNT(*), SUM(indexed) FROM conversation_archive") as cursor:
+            assert tuple(await cursor.fetchone()) == (5, 5)
+
+        # Nothing left to do on a second pass.
+        assert (await manager.compact_idle_conversations(idle_seconds=86400))["conversations"] == 0
+
+    run(manager, scenario)
+
+
+def test_reading_an_archived_conversation_rehydrates_it_unchanged(tmp_path):
+    manager = make_manager(tmp_path)
+    messages = long_conversation("trip to Lisbon")
+    insert(manager, "c1", messages)
+    with sqlite3.connect(manager.db_path) as conn:
+        original = conn.execute("SELECT id, role, content, timestamp FROM conversations ORDER BY id").fetchall()
+
+    async def scenario():
+        await manager.compact_idle_conversations(idle_seconds=86400)
+        db = await manager._get_db()
+        async with db.execute("SELECT COUNT(*) FROM conversations") as cursor:
+            assert (await cursor.fetchone())[0] == 0
+
+        history = await manager.get_conversation_history("c1")
+        assert history == [{"isUser": role == "user", "text": content} for role, content in messages]
+        assert manager.rehydrated == 1
+
+        # Ids and timestamps come back as they were, and the archive is gone.
+        async with db.execute("SELECT id, role, content, timestamp FROM conversations ORDER BY id") as cursor:
+            assert [tuple(row) for row in await cursor.fetchall()] == original
+        async with db.execute("SELECT COUNT(*) FROM conversation_archive") as cursor:
+            assert (await cursor.fetchone())[0] == 0
+        async with db.execute("SELECT COUNT(*) FROM archived_messages") as cursor:
+            assert (await cursor.fetchone())[0] == 0
+
+        # New messages land after the rehydrated ones.
+        await manager.store_message("c1", "user", "And the return flight?")
+        history = await manager.get_conversation_history("c1")
+        assert history[-1] == {"isUser": True, "text": "And the return flight?"}
+        assert len(history) == len(messages) + 1
+
+    run(manager, scenario)
+
+
+def test_archived_messages_stay_searchable(tmp_path):
+    manager = make_manager(tmp_path)
+    insert(manager, "archived", long_conversation("passport renewal"))
+    insert(manager, "hot", [("user", "my passport expires soon"), ("assistant", "Renew it early.")],
+           timestamp="2999-01-01 00:00:00")
+
+    async def scenario():
+        await manager.compact_idle_conversations(idle_seconds=86400)
+
+        total, hits = await manager.search_messages("passport", limit=50)
+        assert total == 31
+        assert {hit["conversation_id"] for hit in hits} == {"archived", "hot"}
+        assert all("<mark>passport</mark>" in hit["snippet"] for hit in hits)
+        # Each index's best hit scores 1.0; raw bm25() from the two is not comparable.
+        assert [hit["score"] for hit in hits[:2]] == [1.0, 1.0]
+        assert all(0 < hit["score"] <= 1.0 for hit in hits)
+        assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+
+        # Pages of the merged list do not overlap.
+        _, first = await manager.search_messages("passport", limit=10)
+        _, second = await manager.search_messages("passport", limit=10, offset=10)
+        assert not {hit["message_id"] for hit in first} & {hit["message_id"] for hit in second}
+
+        # Once rehydrated, the messages are found through the hot index, once.
+        await manager.get_conversation_history("archived")
+        total, hits = await manager.search_messages("passport", limit=50)
+        assert total == 31
+        assert len({hit["message_id"] for hit in hits}) == 31
+
+        total, hits = await manager.search_messages("passport", conversation_id="hot")
+        assert total == 1 and hits[0]["conversation_id"] == "hot"
+
+    run(manager, scenario)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd"])
+def test_archive_blob_round_trip(codec):
+    if codec == "zstd" and conversation_archive.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    rows = [(1, "user", "Grüße 👋", OLD), (2, "assistant", None, OLD)]
+    assert conversation_archive.decompress_rows(*conversation_archive.compress_rows(rows, codec)) == rows
+
+
+def search_ids(db_path: str, match: str):
+    with sqlite3.connect(db_path) as conn:
+        return sorted(row[0] for row in conn.execute(
+            "SELECT rowid FROM conversations_fts WHERE conversations_fts MATCH ?", (match,)
+        ))
+
+
+def test_triggers_keep_the_index_in_sync(tmp_path):
+    manager = make_manager(tmp_path)
+    insert(manager, "c1", [("user", "bake sourdough bread"), ("user", "walk the dog")])
+    assert search_ids(manager.db_path, "sourdough") == [1]
+
+    with sqlite3.connect(manager.db_path) as conn:
+        conn.execute("UPDATE conversations SET content = 'bake rye bread' WHERE id = 1")
+    assert search_ids(manager.db_path, "sourdough") == []
+    assert search_ids(manager.db_path, "rye") == [1]
+
+    with sqlite3.connect(manager.db_path) as conn:
+        conn.execute("DELETE FROM conversations WHERE id = 1")
+    assert search_ids(manager.db_path, "rye") == []
+    assert search_ids(manager.db_path, "bread") == []
+    assert search_ids(manager.db_path, "dog") == [2]
+    with sqlite3.connect(manager.db_path) as conn:
+        # The index agrees with its content table.
+        conn.execute("INSERT INTO conversations_fts (conversations_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_backfill_indexes_older_messages_and_resumes(tmp_path):
+    db_path = str(tmp_path / "chat_history.db")
+    # A database from before the search index, migrated in place.
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            CREATE TABLE conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT,
+                role TEXT,
+                content TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO conversations (conversation_id, role, content) VALUES ('old', 'user', ?)",
+            [(f"old note {i} about tomatoes",) for i in range(10)]
+        )
+        conn.execute("PRAGMA user_version = 1")
+    manager = make_manager(tmp_path)
+    manager.search_backfill_batch = 4
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT done_upto, stop_id FROM search_backfill").fetchone() == (0, 10)
+        # Partway through: the first batch was indexed before a restart.
+        conn.execute("INSERT INTO conversations_fts (rowid, content) SELECT id, content FROM conversations WHERE id <= 4")
+        conn.execute("UPDATE search_backfill SET done_upto = 4")
+    insert(manager, "new", [("user", "new note about tomatoes")])
+    # Deleting a row the backfill has not reached must not touch the index.
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM conversations WHERE id = 7")
+    assert search_ids(db_path, "tomatoes") == [1, 2, 3, 4, 11]
+
+    async def scenario():
+        await manager._get_db()
+        await asyncio.wait_for(manager._backfill_task, timeout=5)
+        total, hits = await manager.search_messages("tomatoes", limit=50)
+        assert total == 10 and len(hits) == 10
+
+    run(manager, scenario)
+    assert search_ids(db_path, "tomatoes") == [1, 2, 3, 4, 5, 6, 8, 9, 10, 11]
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT done_upto, stop_id FROM search_backfill").fetchone() == (10, 10)
+        conn.execute("INSERT INTO conversations_fts (conversations_fts, rank) VALUES ('integrity-check', 1)")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("hello world", '"hello" "world"*'),
+    ('say "hi" to -bob', '"say" "hi" "to" "bob"*'),
+    ("NEAR(a b) OR c AND NOT d", '"NEAR" "a" "b" "OR" "c" "AND" "NOT" "d"*'),
+    ("pass* col:umn ^start", '"pass" "col" "umn" "start"*'),
+    ("\"*-:()^", ''),
+])
+def test_fts_query_quotes_every_word(text, expected):
+    assert fts_query(text) == expected
+
+
+@pytest.mark.parametrize("query, matches", [
+    ('"unbalanced', 0),
+    ("NEAR(", 1),
+    ("-dog", 1),
+    ("*", 0),
+    ("a OR", 1),
+    ("col:dog", 0),
+    ("dog)", 1),
+])
+def test_search_treats_fts_syntax_as_plain_words(tmp_path, query, matches):
+    manager = make_manager(tmp_path)
+    insert(manager, "c1", [("user", "walk the dog"), ("user", "near the col, a or b")])
+
+    async def scenario():
+        total, hits = await manager.search_messages(query)
+        assert total == len(hits) == matches
+
+    run(manager, scenario)
+
+
+def test_history_cache_notices_writes_from_another_worker(tmp_path):
+    mine, other = make_manager(tmp_path), make_manager(tmp_path)
+    messages = long_conversation("tax return", turns=10)
+    insert(mine, "c1", messages)
+
+    def texts(history):
+        return [message["text"] for message in history][len(messages):]
+
+    async def scenario():
+        assert len(await mine.get_conversation_history("c1")) == 10
+
+        # Our own messages keep the cached copy valid once they are committed.
+        await mine.store_message("c1", "user", "how are you?")
+        assert texts(await mine.get_conversation_history("c1")) == ["how are you?"]
+        await asyncio.sleep(0.1)
+        assert mine.writer.queue_depth == 0
+        assert texts(await mine.get_conversation_history("c1")) == ["how are you?"]
+        assert mine.history_cache.stats()["hits"] == 2
+
+        # Another worker answers in the same conversation.
+        await other.store_message("c1", "assistant", "fine, thanks")
+        await other.close()
+        assert texts(await mine.get_conversation_history("c1")) == ["how are you?", "fine, thanks"]
+        assert mine.history_cache.stats()["stale"] == 1
+
+        # ...or archives it; the cached copy is dropped and the archive rehydrated.
+        assert (await other.compact_idle_conversations(idle_seconds=-86400))["conversations"] == 1
+        await other.close()
+        assert texts(await mine.get_conversation_history("c1")) == ["how are you?", "fine, thanks"]
+        assert mine.history_cache.stats()["stale"] == 2
+        assert mine.rehydrated == 1
+
+    run(mine, scenario)
@@ -0,0 +1,280 @@
+import asyncio
+import json
+
+import pytest
+
+from connection_manager import ConnectionManager
+from metrics import MetricsRegistry
+from ws_session import ClientSession
+
+
+class FakeWebSocket:
+    """Accepts everything; a slow one never finishes sending until released."""
+
+    def __init__(self, slow: bool = False):
+        self.sent = []
+        self.release = asyncio.Event()
+        if not slow:
+            self.release.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.send_text(data)
+
+    async def close(self, code=1000):
+        pass
+
+
+def test_slow_client_queue_depth_is_reported_per_connection():
+    async def scenario():
+        manager = ConnectionManager(max_queue=100, metrics_connections=1)
+        registry = MetricsRegistry()
+        registry.register_stats("websocket_connection", manager.connection_stats, label="client_id")
+        slow, fast = FakeWebSocket(slow=True), FakeWebSocket()
+        await manager.connect(slow, "slow")
+        await manager.connect(fast, "fast")
+
+        for index in range(10):
+            await manager.send_message({"type": "token", "token": str(index)}, "slow")
+            await manager.send_message({"type": "token", "token": str(index)}, "fast")
+        await asyncio.sleep(0.05)
+
+        # The slow client's writer is stuck on the first frame; the rest wait in its queue.
+        assert len(fast.sent) == 10
+        assert manager.connection_stats() == [
+            {"client_id": "slow", **manager.senders["slow"].stats()}
+        ]
+        assert manager.connection_stats()[0]["queue_depth"] == 9
+        assert manager.stats()["queued_frames"] == 9
+        assert 'assistant_websocket_connection_queue_depth{client_id="slow"} 9' in registry.render()
+
+        slow.release.set()
+        await asyncio.sleep(0.05)
+        assert manager.connection_stats()[0]["queue_depth"] == 0
+        await manager.disconnect("slow")
+        await manager.disconnect("fast")
+
+    asyncio.run(scenario())
+
+
+def received(websocket):
+    return [json.loads(frame) for frame in websocket.sent]
+
+
+def test_frames_after_reports_gaps():
+    async def scenario():
+        session = ClientSession("c1", max_frames=3)
+        assert session.frames_after(0) == []
+        for index in range(5):
+            assert session.record({"type": "token", "token": str(index)})["seq"] == index + 1
+
+        assert [frame["seq"] for frame in session.frames_after(2)] == [3, 4, 5]
+        assert session.frames_after(5) == []
+        # Frames 1 and 2 fell out of the buffer, and 9 was never sent.
+        assert session.frames_after(1) is None
+        assert session.frames_after(9) is None
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_replays_missed_frames():
+    async def scenario():
+        manager = ConnectionManager(resume_grace=60, generation_grace=60)
+        first = FakeWebSocket()
+        await manager.connect(first, "c1")
+        await manager.send_message({"type": "token", "token": "a"}, "c1")
+        await asyncio.sleep(0.01)
+        await manager.disconnect("c1", first)
+        assert not manager.sessions["c1"].connected
+
+        # Sent while the client is away: kept for replay only.
+        assert not await manager.send_message({"type": "token", "token": "b"}, "c1")
+        await manager.send_message({"type": "chat_done", "message": "ab"}, "c1")
+
+        second = FakeWebSocket()
+        await manager.connect(second, "c1", resume_from=1)
+        await manager.send_message({"type": "token", "token": "c"}, "c1")
+        await asyncio.sleep(0.01)
+
+        assert received(first) == [{"type": "token", "token": "a", "seq": 1}]
+        assert received(second) == [
+            {"type": "token", "token": "b", "seq": 2},
+            {"type": "chat_done", "message": "ab", "seq": 3},
+            {"type": "resumed", "last_seq": 1, "replayed": 2, "seq": 4},
+            {"type": "token", "token": "c", "seq": 5}
+        ]
+        assert manager.stats()["resumes"] == 1
+        assert manager.stats()["frames_replayed"] == 2
+        await manager.disconnect("c1")
+
+    asyncio.run(scenario())
+
+
+def test_resume_from_an_unknown_position_fails():
+    async def scenario():
+        manager = ConnectionManager(replay_frames=2)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "c1")
+        for index in range(4):
+            await manager.send_message({"type": "token", "token": str(index)}, "c1")
+        await manager.disconnect("c1")
+
+        again = FakeWebSocket()
+        await manager.connect(again, "c1", resume_from=1)
+        await asyncio.sleep(0.01)
+        assert received(again) == [{"type": "resume_failed", "last_seq": 1, "seq": 5}]
+        assert manager.stats()["failed_resumes"] == 1
+        await manager.disconnect("c1")
+
+    asyncio.run(scenario())
+
+
+def test_session_expires_after_resume_grace():
+    async def scenario():
+        manager = ConnectionManager(resume_grace=0.05, generation_grace=0.01)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "c1")
+        generation = manager.start_generation("c1", asyncio.sleep(10))
+        await manager.disconnect("c1")
+
+        await asyncio.sleep(0.03)
+        assert generation.cancelled()
+        assert "c1" in manager.sessions
+        await asyncio.sleep(0.05)
+        assert "c1" not in manager.sessions
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_within_grace_keeps_generations_running():
+    async def scenario():
+        manager = ConnectionManager(resume_grace=0.05, generation_grace=0.02)
+        await manager.connect(FakeWebSocket(), "c1")
+        generation = manager.start_generation("c1", asyncio.sleep(0.2))
+        await manager.disconnect("c1")
+        await manager.connect(FakeWebSocket(), "c1")
+
+        await asyncio.sleep(0.1)
+        assert not generation.done()
+        assert "c1" in manager.sessions
+        generation.cancel()
+        await manager.disconnect("c1")
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_without_generation_grace_still_expires_the_session():
+    async def scenario():
+        manager = ConnectionManager(resume_grace=0.05, generation_grace=0)
+        await manager.connect(FakeWebSocket(), "c1")
+        generation = manager.start_generation("c1", asyncio.sleep(10))
+        await manager.disconnect("c1")
+        await asyncio.sleep(0)
+
+        assert generation.cancelled()
+        assert not manager.sessions["c1"].connected
+        await asyncio.sleep(0.1)
+        assert "c1" not in manager.sessions
+
+    asyncio.run(scenario())
+
+
+class FakeRequest:
+    """An HTTP request whose client disconnects once `gone` is set."""
+
+    def __init__(self):
+        self.gone = asyncio.Event()
+
+    async def receive(self):
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+
+def test_http_client_disconnect_cancels_generation_with_499():
+    async def scenario():
+        manager = ConnectionManager()
+        request = FakeRequest()
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def generation():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        handler = asyncio.create_task(manager.run_for_request("c1", generation(), request))
+        await started.wait()
+        assert manager.stats()["generations_in_flight"] == 1
+        request.gone.set()
+
+        response = await asyncio.wait_for(handler, timeout=1)
+        assert response.status_code == 499
+        assert cancelled.is_set()
+        assert manager.stats()["generations_in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_finished_generation_is_returned_as_is():
+    async def scenario():
+        manager = ConnectionManager()
+
+        async def generation():
+            return {"message": "Hello"}
+
+        assert await manager.run_for_request("c1", generation(), FakeRequest()) == {"message": "Hello"}
+        assert manager.generations == {}
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_the_handler_is_not_a_client_disconnect():
+    async def scenario():
+        manager = ConnectionManager()
+        handler = asyncio.create_task(manager.run_for_request("c1", asyncio.sleep(10), FakeRequest()))
+        await asyncio.sleep(0.01)
+        handler.cancel()
+        # Server shutdown: the cancellation propagates instead of turning into a 499.
+        with pytest.raises(asyncio.CancelledError):
+            await handler
+
+    asyncio.run(scenario())
+
+
+def test_websocket_disconnect_and_cancel_stop_tracked_generations():
+    async def scenario():
+        manager = ConnectionManager(generation_grace=0)
+
+        async def streamed_turn():
+            with manager.track_generation("c1"):
+                await asyncio.sleep(10)
+
+        await manager.connect(FakeWebSocket(), "c1")
+        first = manager.start_generation("c1", asyncio.sleep(10))
+        second = asyncio.create_task(streamed_turn())
+        await asyncio.sleep(0.01)
+        assert manager.stats()["generations_in_flight"] == 2
+
+        await manager.disconnect("c1")
+        await asyncio.gather(first, second, return_exceptions=True)
+        assert first.cancelled() and second.cancelled()
+        assert manager.generations == {}
+
+        # A {"type": "cancel"} frame stops a running turn without disconnecting.
+        await manager.connect(FakeWebSocket(), "c1")
+        third = manager.start_generation("c1", asyncio.sleep(10))
+        await asyncio.sleep(0)
+        assert manager.cancel_generations("c1") == 1
+        await asyncio.gather(third, return_exceptions=True)
+        assert third.cancelled()
+        await manager.disconnect("c1")
+
+    asyncio.run(scenario())
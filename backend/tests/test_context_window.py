@@ -0,0 +1,86 @@
+import asyncio
+
+from context_service import ContextWindowManager
+from llm_scheduler import BACKGROUND
+
+SYSTEM_PROMPT = {"role": "system", "content": "You are a helpful assistant."}
+
+
+class SlowSummarizer:
+    """Stands in for the Ollama client: summaries only return once released."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.priorities = []
+
+    async def chat(self, messages, options=None, priority=None):
+        self.priorities.append(priority)
+        await self.release.wait()
+        return {"message": {"role": "assistant", "content": "They talked about turn 0."}}
+
+
+def test_first_summary_is_built_in_the_background():
+    async def scenario():
+        client = SlowSummarizer()
+        manager = ContextWindowManager(client, token_budget=200, summary_max_tokens=16)
+        history = [
+            {"role": "user" if index % 2 == 0 else "assistant", "content": f"turn {index} " + "word " * 30}
+            for index in range(12)
+        ]
+
+        # The summary call is stuck, so the turn must not wait for it.
+        messages = await asyncio.wait_for(
+            manager.build_messages(SYSTEM_PROMPT, history, "And now?", conversation_id="c1"), timeout=1
+        )
+        assert not any(message["content"].startswith("Summary of") for message in messages)
+        assert messages[-1] == {"role": "user", "content": "And now?"}
+        assert len(messages) < len(history) + 2
+        await asyncio.sleep(0)
+        assert client.priorities == [BACKGROUND]
+
+        client.release.set()
+        await asyncio.sleep(0.05)
+        messages = await manager.build_messages(SYSTEM_PROMPT, history, "And now?", conversation_id="c1")
+        assert {"role": "system", "content": "Summary of the earlier conversation: They talked about turn 0."} in messages
+        assert client.priorities == [BACKGROUND]
+
+    asyncio.run(scenario())
+
+
+class FlakySummarizer:
+    """Fails the first summary call, then succeeds."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def chat(self, messages, options=None, priority=None):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("Ollama is down")
+        return {"message": {"role": "assistant", "content": "They talked about turn 0."}}
+
+
+def test_failed_summary_is_retried_on_the_next_turn():
+    async def scenario():
+        client = FlakySummarizer()
+        manager = ContextWindowManager(client, token_budget=200, summary_max_tokens=16, refresh_after=6)
+        history = [
+            {"role": "user" if index % 2 == 0 else "assistant", "content": f"turn {index} " + "word " * 30}
+            for index in range(12)
+        ]
+
+        await manager.build_messages(SYSTEM_PROMPT, history, "And now?", conversation_id="c1")
+        await asyncio.sleep(0.05)
+        assert client.calls == 1
+        # Nothing was summarized, so no coverage is recorded for the older turns.
+        assert "c1" not in manager._summaries
+
+        # Same history, well within refresh_after of the failed attempt: still retried.
+        messages = await manager.build_messages(SYSTEM_PROMPT, history, "And now?", conversation_id="c1")
+        assert not any(message["content"].startswith("Summary of") for message in messages)
+        await asyncio.sleep(0.05)
+        assert client.calls == 2
+        messages = await manager.build_messages(SYSTEM_PROMPT, history, "And now?", conversation_id="c1")
+        assert {"role": "system", "content": "Summary of the earlier conversation: They talked about turn 0."} in messages
+
+    asyncio.run(scenario())
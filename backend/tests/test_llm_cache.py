@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from llm_cache import LLMResponseCache
+
+MESSAGES = [{"role": "user", "content": "Summarize this conversation."}]
+
+
+def test_coalesced_call_survives_cancelled_caller(tmp_path):
+    async def scenario():
+        cache = LLMResponseCache(db_path=str(tmp_path / "llm_cache.db"))
+        release = asyncio.Event()
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return {"message": {"role": "assistant", "content": "A summary."}}
+
+        try:
+            leader = asyncio.create_task(cache.get_or_call("llama3", MESSAGES, None, call))
+            await asyncio.sleep(0.05)
+            follower = asyncio.create_task(cache.get_or_call("llama3", MESSAGES, None, call))
+            await asyncio.sleep(0.05)
+
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            release.set()
+
+            assert (await follower)["message"]["content"] == "A summary."
+            assert calls == 1
+            assert cache.stats()["coalesced"] == 1
+            assert (await cache.get_or_call("llama3", MESSAGES, None, call))["message"]["content"] == "A summary."
+            assert cache.stats()["hits"] == 1
+        finally:
+            await cache.close()
+
+    asyncio.run(scenario())
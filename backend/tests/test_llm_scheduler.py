@@ -0,0 +1,145 @@
+import asyncio
+
+from llm_scheduler import LLMScheduler, INTERACTIVE, BACKGROUND
+
+
+class FakeBackend:
+    """Stands in for Ollama: records the order generations start in and holds each until finished."""
+
+    def __init__(self, scheduler: LLMScheduler):
+        self.scheduler = scheduler
+        self.started = []
+        self._running = {}
+        self._tasks = []
+
+    def submit(self, name, priority=INTERACTIVE, client_id=None):
+        self._tasks.append(asyncio.create_task(self._generate(name, priority, client_id)))
+        return self._tasks[-1]
+
+    async def _generate(self, name, priority, client_id):
+        async with self.scheduler.slot(priority, client_id):
+            self.started.append(name)
+            done = self._running[name] = asyncio.Event()
+            await done.wait()
+
+    def finish(self, name):
+        self._running.pop(name).set()
+
+    @property
+    def running(self):
+        return sorted(self._running)
+
+    async def drain(self):
+        """Finish everything, including work still queued, until all submissions are done."""
+        while not all(task.done() for task in self._tasks):
+            for name in list(self._running):
+                self.finish(name)
+            await settle()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def run_one_at_a_time(backend: FakeBackend, first: str):
+    """Finish generations one by one and return the order the queued ones started in."""
+    backend.finish(first)
+    await settle()
+    while backend.running:
+        backend.finish(backend.running[0])
+        await settle()
+    return backend.started[1:]
+
+
+def test_interactive_work_is_admitted_before_background_work():
+    async def scenario():
+        backend = FakeBackend(LLMScheduler(max_in_flight=1))
+        backend.submit("busy")
+        await settle()
+        backend.submit("summary-1", BACKGROUND)
+        backend.submit("chat-1")
+        backend.submit("summary-2", BACKGROUND)
+        backend.submit("chat-2")
+        await settle()
+        assert backend.started == ["busy"]
+
+        assert await run_one_at_a_time(backend, "busy") == ["chat-1", "chat-2", "summary-1", "summary-2"]
+        await backend.drain()
+
+    asyncio.run(scenario())
+
+
+def test_clients_are_served_round_robin_within_a_class():
+    async def scenario():
+        backend = FakeBackend(LLMScheduler(max_in_flight=1))
+        backend.submit("busy")
+        await settle()
+        for name in ("a1", "a2", "a3"):
+            backend.submit(name, client_id="alice")
+        backend.submit("b1", client_id="bob")
+        backend.submit("c1", client_id="carol")
+        backend.submit("b2", client_id="bob")
+        await settle()
+
+        assert await run_one_at_a_time(backend, "busy") == ["a1", "b1", "c1", "a2", "b2", "a3"]
+        await backend.drain()
+
+    asyncio.run(scenario())
+
+
+def test_background_work_never_takes_more_than_its_cap():
+    async def scenario():
+        scheduler = LLMScheduler(max_in_flight=3, max_background_in_flight=1)
+        backend = FakeBackend(scheduler)
+        for index in range(3):
+            backend.submit(f"summary-{index}", BACKGROUND)
+        await settle()
+        assert backend.running == ["summary-0"]
+
+        # The slots background work may not use stay free for chat.
+        backend.submit("chat-1")
+        backend.submit("chat-2")
+        await settle()
+        assert backend.running == ["chat-1", "chat-2", "summary-0"]
+        backend.submit("chat-3")
+        await settle()
+        assert "chat-3" not in backend.running
+
+        stats = scheduler.stats()
+        assert stats["background"]["in_flight"] == 1
+        assert stats["background"]["queue_depth"] == 2
+        assert stats["interactive"]["queue_depth"] == 1
+
+        # A freed slot goes to the waiting chat, not to the queued summaries.
+        backend.finish("summary-0")
+        await settle()
+        assert backend.running == ["chat-1", "chat-2", "chat-3"]
+        backend.finish("chat-1")
+        await settle()
+        assert backend.running == ["chat-2", "chat-3", "summary-1"]
+        await backend.drain()
+        assert scheduler.stats()["background"]["in_flight"] == 0
+        assert scheduler.stats()["interactive"]["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiters_give_up_their_place_without_leaking_slots():
+    async def scenario():
+        scheduler = LLMScheduler(max_in_flight=1)
+        backend = FakeBackend(scheduler)
+        backend.submit("busy")
+        await settle()
+        abandoned = backend.submit("abandoned")
+        backend.submit("next")
+        await settle()
+        abandoned.cancel()
+        await settle()
+
+        assert await run_one_at_a_time(backend, "busy") == ["next"]
+        await backend.drain()
+        assert scheduler.stats()["interactive"]["in_flight"] == 0
+        assert scheduler.stats()["interactive"]["queue_depth"] == 0
+
+    asyncio.run(scenario())
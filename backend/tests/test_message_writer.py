@@ -0,0 +1,28 @@
+import asyncio
+import logging
+
+import aiosqlite
+
+from message_writer import MessageWriter
+
+
+def test_stop_logs_a_failed_final_flush(tmp_path, caplog):
+    async def scenario():
+        # No conversations table, so every batch fails.
+        db = await aiosqlite.connect(str(tmp_path / "chat.db"))
+
+        async def get_db():
+            return db
+
+        writer = MessageWriter(get_db)
+        writer.start()
+        writer.enqueue("c1", "user", "Hello")
+        try:
+            await asyncio.wait_for(writer.stop(), timeout=5)
+        finally:
+            await db.close()
+        assert writer.rows_written == 0
+
+    with caplog.at_level(logging.ERROR, logger="message_writer"):
+        asyncio.run(scenario())
+    assert "dropping 1 unsaved" in caplog.text
@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import pytest
+from ollama import ResponseError
+
+from llm_service import LLMService
+from ollama_pool import OllamaBackendPool
+
+
+def fake_ollama(name, state=None):
+    """
+    An Ollama stand-in that answers /api/chat with its `name` and /api/tags
+    with no models. While `state["down"]` is set every request gets a 503;
+    `state["status"]` forces another error status for chat requests.
+    """
+    state = state if state is not None else {}
+    state.setdefault("chats", 0)
+
+    def respond(method, path, headers, body):
+        if state.get("down"):
+            return 503, {"Content-Type": "application/json"}, b'{"error": "overloaded"}'
+        if path == "/api/tags":
+            return 200, {"Content-Type": "application/json"}, b'{"models": []}'
+        if path == "/api/chat":
+            state["chats"] += 1
+            if state.get("status"):
+                return state["status"], {"Content-Type": "application/json"}, b'{"error": "bad request"}'
+            request = json.loads(body)
+            done = {"model": request["model"], "done": True, "eval_count": 2, "message": {"role": "assistant", "content": ""}}
+            if request.get("stream"):
+                chunks = [{"model": request["model"], "done": False, "message": {"role": "assistant", "content": word}} for word in (name, "!")]
+                lines = b"".join(json.dumps(chunk).encode() + b"\n" for chunk in chunks + [done])
+                return 200, {"Content-Type": "application/x-ndjson"}, lines
+            return 200, {"Content-Type": "application/json"}, json.dumps({**done, "message": {"role": "assistant", "content": name}}).encode()
+        return 404, {}, b""
+
+    return respond, state
+
+
+def make_service(hosts):
+    return LLMService(OllamaBackendPool.from_hosts(hosts, health_interval=0.05, probe_timeout=1), default_timeout=5)
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_chat_fails_over_to_a_healthy_backend(serve):
+    failing, failing_state = fake_ollama("a", {"down": True})
+    working, working_state = fake_ollama("b")
+    service = make_service([serve(failing), serve(working)])
+
+    async def scenario():
+        try:
+            response = await service.chat(MESSAGES, conversation_id="c1")
+            # The failed backend is out of rotation, so the next call goes straight to the other one.
+            await service.chat(MESSAGES, conversation_id="c2")
+            return response
+        finally:
+            await service.aclose()
+
+    response = asyncio.run(scenario())
+    assert response["message"]["content"] == "b"
+    assert working_state["chats"] == 2
+    stats = {backend["host"]: backend for backend in service.pool.stats()}
+    assert [backend["healthy"] for backend in stats.values()] == [False, True]
+    assert list(stats.values())[0]["consecutive_failures"] == 1
+
+
+def test_unreachable_backend_is_skipped(serve):
+    working, _ = fake_ollama("b")
+    service = make_service(["http://127.0.0.1:9", serve(working)])
+
+    async def scenario():
+        try:
+            return await service.chat(MESSAGES)
+        finally:
+            await service.aclose()
+
+    assert asyncio.run(scenario())["message"]["content"] == "b"
+    assert [backend.healthy for backend in service.pool.backends] == [False, True]
+
+
+def test_client_errors_do_not_fail_over(serve):
+    first, first_state = fake_ollama("a", {"status": 400})
+    second, second_state = fake_ollama("b", {"status": 400})
+    service = make_service([serve(first), serve(second)])
+
+    async def scenario():
+        try:
+            await service.chat(MESSAGES)
+        finally:
+            await service.aclose()
+
+    with pytest.raises(ResponseError):
+        asyncio.run(scenario())
+    assert first_state["chats"] + second_state["chats"] == 1
+    assert all(backend.healthy for backend in service.pool.backends)
+
+
+def test_stream_fails_over_before_the_first_chunk(serve):
+    failing, _ = fake_ollama("a", {"down": True})
+    working, _ = fake_ollama("b")
+    service = make_service([serve(failing), serve(working)])
+
+    async def scenario():
+        try:
+            return [chunk["message"]["content"] async for chunk in service.stream_chat(MESSAGES)]
+        finally:
+            await service.aclose()
+
+    assert "".join(asyncio.run(scenario())) == "b!"
+
+
+def test_health_probe_takes_backends_out_and_back_into_rotation(serve):
+    respond, state = fake_ollama("a")
+    pool = OllamaBackendPool.from_hosts([serve(respond)], health_interval=0.05, probe_timeout=1)
+    backend = pool.backends[0]
+
+    async def wait_until(condition):
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0.02)
+        raise AssertionError("health probe did not catch up")
+
+    async def scenario():
+        pool.start()
+        try:
+            await wait_until(lambda: backend.last_probe_latency is not None)
+            state["down"] = True
+            await wait_until(lambda: not backend.healthy)
+            assert "503" in backend.last_error or "overloaded" in backend.last_error
+            state["down"] = False
+            await wait_until(lambda: backend.healthy)
+        finally:
+            await pool.aclose()
+
+    asyncio.run(scenario())
+    assert backend.consecutive_failures == 0
+
+
+def test_conversations_stick_to_their_backend_unless_it_is_much_busier():
+    pool = OllamaBackendPool.from_hosts(["http://a:11434", "http://b:11434"], sticky_slack=1)
+    first, second = pool.backends
+    pool.remember("c1", second)
+    assert pool.pick("c1") is second
+
+    second.outstanding = 2
+    assert pool.pick("c1") is first
+    assert pool.pick("c1", exclude=[first]) is second
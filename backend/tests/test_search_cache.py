@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from search_cache import SearchCache, normalize_query
+
+
+def test_normalize_query_folds_case_whitespace_and_punctuation():
+    assert normalize_query("  Python   Asyncio?! ") == "python asyncio"
+    assert normalize_query('"c++" -java site:example.com') == '"c++" -java site:example.com'
+
+
+def test_coalesced_fetch_survives_cancelled_caller(tmp_path):
+    async def scenario():
+        cache = SearchCache(db_path=str(tmp_path / "search_cache.db"))
+        release = asyncio.Event()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return [{"link": "https://example.com"}]
+
+        try:
+            leader = asyncio.create_task(cache.get_or_fetch("web", "python", 5, fetch))
+            await asyncio.sleep(0.05)
+            follower = asyncio.create_task(cache.get_or_fetch("web", "Python", 5, fetch))
+            await asyncio.sleep(0.05)
+
+            leader.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+            release.set()
+
+            assert await follower == [{"link": "https://example.com"}]
+            assert calls == 1
+            assert cache.stats()["coalesced"] == 1
+            # The result was cached although the caller that started the fetch went away.
+            assert await cache.get_or_fetch("web", "python", 5, fetch) == [{"link": "https://example.com"}]
+            assert calls == 1
+        finally:
+            await cache.close()
+
+    asyncio.run(scenario())
+
+
+def test_fetch_is_cancelled_once_every_caller_is_gone(tmp_path):
+    async def scenario():
+        cache = SearchCache(db_path=str(tmp_path / "search_cache.db"))
+        cancelled = asyncio.Event()
+
+        async def fetch():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        try:
+            caller = asyncio.create_task(cache.get_or_fetch("web", "python", 5, fetch))
+            await asyncio.sleep(0.05)
+            caller.cancel()
+            await asyncio.wait_for(cancelled.wait(), 1)
+        finally:
+            await cache.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_fetch_reaches_every_caller(tmp_path):
+    async def scenario():
+        cache = SearchCache(db_path=str(tmp_path / "search_cache.db"))
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            raise RuntimeError("quota exceeded")
+
+        try:
+            results = await asyncio.gather(
+                cache.get_or_fetch("web", "python", 5, fetch),
+                cache.get_or_fetch("web", "python", 5, fetch),
+                return_exceptions=True
+            )
+            assert [str(result) for result in results] == ["quota exceeded", "quota exceeded"]
+        finally:
+            await cache.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+import pytest
+
+from search_service import GoogleSearchClient
+
+ITEMS = {"items": [{"title": "Python", "link": "https://python.org", "snippet": "The language"}]}
+
+
+def fake_cse(replies):
+    """A Custom Search stand-in answering with `replies` in turn (the last one repeats), recording queries."""
+    seen = []
+
+    def respond(method, path, headers, body):
+        seen.append((time.monotonic(), parse_qs(urlsplit(path).query)))
+        status, extra_headers, payload = replies[min(len(seen), len(replies)) - 1]
+        return status, {"Content-Type": "application/json", **extra_headers}, json.dumps(payload).encode()
+
+    return respond, seen
+
+
+def make_client(base_url, **kwargs):
+    return GoogleSearchClient("key", "engine", base_url=base_url, timeout=2, **kwargs)
+
+
+def test_retries_transient_errors_then_returns_results(serve):
+    respond, seen = fake_cse([(503, {}, {}), (429, {}, {}), (200, {}, ITEMS)])
+    client = make_client(serve(respond), max_retries=3, backoff=0.01)
+
+    async def scenario():
+        try:
+            return await client.web("python", num_results=3, start=11)
+        finally:
+            await client.aclose()
+
+    results = asyncio.run(scenario())
+    assert [result.link for result in results] == ["https://python.org"]
+    assert len(seen) == 3
+    assert seen[-1][1] == {"key": ["key"], "cx": ["engine"], "q": ["python"], "num": ["3"], "start": ["11"]}
+    assert client.stats() == {"requests": 3, "retries": 2, "failures": 0}
+
+
+def test_honours_retry_after(serve):
+    respond, seen = fake_cse([(429, {"Retry-After": "0.3"}, {}), (200, {}, ITEMS)])
+    client = make_client(serve(respond), backoff=0.001)
+
+    async def scenario():
+        try:
+            await client.web("python")
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+    assert seen[1][0] - seen[0][0] >= 0.3
+
+
+def test_backoff_is_capped(serve):
+    respond, seen = fake_cse([(500, {"Retry-After": "60"}, {}), (200, {}, ITEMS)])
+    client = make_client(serve(respond), max_backoff=0.05)
+
+    async def scenario():
+        try:
+            await client.web("python")
+        finally:
+            await client.aclose()
+
+    started = time.monotonic()
+    asyncio.run(scenario())
+    assert time.monotonic() - started < 2
+    assert len(seen) == 2
+
+
+def test_gives_up_after_max_retries(serve):
+    respond, seen = fake_cse([(503, {}, {})])
+    client = make_client(serve(respond), max_retries=2, backoff=0.01)
+
+    async def scenario():
+        try:
+            await client.web("python")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(scenario())
+    assert len(seen) == 3
+    assert client.stats() == {"requests": 3, "retries": 2, "failures": 1}
+
+
+def test_client_errors_are_not_retried(serve):
+    respond, seen = fake_cse([(400, {}, {"error": "bad request"})])
+    client = make_client(serve(respond), backoff=0.01)
+
+    async def scenario():
+        try:
+            await client.images("python")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(scenario())
+    assert len(seen) == 1
+    assert seen[0][1]["searchType"] == ["image"]
+
+
+def test_connection_errors_are_retried():
+    # Nothing listens on the port, so every attempt fails to connect.
+    client = GoogleSearchClient("key", "engine", base_url="http://127.0.0.1:9/customsearch", max_retries=2, backoff=0.01)
+
+    async def scenario():
+        try:
+            await client.web("python")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(httpx.TransportError):
+        asyncio.run(scenario())
+    assert client.stats() == {"requests": 3, "retries": 2, "failures": 1}
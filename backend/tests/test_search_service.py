@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+import search_service
+from search_cache import SearchCache
+from search_service import GoogleSearchClient, deep_search, search_all
+
+# How many results the fake API has for any query.
+AVAILABLE = 35
+
+
+def fake_cse(image_delay: float = 0.0, failing_starts=()):
+    """
+    A Custom Search stand-in with AVAILABLE ranked results per query. Image
+    requests answer after `image_delay` seconds; pages starting at
+    `failing_starts` fail with a 400, which is not retried.
+    """
+    seen = []
+
+    def respond(method, path, headers, body):
+        params = {name: values[0] for name, values in parse_qs(urlsplit(path).query).items()}
+        seen.append(params)
+        start, num = int(params["start"]), int(params["num"])
+        if start in failing_starts:
+            return 400, {"Content-Type": "application/json"}, b'{"error": "bad request"}'
+        image = params.get("searchType") == "image"
+        if image:
+            time.sleep(image_delay)
+        items = [
+            {
+                "title": f"Result {rank}",
+                "link": f"https://example.com/{'img' if image else 'page'}/{rank}",
+                "snippet": f"Snippet {rank}",
+                "image": {"thumbnailLink": f"https://example.com/thumb/{rank}"}
+            }
+            for rank in range(start, min(start + num, AVAILABLE + 1))
+        ]
+        return 200, {"Content-Type": "application/json"}, json.dumps({"items": items}).encode()
+
+    return respond, seen
+
+
+@pytest.fixture
+def search_api(serve, tmp_path, monkeypatch):
+    """Point search_service at a fake API (see fake_cse) and a fresh cache; returns the recorded requests."""
+    def start(**kwargs):
+        respond, seen = fake_cse(**kwargs)
+        monkeypatch.setattr(search_service, "search_client", GoogleSearchClient(
+            "key", "engine", base_url=serve(respond), timeout=5, max_retries=0
+        ))
+        monkeypatch.setattr(search_service, "search_cache", SearchCache(db_path=str(tmp_path / "search_cache.db")))
+        return seen
+
+    return start
+
+
+def run(scenario):
+    async def wrapped():
+        try:
+            return await scenario()
+        finally:
+            await search_service.search_client.aclose()
+            await search_service.search_cache.close()
+
+    return asyncio.run(wrapped())
+
+
+def ranks(results):
+    return [int(result.link.rsplit("/", 1)[1]) for result in results]
+
+
+def test_deep_search_pages_through_every_result(search_api):
+    seen = search_api()
+
+    async def scenario():
+        collected, cursor, calls = [], 1, 0
+        while cursor is not None:
+            results, cursor = await deep_search("web", "python", 20, cursor)
+            collected += results
+            calls += 1
+        return collected, calls
+
+    collected, calls = run(scenario)
+    # 1-20, then 21-35: a short last page means there is nothing after it.
+    assert ranks(collected) == list(range(1, AVAILABLE + 1))
+    assert calls == 2
+    assert sorted((int(params["start"]), int(params["num"])) for params in seen) == [
+        (1, 10), (11, 10), (21, 10), (31, 10)
+    ]
+
+
+def test_deep_search_stops_at_the_api_limit(search_api, monkeypatch):
+    monkeypatch.setattr(search_service, "MAX_RESULTS", 30)
+    seen = search_api()
+
+    async def scenario():
+        first = await deep_search("web", "python", 20, 1)
+        # Only ranks up to MAX_RESULTS can be asked for, however many exist.
+        second = await deep_search("web", "python", 20, 21)
+        return first, second
+
+    (first, first_cursor), (second, second_cursor) = run(scenario)
+    assert ranks(first) == list(range(1, 21)) and first_cursor == 21
+    assert ranks(second) == list(range(21, 31)) and second_cursor is None
+    assert max(int(params["start"]) for params in seen) == 21
+
+
+def test_deep_search_returns_the_other_pages_when_one_fails(search_api):
+    search_api(failing_starts={11})
+
+    async def scenario():
+        middle = await deep_search("web", "python", 30, 1)
+        last = await deep_search("web", "python", 20, 21)
+        return middle, last
+
+    (middle, middle_cursor), (last, last_cursor) = run(scenario)
+    assert ranks(middle) == list(range(1, 11)) + list(range(21, 31))
+    assert middle_cursor == 31
+    assert ranks(last) == list(range(21, 36)) and last_cursor is None
+
+
+def test_deep_search_raises_when_every_page_fails(search_api):
+    search_api(failing_starts={1, 11})
+
+    async def scenario():
+        with pytest.raises(Exception, match="400"):
+            await deep_search("web", "python", 20, 1)
+
+    run(scenario)
+
+
+def test_search_all_returns_web_results_when_images_time_out(search_api):
+    search_api(image_delay=1.0)
+
+    async def scenario():
+        started = time.monotonic()
+        outcome = await search_all("python", 15, 1, timeout=0.3)
+        return outcome, time.monotonic() - started
+
+    (web, images, cursor, errors), elapsed = run(scenario)
+    assert ranks(web) == list(range(1, 16))
+    assert images == []
+    assert cursor == 16
+    assert errors == {"image": "timed out after 0.3 seconds"}
+    assert elapsed < 0.9
+
+
+def test_search_all_returns_both_sides_in_time(search_api):
+    search_api()
+
+    async def scenario():
+        return await search_all("python", 10, 31, timeout=5)
+
+    web, images, cursor, errors = run(scenario)
+    assert ranks(web) == ranks(images) == list(range(31, 36))
+    # Five results where ten were asked for: the end of the list.
+    assert cursor is None
+    assert errors == {}
+
+
+def test_search_all_raises_when_both_sides_fail(search_api):
+    search_api(failing_starts={1})
+
+    async def scenario():
+        with pytest.raises(RuntimeError, match="both failed"):
+            await search_all("python", 5, 1, timeout=5)
+
+    run(scenario)
@@ -0,0 +1,102 @@
+import asyncio
+
+import expense_service  # noqa: F401  registers the expense intent
+from intent_router import IntentRouter, intent_router, dispatch
+from state import SessionStore, State
+
+
+async def expense_turn(store: SessionStore, conversation_id: str, message: str) -> str:
+    """One chat turn as chat_turn runs it: route, resume a pending flow, dispatch, save the session."""
+    session = await store.get(conversation_id)
+    intent = intent_router.route(message)
+    if session.flow:
+        intent = intent_router.resume(session.flow, message) or intent
+    response = await dispatch(intent, message, session)
+    await store.save(conversation_id, session)
+    return response.message
+
+
+def test_expense_flow_continues_across_turns(tmp_path):
+    async def scenario():
+        store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+        try:
+            assert "expense amount" in await expense_turn(store, "c1", "add expense")
+            assert "category" in await expense_turn(store, "c1", "$1,234.50")
+
+            session = await store.get("c1")
+            assert session.flow == 'expense'
+            assert session.event_creation_stage == 'category'
+            assert session.expense_info == {'amount': 1234.5}
+            # Other conversations have flows of their own.
+            assert (await store.get("c2")).event_creation_stage is None
+        finally:
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_expense_flow_completes_and_clears_the_session(tmp_path):
+    async def scenario():
+        store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+        try:
+            for message in ("add expense", "12.50", "Groceries", "Weekly shopping"):
+                await expense_turn(store, "c1", message)
+            reply = await expense_turn(store, "c1", "10:00am on October 24, 2024")
+
+            assert "$12.50" in reply and "Groceries" in reply and "October 24, 2024" in reply
+            session = await store.get("c1")
+            assert session.is_empty()
+        finally:
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_unparseable_amount_is_asked_again(tmp_path):
+    async def scenario():
+        store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+        try:
+            await expense_turn(store, "c1", "add expense")
+            assert "couldn't understand that amount" in await expense_turn(store, "c1", "a lot")
+            assert (await store.get("c1")).event_creation_stage == 'amount'
+        finally:
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_dispatch_awaits_async_handlers_and_tracks_the_flow():
+    async def scenario():
+        router = IntentRouter()
+
+        async def handle_note(message, state):
+            state.event_creation_stage = None if state.event_creation_stage else 'text'
+            return f"note: {message}"
+
+        router.register('note', ['take a note'], handler=handle_note)
+        state = State()
+        assert await dispatch(router.route("please take a note"), "please take a note", state) == "note: please take a note"
+        assert state.flow == 'note'
+
+        match = router.resume(state.flow, " buy milk ")
+        assert match.name == 'note' and match.args == {"rest": "buy milk"}
+        await dispatch(match, "buy milk", state)
+        assert state.flow is None
+        assert router.resume('unknown', "anything") is None
+
+    asyncio.run(scenario())
+
+
+def test_route_offsets_survive_characters_that_lowercase_to_two():
+    router = IntentRouter()
+    router.register('travel', ['visit İzmir'], args_pattern=r'\s+on\s+(?P<day>\w+)')
+
+    # 'İ'.lower() is two characters; the trigger and arguments must still line up.
+    for message, trigger in [
+        ("Please VISIT İZMIR on Monday", "VISIT İZMIR"),
+        ("please visit izmir on Monday", "visit izmir"),
+        ("İİ visit İzmir on Monday", "visit İzmir"),
+    ]:
+        match = router.route(message)
+        assert match is not None and match.trigger == trigger
+        assert match.args == {"day": "Monday", "rest": "on Monday"}
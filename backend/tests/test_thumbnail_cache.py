@@ -0,0 +1,248 @@
+import asyncio
+import io
+import ipaddress
+import os
+import socket
+import threading
+from unittest import mock
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from PIL import Image
+
+from thumbnail_cache import ThumbnailCache, thumbnail_response
+
+
+def png(width=800, height=600, color="red"):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, "PNG")
+    return output.getvalue()
+
+
+def image_server(images, delay=None):
+    """
+    Serves `images` (path -> bytes) as PNGs, "/redirect/<path>" as a 302 to
+    "/<path>", "/nowhere" as a 302 without a Location and anything else as HTML. Records each request's path and Host
+    header. Requests wait on the `delay` event, if given, before answering.
+    """
+    seen = []
+
+    def respond(method, path, headers, body):
+        seen.append((path, headers.get("Host")))
+        if delay is not None:
+            delay.wait(5)
+        if path.startswith("/redirect/"):
+            return 302, {"Location": path[len("/redirect"):]}, b""
+        if path == "/nowhere":
+            return 302, {}, b""
+        if path in images:
+            return 200, {"Content-Type": "image/png"}, images[path]
+        return 200, {"Content-Type": "text/html"}, b"<html></html>"
+
+    return respond, seen
+
+
+def make_cache(tmp_path, **kwargs):
+    kwargs.setdefault("allow_private_hosts", True)
+    return ThumbnailCache(str(tmp_path / "thumbnails"), max_dimension=64, **kwargs)
+
+
+def run(cache, scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await cache.aclose()
+    return asyncio.run(main())
+
+
+def test_fetches_once_resizes_and_serves_from_disk(serve, tmp_path):
+    respond, seen = image_server({"/a.png": png()})
+    base = serve(respond)
+    cache = make_cache(tmp_path)
+
+    async def scenario():
+        first = await asyncio.gather(*(cache.get(f"{base}/a.png") for _ in range(5)))
+        again = await cache.get(f"{base}/a.png")
+        return first, again
+
+    first, again = run(cache, scenario)
+    assert len(seen) == 1
+    assert {thumbnail.etag for thumbnail in first} == {again.etag}
+    assert again.media_type == "image/webp"
+    with Image.open(io.BytesIO(again.data)) as image:
+        assert max(image.size) == 64
+    assert cache.stats()["hits"] == 1
+
+    # A new instance finds the thumbnail on disk.
+    reopened = make_cache(tmp_path)
+    assert run(reopened, lambda: reopened.get(f"{base}/a.png")).etag == again.etag
+    assert len(seen) == 1
+
+
+def test_follows_redirects_and_rejects_non_images(serve, tmp_path):
+    respond, seen = image_server({"/a.png": png()})
+    base = serve(respond)
+    cache = make_cache(tmp_path)
+
+    async def scenario():
+        redirected = await cache.get(f"{base}/redirect/a.png")
+        with pytest.raises(HTTPException) as not_image:
+            await cache.get(f"{base}/page.html")
+        with pytest.raises(HTTPException) as bad_url:
+            await cache.get("ftp://example.com/a.png")
+        with pytest.raises(HTTPException) as no_location:
+            await cache.get(f"{base}/nowhere")
+        return redirected, not_image.value, bad_url.value, no_location.value
+
+    redirected, not_image, bad_url, no_location = run(cache, scenario)
+    assert redirected.media_type == "image/webp"
+    assert [path for path, _ in seen] == ["/redirect/a.png", "/a.png", "/page.html", "/nowhere"]
+    assert not_image.status_code == 502
+    assert bad_url.status_code == 400
+    assert no_location.status_code == 502
+
+
+def test_oversized_sources_are_rejected(serve, tmp_path):
+    respond, _ = image_server({"/big.png": os.urandom(64 * 1024)})
+    base = serve(respond)
+    cache = make_cache(tmp_path, max_source_bytes=16 * 1024)
+
+    async def scenario():
+        with pytest.raises(HTTPException) as error:
+            await cache.get(f"{base}/big.png")
+        return error.value
+
+    assert "too large" in run(cache, scenario).detail
+    assert cache.stats()["fetch_failures"] == 1
+
+
+def test_least_recently_used_thumbnails_are_evicted(serve, tmp_path):
+    images = {f"/{i}.png": png(color=(i * 40, 255 - i * 40, i * 20)) for i in range(6)}
+    respond, seen = image_server(images)
+    base = serve(respond)
+    cache = make_cache(tmp_path)
+
+    async def scenario():
+        sizes = [len((await cache.get(f"{base}/{i}.png")).data) for i in range(3)]
+        # Room for the three largest; each new one then pushes out the least recently used.
+        cache.max_bytes = sum(sorted(sizes)[-3:])
+        await cache.get(f"{base}/0.png")
+        for i in range(3, 5):
+            await cache.get(f"{base}/{i}.png")
+        seen.clear()
+        for i in (0, 4):
+            await cache.get(f"{base}/{i}.png")
+
+    run(cache, scenario)
+    assert seen == []  # 0 was used recently, 4 is the newest; both still on disk
+    stats = cache.stats()
+    assert stats["evictions"] >= 2 and stats["bytes"] <= cache.max_bytes
+    assert len(os.listdir(tmp_path / "thumbnails")) == stats["entries"]
+
+
+def test_private_hosts_are_refused(serve, tmp_path):
+    respond, seen = image_server({"/a.png": png()})
+    base = serve(respond)
+    cache = make_cache(tmp_path, allow_private_hosts=False)
+
+    async def scenario():
+        with pytest.raises(HTTPException) as error:
+            await cache.get(f"{base}/a.png")
+        return error.value
+
+    assert run(cache, scenario).status_code == 403
+    assert seen == []
+
+
+def test_connects_to_the_address_that_was_checked(serve, tmp_path):
+    respond, seen = image_server({"/a.png": png()})
+    port = int(serve(respond).rsplit(":", 1)[1])
+    cache = make_cache(tmp_path, allow_private_hosts=False)
+    lookups = []
+
+    async def getaddrinfo(host, *args, **kwargs):
+        lookups.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        # images.test resolves to an address treated as public, once per hop;
+        # httpx never resolves the name itself, it connects to that address.
+        with mock.patch.object(loop, "getaddrinfo", getaddrinfo), \
+                mock.patch.object(ipaddress.IPv4Address, "is_global", property(lambda self: True)):
+            return await cache.get(f"http://images.test:{port}/redirect/a.png")
+
+    assert run(cache, scenario).media_type == "image/webp"
+    assert lookups == ["images.test", "images.test"]
+    assert seen == [("/redirect/a.png", f"images.test:{port}"), ("/a.png", f"images.test:{port}")]
+
+
+def test_host_is_checked_on_the_scheme_default_port(tmp_path):
+    cache = make_cache(tmp_path, allow_private_hosts=False)
+    lookups = []
+
+    async def getaddrinfo(host, port, **kwargs):
+        lookups.append((host, port))
+        raise socket.gaierror("not found")
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        with mock.patch.object(loop, "getaddrinfo", getaddrinfo):
+            for url in ("http://images.test/a.png", "https://images.test/a.png", "http://images.test:8080/a.png"):
+                with pytest.raises(HTTPException) as error:
+                    await cache.get(url)
+                assert error.value.status_code == 502
+
+    run(cache, scenario)
+    assert lookups == [("images.test", 80), ("images.test", 443), ("images.test", 8080)]
+
+
+def test_cancelled_request_does_not_fail_the_others(serve, tmp_path):
+    release = threading.Event()
+    respond, seen = image_server({"/a.png": png()}, delay=release)
+    base = serve(respond)
+    cache = make_cache(tmp_path)
+
+    async def scenario():
+        first = asyncio.create_task(cache.get(f"{base}/a.png"))
+        await asyncio.sleep(0.1)
+        second = asyncio.create_task(cache.get(f"{base}/a.png"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert run(cache, scenario).media_type == "image/webp"
+    assert len(seen) == 1
+
+
+def test_endpoint_revalidates_with_etags(serve, tmp_path):
+    respond, seen = image_server({"/a.png": png()})
+    base = serve(respond)
+    cache = make_cache(tmp_path)
+    app = FastAPI()
+
+    @app.get("/api/thumb")
+    async def thumb(url: str, request: Request):
+        return thumbnail_response(await cache.get(url), request.headers.get("if-none-match"))
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            first = await client.get("/api/thumb", params={"url": f"{base}/a.png"})
+            etag = first.headers["ETag"]
+            revalidated = await client.get("/api/thumb", params={"url": f"{base}/a.png"}, headers={"If-None-Match": f'"other", {etag}'})
+            changed = await client.get("/api/thumb", params={"url": f"{base}/a.png"}, headers={"If-None-Match": '"other"'})
+            return first, revalidated, changed
+
+    first, revalidated, changed = run(cache, scenario)
+    assert first.status_code == 200
+    assert first.headers["Content-Type"] == "image/webp"
+    assert first.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert revalidated.status_code == 304 and revalidated.content == b""
+    assert revalidated.headers["ETag"] == first.headers["ETag"]
+    assert changed.status_code == 200 and changed.content == first.content
+    assert len(seen) == 1
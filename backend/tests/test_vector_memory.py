@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+
+import numpy as np
+
+from llm_scheduler import BACKGROUND
+from vector_memory import VectorMemory
+
+DIM = 256
+
+
+class FakeEmbedder:
+    """Gives every text a fixed random vector, so a stored text is its own best match."""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.priorities = []
+
+    async def embed(self, texts, priority=0):
+        self.calls += 1
+        self.priorities.append(priority)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("embedding model is down")
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], "little")
+            vectors.append(np.random.default_rng(seed).standard_normal(DIM).tolist())
+        return vectors
+
+
+def make_memory(tmp_path, embedder, **kwargs):
+    return VectorMemory(str(tmp_path / "memory"), embedder, dim=DIM, min_score=0.5, **kwargs)
+
+
+def test_two_stage_recall_finds_the_same_messages_as_an_exact_scan(tmp_path):
+    async def scenario():
+        embedder = FakeEmbedder()
+        two_stage = make_memory(tmp_path, embedder, exact_search_rows=50, rerank_candidates=20)
+        try:
+            for i in range(400):
+                await two_stage.add("alice", f"c{i % 7}", "user", f"message number {i}")
+            assert two_stage._partitions["alice"].count > two_stage.exact_search_rows
+
+            for i in (0, 123, 399):
+                hits = await two_stage.recall("alice", f"message number {i}", k=3)
+                assert [hit.content for hit in hits] == [f"message number {i}"]
+                assert hits[0].conversation_id == f"c{i % 7}"
+                assert abs(hits[0].score - 1.0) < 1e-4
+        finally:
+            await two_stage.close()
+
+        # The same rows scanned exactly, after a reopen from disk.
+        exact = make_memory(tmp_path, embedder, exact_search_rows=10_000)
+        try:
+            hits = await exact.recall("alice", "message number 123", k=3)
+            assert [hit.content for hit in hits] == ["message number 123"]
+        finally:
+            await exact.close()
+
+    asyncio.run(scenario())
+
+
+def test_coarse_matrix_is_rebuilt_when_coarse_dim_changes(tmp_path):
+    async def scenario():
+        embedder = FakeEmbedder()
+        memory = make_memory(tmp_path, embedder, coarse_dim=64)
+        try:
+            for i in range(100):
+                await memory.add("alice", "c1", "user", f"message number {i}")
+        finally:
+            await memory.close()
+
+        memory = make_memory(tmp_path, embedder, coarse_dim=16, exact_search_rows=10, rerank_candidates=10)
+        try:
+            embedder.priorities.clear()
+            hits = await memory.recall("alice", "message number 42", k=1)
+            assert [hit.content for hit in hits] == ["message number 42"]
+            # Recall must not compete with chat generation for scheduler slots.
+            assert embedder.priorities == [BACKGROUND]
+        finally:
+            await memory.close()
+
+    asyncio.run(scenario())
+
+
+def test_owners_only_recall_their_own_messages(tmp_path):
+    async def scenario():
+        memory = make_memory(tmp_path, FakeEmbedder())
+        try:
+            await memory.add("alice", "c1", "user", "my cat is called Tom")
+            assert await memory.recall("bob", "my cat is called Tom") == []
+            assert await memory.recall(None, "my cat is called Tom") == []
+        finally:
+            await memory.close()
+
+    asyncio.run(scenario())
+
+
+def test_recall_gives_up_after_the_timeout(tmp_path):
+    async def scenario():
+        embedder = FakeEmbedder()
+        memory = make_memory(tmp_path, embedder, recall_timeout=0.05)
+        try:
+            await memory.add("alice", "c1", "user", "remember this")
+            embedder.delay = 5
+            started = asyncio.get_running_loop().time()
+            assert await memory.recall("alice", "something new") == []
+            assert asyncio.get_running_loop().time() - started < 1
+            assert memory.stats()["recall_timeouts"] == 1
+        finally:
+            await memory.close()
+
+    asyncio.run(scenario())
+
+
+def test_recall_survives_embedding_failures(tmp_path):
+    async def scenario():
+        embedder = FakeEmbedder()
+        memory = make_memory(tmp_path, embedder)
+        try:
+            await memory.add("alice", "c1", "user", "remember this")
+            embedder.fail = True
+            assert await memory.recall("alice", "something new") == []
+        finally:
+            await memory.close()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_adds_survive_partition_eviction(tmp_path):
+    async def scenario():
+        # One open partition for three owners, so nearly every add evicts another owner's.
+        memory = make_memory(tmp_path, FakeEmbedder(delay=0.001), max_partitions=1)
+        owners = ["alice", "bob", "carol"]
+        try:
+            await asyncio.gather(*(
+                memory.add(owner, "c1", "user", f"{owner} message {i}")
+                for i in range(20)
+                for owner in owners
+            ))
+            for owner in owners:
+                for i in (0, 19):
+                    hits = await memory.recall(owner, f"{owner} message {i}", k=1)
+                    assert [hit.content for hit in hits] == [f"{owner} message {i}"]
+            db = await memory._get_db()
+            async with db.execute("SELECT owner, COUNT(*), MAX(row) FROM memory_rows GROUP BY owner") as cursor:
+                assert sorted(await cursor.fetchall()) == [(owner, 20, 19) for owner in owners]
+        finally:
+            await memory.close()
+
+    asyncio.run(scenario())
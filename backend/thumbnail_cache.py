@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import socket
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, NamedTuple, Tuple
+
+import httpx
+from fastapi import HTTPException, Response
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # listed in requirements.txt; without it the proxy refuses to serve
+    Image = None
+
+MEDIA_TYPES = {"webp": "image/webp", "jpg": "image/jpeg", "png": "image/png", "gif": "image/gif"}
+EXTENSIONS = {media_type: extension for extension, media_type in MEDIA_TYPES.items()}
+MAX_REDIRECTS = 3
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class Thumbnail(NamedTuple):
+    data: bytes
+    etag: str
+    media_type: str
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def resize_image(data: bytes, max_dimension: int, quality: int) -> Tuple[bytes, str]:
+    """Shrink an image to fit in a `max_dimension` square and re-encode it as WebP."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.seek(0)  # first frame of animations
+        image.thumbnail((max_dimension, max_dimension))
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        output = io.BytesIO()
+        image.save(output, format="WEBP", quality=quality, method=4)
+    return output.getvalue(), "image/webp"
+
+
+def thumbnail_response(thumbnail: Thumbnail, if_none_match: Optional[str] = None) -> Response:
+    """
+    The HTTP response for a thumbnail. The entity tag is a hash of the bytes,
+    so clients can keep the image for a year and revalidate with
+    If-None-Match, which gets a bodiless 304 when it matches.
+    """
+    headers = {
+        "ETag": thumbnail.etag,
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    tags = [tag.strip() for tag in (if_none_match or "").split(",")]
+    if thumbnail.etag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+    return Response(content=thumbnail.data, media_type=thumbnail.media_type, headers=headers)
+
+
+class ThumbnailCache:
+    """
+    Proxy for third-party image thumbnails, backed by a size-capped LRU on disk.
+
+    Each URL is fetched once, shrunk to fit a `max_dimension` square and
+    re-encoded as WebP, then stored under the SHA-256 of the URL. The file name also carries the
+    hash of the stored bytes, which is the entity tag, so the index can be
+    rebuilt from a directory listing. Once the files exceed `max_bytes` the
+    least recently used ones are deleted. Concurrent requests for the same
+    URL share one fetch, which carries on if the request that started it is
+    cancelled.
+
+    Only public http(s) hosts are fetched unless `allow_private_hosts` is set,
+    so the proxy cannot be used to reach the internal network.
+    """
+
+    def __init__(
+            self,
+            directory: str = 'thumbnails',
+            max_bytes: int = 256 * 1024 * 1024,
+            max_dimension: int = 256,
+            quality: int = 70,
+            max_source_bytes: int = 5 * 1024 * 1024,
+            fetch_timeout: float = 10.0,
+            allow_private_hosts: bool = False
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.max_source_bytes = max_source_bytes
+        self.fetch_timeout = fetch_timeout
+        self.allow_private_hosts = allow_private_hosts
+        self._client: Optional[httpx.AsyncClient] = None
+        # key -> (file name, size), least recently used first
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._in_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fetch_failures = 0
+        if Image is None:
+            logger.error("Pillow is not installed: the thumbnail proxy will answer 503 until it is (pip install -r requirements.txt)")
+
+    def _scan(self) -> List[Tuple[float, str, str, int]]:
+        """The files already on disk as (mtime, key, name, size), oldest access first."""
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            key, _, rest = entry.name.partition("-")
+            if entry.is_file() and rest and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, key, entry.name, stat.st_size))
+        return sorted(files)
+
+    async def _load(self) -> None:
+        files = await asyncio.to_thread(self._scan)
+        if self._loaded:  # another request got here first
+            return
+        for _, key, name, size in files:
+            self._entries[key] = (name, size)
+            self._total_bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.fetch_timeout, headers={"Accept": "image/*"})
+        return self._client
+
+    async def aclose(self) -> None:
+        await self._in_flight.cancel_all()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(self, url: str) -> Thumbnail:
+        """The thumbnail for `url`, from disk or freshly fetched. Raises HTTPException."""
+        if Image is None:
+            # Never fall back to proxying full-size originals.
+            raise HTTPException(status_code=503, detail="Thumbnail proxy is unavailable: Pillow is not installed")
+        if not self._loaded:
+            await self._load()
+        key = url_key(url)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            try:
+                thumbnail = await asyncio.to_thread(self._read, entry[0])
+            except FileNotFoundError:
+                self._forget(key)
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return thumbnail
+
+        if key not in self._in_flight:
+            self.misses += 1
+
+        async def fetch_and_store():
+            thumbnail = await self._fetch(url)
+            name = await asyncio.to_thread(self._write, key, thumbnail)
+            self._add(key, name, len(thumbnail.data))
+            return thumbnail
+
+        return await self._in_flight.run(key, fetch_and_store)
+
+    async def _pin(self, url: httpx.URL) -> Tuple[httpx.URL, Dict[str, str], Dict[str, Any]]:
+        """
+        Check that `url` is a public http(s) URL and return the request to make
+        for it: the URL with its host replaced by the address that was checked,
+        plus the Host header and TLS server name of the original host. Connecting
+        to the checked address, rather than resolving the name again, stops a
+        DNS answer that changes in between (rebinding) from reaching a private
+        address.
+        """
+        if url.scheme not in ("http", "https") or not url.host:
+            raise HTTPException(status_code=400, detail="Thumbnail URL must be an absolute http(s) URL")
+        if self.allow_private_hosts:
+            return url, {}, {}
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                url.host, url.port or DEFAULT_PORTS[url.scheme], type=socket.SOCK_STREAM
+            )
+        except socket.gaierror:
+            raise HTTPException(status_code=502, detail=f"Could not resolve {url.host}")
+        ips = [ipaddress.ip_address(address[4][0]) for address in addresses]
+        if not ips or any(not ip.is_global for ip in ips):
+            raise HTTPException(status_code=403, detail=f"Refusing to fetch thumbnails from {url.host}")
+        extensions = {"sni_hostname": url.host} if url.scheme == "https" else {}
+        return url.copy_with(host=str(ips[0])), {"Host": url.netloc.decode("ascii")}, extensions
+
+    async def _download(self, url: str) -> Tuple[bytes, str]:
+        try:
+            target = httpx.URL(url)
+        except httpx.InvalidURL:
+            raise HTTPException(status_code=400, detail="Thumbnail URL must be an absolute http(s) URL")
+        # Redirects are followed by hand so every hop is checked and pinned.
+        for _ in range(MAX_REDIRECTS + 1):
+            pinned, headers, extensions = await self._pin(target)
+            async with self._get_client().stream("GET", pinned, headers=headers, extensions=extensions) as response:
+                if response.is_redirect:
+                    try:
+                        target = target.join(response.headers["Location"])
+                    except (KeyError, httpx.InvalidURL):
+                        raise HTTPException(status_code=502, detail="Thumbnail host sent a redirect without a valid Location")
+                    continue
+                if response.status_code != 200:
+                    raise HTTPException(status_code=502, detail=f"Thumbnail host returned {response.status_code}")
+                media_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if not media_type.startswith("image/"):
+                    raise HTTPException(status_code=502, detail=f"Thumbnail URL returned {media_type or 'no content type'}, not an image")
+                chunks, size = [], 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > self.max_source_bytes:
+                        raise HTTPException(status_code=502, detail="Thumbnail is too large")
+                    chunks.append(chunk)
+                return b"".join(chunks), media_type
+        raise HTTPException(status_code=502, detail="Too many redirects fetching thumbnail")
+
+    async def _fetch(self, url: str) -> Thumbnail:
+        try:
+            data, media_type = await self._download(url)
+        except HTTPException:
+            self.fetch_failures += 1
+            raise
+        except httpx.HTTPError as e:
+            self.fetch_failures += 1
+            raise HTTPException(status_code=502, detail=f"Could not fetch thumbnail: {e}")
+
+        try:
+            data, media_type = await asyncio.to_thread(resize_image, data, self.max_dimension, self.quality)
+        except Exception as e:
+            self.fetch_failures += 1
+            raise HTTPException(status_code=502, detail=f"Could not decode thumbnail: {e}")
+        return Thumbnail(data, f'"{hashlib.sha256(data).hexdigest()[:32]}"', media_type)
+
+    def _read(self, name: str) -> Thumbnail:
+        path = os.path.join(self.directory, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # access order survives a restart
+        digest, _, extension = name.partition("-")[2].partition(".")
+        return Thumbnail(data, f'"{digest}"', MEDIA_TYPES.get(extension, "application/octet-stream"))
+
+    def _write(self, key: str, thumbnail: Thumbnail) -> str:
+        name = f"{key}-{thumbnail.etag.strip(chr(34))}.{EXTENSIONS[thumbnail.media_type]}"
+        path = os.path.join(self.directory, name)
+        # Write then rename, so a crash never leaves a truncated thumbnail behind.
+        with open(path + ".tmp", "wb") as f:
+            f.write(thumbnail.data)
+        os.replace(path + ".tmp", path)
+        return name
+
+    def _add(self, key: str, name: str, size: int) -> None:
+        previous = self._entries.get(key)
+        if previous is not None and previous[0] != name:
+            # The image behind the URL changed since it was last cached.
+            self._remove_file(previous[0])
+        self._forget(key)
+        self._entries[key] = (name, size)
+        self._total_bytes += size
+        self._evict()
+
+    def _remove_file(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _evict(self) -> None:
+        while self._entries and self._total_bytes > self.max_bytes:
+            key, (name, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            self._remove_file(name)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "fetch_failures": self.fetch_failures,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
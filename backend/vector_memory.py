@@ -0,0 +1,375 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, NamedTuple
+
+import aiosqlite
+import numpy as np
+
+from llm_scheduler import INTERACTIVE, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores, in no particular order."""
+    if k >= scores.shape[0]:
+        return np.arange(scores.shape[0])
+    return np.argpartition(scores, -k)[-k:]
+
+
+class MemoryHit(NamedTuple):
+    conversation_id: str
+    role: str
+    content: str
+    score: float
+
+
+class OllamaEmbedder:
+    """Embeds text with an Ollama embedding model through the LLM service."""
+
+    def __init__(self, llm_service, model: str = "nomic-embed-text"):
+        self.llm_service = llm_service
+        self.model = model
+
+    async def embed(self, texts: List[str], priority: int = INTERACTIVE) -> List[List[float]]:
+        return await self.llm_service.embed(texts, model=self.model, priority=priority)
+
+
+class HashingEmbedder:
+    """
+    Offline stand-in for an embedding model, for tests and development.
+
+    Words are hashed into signed buckets, so texts sharing words get similar
+    vectors. It needs no Ollama server and always returns the same vector for
+    the same text.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    async def embed(self, texts: List[str], priority: int = INTERACTIVE) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for word in re.findall(r'\w+', text.lower()):
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+            vectors.append(vector.tolist())
+        return vectors
+
+
+class _Matrix:
+    """A growable, contiguous float32 matrix in a memory-mapped file."""
+
+    def __init__(self, path: str, dim: int, min_capacity: int = 0):
+        self.path = path
+        self.dim = dim
+        self.matrix: Optional[np.memmap] = None
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._map(max(size // (4 * dim), min_capacity))
+
+    def _map(self, capacity: int) -> None:
+        if capacity == 0:
+            self.matrix = None
+            return
+        with open(self.path, "ab") as f:
+            if f.tell() < capacity * self.dim * 4:
+                f.truncate(capacity * self.dim * 4)
+        self.matrix = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    def put(self, row: int, vector: np.ndarray) -> None:
+        if row >= self.capacity:
+            # Grow geometrically so appends stay amortized O(1). A search
+            # running in a worker thread keeps using the old mapping, which
+            # stays valid because the file only ever grows.
+            self._map(max(1024, self.capacity * 2, row + 1))
+        self.matrix[row] = vector
+
+    def flush(self) -> None:
+        if self.matrix is not None:
+            self.matrix.flush()
+
+
+class _Partition:
+    """
+    One owner's vectors, as a full matrix plus a coarse matrix holding only
+    the first `coarse_dim` dimensions of each row, renormalized.
+    """
+
+    def __init__(self, path: str, dim: int, coarse_dim: int, count: int):
+        self.count = count
+        # Held from appending a row until it is in SQLite; a locked partition is never evicted.
+        self.lock = asyncio.Lock()
+        self.full = _Matrix(f"{path}.f32", dim, count)
+        self.coarse = None
+        if coarse_dim:
+            coarse_path = f"{path}.c{coarse_dim}.f32"
+            rebuild = count > 0 and not os.path.exists(coarse_path)
+            self.coarse = _Matrix(coarse_path, coarse_dim, count)
+            if rebuild:
+                # The rows were stored with another coarse_dim; derive this one from the full vectors.
+                for start in range(0, count, 65536):
+                    block = np.asarray(self.full.matrix[start:min(count, start + 65536), :coarse_dim])
+                    norms = np.linalg.norm(block, axis=1, keepdims=True)
+                    self.coarse.matrix[start:start + len(block)] = block / np.where(norms > 0, norms, 1)
+
+    def append(self, vector: np.ndarray, coarse_vector: Optional[np.ndarray]) -> int:
+        row = self.count
+        self.full.put(row, vector)
+        if self.coarse is not None:
+            self.coarse.put(row, coarse_vector)
+        self.count += 1
+        return row
+
+    def flush(self) -> None:
+        self.full.flush()
+        if self.coarse is not None:
+            self.coarse.flush()
+
+
+class VectorMemory:
+    """
+    Long-term memory of past chat turns, searched by meaning.
+
+    Every stored message is embedded and appended to its owner's matrix, a
+    contiguous float32 array in a memory-mapped file under `directory`, while
+    the message text lives in SQLite next to it. Vectors are truncated to
+    `dim` dimensions (Matryoshka-trained models such as nomic-embed-text keep
+    most of their quality at 256) and L2-normalized, so recall is a
+    matrix-vector product over the owner's rows followed by a partial sort.
+    Keeping each owner's rows contiguous means a search only reads that
+    owner's vectors, however many other users there are.
+
+    Past `exact_search_rows` rows the scan is done in two stages: the leading
+    `coarse_dim` dimensions of every row (a valid, smaller embedding for
+    Matryoshka models) pick `rerank_candidates` rows, which are then rescored
+    with the full vectors. That reads an eighth of the data at the default
+    sizes, at the price of an approximate top-k; the generous candidate pool
+    makes up for most of what the short prefix misses, and rescoring it is
+    cheap. A partition opened with a new `coarse_dim` rebuilds its coarse
+    matrix from the full one.
+
+    Recall runs on the request path, so it gives up after `recall_timeout`
+    seconds (a busy or unreachable embedding model, say) and the turn goes
+    on without memories.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            embedder,
+            dim: int = 256,
+            coarse_dim: int = 32,
+            exact_search_rows: int = 20000,
+            rerank_candidates: int = 500,
+            min_score: float = 0.35,
+            max_excerpt_chars: int = 500,
+            max_partitions: int = 256,
+            recall_timeout: Optional[float] = 1.5
+    ):
+        self.directory = directory
+        self.embedder = embedder
+        self.dim = dim
+        self.coarse_dim = coarse_dim if 0 < coarse_dim < dim else 0
+        self.exact_search_rows = exact_search_rows
+        self.rerank_candidates = rerank_candidates
+        self.min_score = min_score
+        self.max_excerpt_chars = max_excerpt_chars
+        self.max_partitions = max_partitions
+        self.recall_timeout = recall_timeout
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self._partitions: "OrderedDict[str, _Partition]" = OrderedDict()
+        # The user's message is recalled against and then remembered, so keep
+        # its vector around instead of embedding it twice.
+        self._recent_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: set = set()
+        self.stored = 0
+        self.searches = 0
+        self.recall_timeouts = 0
+
+    async def _get_db(self) -> aiosqlite.Connection:
+        async with self._db_lock:
+            if self._db is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._db = await aiosqlite.connect(os.path.join(self.directory, "memory.db"))
+                await self._db.execute("PRAGMA journal_mode = WAL")
+                await self._db.execute("PRAGMA synchronous = NORMAL")
+                await self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS memory_rows (
+                        owner TEXT,
+                        row INTEGER,
+                        conversation_id TEXT,
+                        role TEXT,
+                        content TEXT,
+                        PRIMARY KEY (owner, row)
+                    )
+                """)
+                await self._db.commit()
+        return self._db
+
+    async def _partition(self, owner: str) -> _Partition:
+        partition = self._partitions.get(owner)
+        if partition is None:
+            db = await self._get_db()
+            async with db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM memory_rows WHERE owner = ?", (owner,)) as cursor:
+                count = (await cursor.fetchone())[0]
+            # Another call may have opened it while we were waiting on SQLite.
+            partition = self._partitions.get(owner)
+            if partition is None:
+                name = hashlib.sha256(owner.encode("utf-8")).hexdigest()[:32]
+                partition = _Partition(os.path.join(self.directory, name), self.dim, self.coarse_dim, count)
+                self._partitions[owner] = partition
+                self._evict(keep=owner)
+        self._partitions.move_to_end(owner)
+        return partition
+
+    def _evict(self, keep: str) -> None:
+        """Close least recently used partitions past `max_partitions`, except `keep` and any with an add in progress."""
+        for owner in list(self._partitions):
+            if len(self._partitions) <= self.max_partitions:
+                break
+            partition = self._partitions[owner]
+            if owner != keep and not partition.lock.locked():
+                del self._partitions[owner]
+                partition.flush()
+
+    async def _vector(self, text: str, priority: int) -> np.ndarray:
+        vector = self._recent_vectors.get(text)
+        if vector is None:
+            raw = np.asarray((await self.embedder.embed([text], priority=priority))[0], dtype=np.float32)
+            if raw.shape[0] < self.dim:
+                raise ValueError(f"Embedding has {raw.shape[0]} dimensions, memory expects at least {self.dim}")
+            vector = _normalize(raw[:self.dim])
+            self._recent_vectors[text] = vector
+            while len(self._recent_vectors) > 64:
+                self._recent_vectors.popitem(last=False)
+        return vector
+
+    async def add(self, owner: str, conversation_id: str, role: str, content: str) -> None:
+        if not content.strip():
+            return
+        vector = await self._vector(content, BACKGROUND)
+        db = await self._get_db()
+        while True:
+            partition = await self._partition(owner)
+            async with partition.lock:
+                if self._partitions.get(owner) is not partition:
+                    # Evicted while waiting for the lock; reopen it from what SQLite holds now.
+                    continue
+                row = partition.append(vector, _normalize(vector[:self.coarse_dim]) if self.coarse_dim else None)
+                await db.execute(
+                    "INSERT OR REPLACE INTO memory_rows (owner, row, conversation_id, role, content) VALUES (?, ?, ?, ?, ?)",
+                    (owner, row, conversation_id, role, content)
+                )
+                await db.commit()
+            break
+        self.stored += 1
+
+    def remember(self, owner: str, conversation_id: str, role: str, content: str) -> None:
+        """Embed and store a message in the background; failures are only logged."""
+        async def run():
+            try:
+                await self.add(owner, conversation_id, role, content)
+            except Exception as e:
+                logger.warning(f"Could not add message to vector memory: {e}")
+
+        task = asyncio.create_task(run())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def search(self, owner: str, query: str, k: int = 5, priority: int = INTERACTIVE) -> List[MemoryHit]:
+        """Return up to `k` of the owner's stored messages closest to `query`; `priority` is the embedding call's."""
+        if not query.strip():
+            return []
+        partition = await self._partition(owner)
+        count = partition.count
+        if count == 0:
+            return []
+        query_vector = await self._vector(query, priority)
+        full = partition.full.matrix
+        coarse = partition.coarse.matrix if partition.coarse is not None and count > self.exact_search_rows else None
+
+        def top_rows():
+            if coarse is not None:
+                coarse_scores = coarse[:count] @ _normalize(query_vector[:self.coarse_dim])
+                candidates = _top(coarse_scores, max(self.rerank_candidates, k))
+                scores = full[candidates] @ query_vector
+            else:
+                candidates = None
+                scores = full[:count] @ query_vector
+            best = _top(scores, k)
+            best = best[np.argsort(-scores[best])]
+            rows = candidates[best] if candidates is not None else best
+            return [(int(row), float(score)) for row, score in zip(rows, scores[best]) if score >= self.min_score]
+
+        # numpy releases the GIL for the product, so other requests keep running.
+        ranked = await asyncio.to_thread(top_rows)
+        self.searches += 1
+        if not ranked:
+            return []
+
+        db = await self._get_db()
+        placeholders = ",".join("?" * len(ranked))
+        async with db.execute(
+            f"SELECT row, conversation_id, role, content FROM memory_rows WHERE owner = ? AND row IN ({placeholders})",
+            [owner] + [row for row, _ in ranked]
+        ) as cursor:
+            rows = {row[0]: row[1:] for row in await cursor.fetchall()}
+
+        return [
+            MemoryHit(rows[row][0], rows[row][1], rows[row][2][:self.max_excerpt_chars], score)
+            for row, score in ranked
+            if row in rows
+        ]
+
+    async def recall(self, owner: Optional[str], query: str, k: int = 5) -> List[MemoryHit]:
+        """
+        Like `search`, but returns nothing instead of raising when embedding
+        fails or times out. The query is embedded at BACKGROUND priority, so it
+        never holds a slot the chat generation it feeds is waiting for.
+        """
+        if not owner:
+            return []
+        try:
+            return await asyncio.wait_for(self.search(owner, query, k, BACKGROUND), timeout=self.recall_timeout)
+        except asyncio.TimeoutError:
+            self.recall_timeouts += 1
+            logger.warning(f"Vector memory recall took longer than {self.recall_timeout}s, skipping it")
+            return []
+        except Exception as e:
+            logger.warning(f"Vector memory recall failed: {e}")
+            return []
+
+    async def close(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        for partition in self._partitions.values():
+            partition.flush()
+        self._partitions.clear()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "partitions_open": len(self._partitions),
+            "stored": self.stored,
+            "searches": self.searches,
+            "recall_timeouts": self.recall_timeouts,
+            "pending": len(self._pending)
+        }
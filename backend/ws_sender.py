@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Dict, Any, Optional, Union, Callable
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it every frame is JSON text
+    msgpack = None
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+
+class WebSocketSender:
+    """
+    Bounded outbound queue for one WebSocket, drained by its own writer task.
+
+    `send` never waits on the network, so a slow client only ever stalls its
+    own writer, never the coroutine producing messages. When the queue holds
+    `max_queue` frames the overflow policy applies: DROP_OLDEST discards the
+    oldest queued frame (chat clients recover from lost tokens through the
+    full message in "chat_done"), DISCONNECT closes the connection.
+
+    With `binary` set (the client asked for msgpack), JSON payloads larger than
+    `binary_min_bytes` go out as msgpack binary frames; smaller ones stay text.
+    """
+
+    def __init__(
+            self,
+            websocket: WebSocket,
+            max_queue: int = 256,
+            overflow_policy: str = DROP_OLDEST,
+            binary: bool = False,
+            binary_min_bytes: int = 4096,
+            on_overflow_disconnect: Optional[Callable[[], None]] = None
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy!r}, expected one of {OVERFLOW_POLICIES}")
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.binary = binary and msgpack is not None
+        self.binary_min_bytes = binary_min_bytes
+        self.on_overflow_disconnect = on_overflow_disconnect
+        self._queue: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.binary_frames_sent = 0
+        self.frames_dropped = 0
+        self.max_depth_seen = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._queue.clear()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def send(self, message: Union[str, Dict[str, Any]], bypass_limit: bool = False) -> bool:
+        """
+        Queue a text message or a JSON-serializable payload; False if it was not queued.
+
+        `bypass_limit` skips the overflow policy, for frames replayed on resume,
+        which are already held in memory by the replay buffer anyway.
+        """
+        if self.closed:
+            return False
+        if isinstance(message, str):
+            frame: Union[str, bytes] = message
+        else:
+            frame = json.dumps(message)
+            if self.binary and len(frame) >= self.binary_min_bytes:
+                frame = msgpack.packb(message, use_bin_type=True)
+
+        if len(self._queue) >= self.max_queue and not bypass_limit:
+            if self.overflow_policy == DISCONNECT:
+                logger.warning(f"Send queue full ({self.max_queue} frames), disconnecting slow client")
+                self.closed = True
+                self._queue.clear()
+                self._wakeup.set()
+                if self.on_overflow_disconnect is not None:
+                    self.on_overflow_disconnect()
+                return False
+            self._queue.popleft()
+            self.frames_dropped += 1
+
+        self._queue.append(frame)
+        self.max_depth_seen = max(self.max_depth_seen, len(self._queue))
+        self._wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._queue:
+                    frame = self._queue.popleft()
+                    if isinstance(frame, bytes):
+                        await self.websocket.send_bytes(frame)
+                        self.binary_frames_sent += 1
+                    else:
+                        await self.websocket.send_text(frame)
+                    self.frames_sent += 1
+                    self.bytes_sent += len(frame)
+                if self.closed:
+                    # Overflow under the DISCONNECT policy; 1013 is "try again later".
+                    await self.websocket.close(code=1013)
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The socket is gone; the receive loop will notice and clean up.
+            self.closed = True
+            self._queue.clear()
+            logger.info(f"Stopped sending to WebSocket: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._queue),
+            "max_depth_seen": self.max_depth_seen,
+            "frames_sent": self.frames_sent,
+            "binary_frames_sent": self.binary_frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_dropped": self.frames_dropped
+        }
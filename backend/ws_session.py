@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ClientSession:
+    """
+    Server-side state of one WebSocket client that outlives its connections.
+
+    Every frame sent to the client is stamped with the next sequence number
+    and kept in a ring buffer of the last `max_frames` frames, so a client
+    that reconnects with the last sequence it saw can be sent exactly the
+    frames it missed. The turn lock lives here too, so turns stay in order
+    across reconnects.
+    """
+
+    def __init__(self, client_id: str, max_frames: int = 1024):
+        self.client_id = client_id
+        self.seq = 0
+        self.frames: deque = deque(maxlen=max_frames)
+        self.turn_lock = asyncio.Lock()
+        self.connected = False
+        self._timers: List[asyncio.TimerHandle] = []
+
+    def record(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Stamp `message` with the next sequence number and buffer it for replay."""
+        self.seq += 1
+        frame = dict(message, seq=self.seq)
+        self.frames.append(frame)
+        return frame
+
+    def frames_after(self, last_seq: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Frames the client has not seen yet, or None when they can no longer
+        all be replayed (they fell out of the buffer, or `last_seq` is from
+        before a server restart).
+        """
+        if last_seq > self.seq:
+            return None
+        if last_seq == self.seq:
+            return []
+        if not self.frames or self.frames[0]["seq"] > last_seq + 1:
+            return None
+        return [frame for frame in self.frames if frame["seq"] > last_seq]
+
+    def attach(self) -> None:
+        self.connected = True
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+
+    def detach(self) -> None:
+        self.connected = False
+
+    def call_later(self, delay: float, callback) -> None:
+        """Run `callback` after `delay` seconds unless the client reattaches first."""
+        self._timers.append(asyncio.get_running_loop().call_later(delay, callback))